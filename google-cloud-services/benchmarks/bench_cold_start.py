@@ -0,0 +1,103 @@
+"""Benchmark: import-to-first-request time of the Gemini services (Cloud Run cold start).
+
+Usage:
+    python benchmarks/bench_cold_start.py [--services concept-chunker concept-structurer learning-goals-generation]
+                                          [--repeat 5]
+
+Each run starts a fresh interpreter, as a new Cloud Run instance would, and
+measures:
+
+    import   python start to `import main` returning (the port can open here)
+    first    the first request through Flask's test client (GET /, the health check)
+    clients  creating the Supabase, GCS and Gemini clients on first use
+
+in two modes: "eager" creates the clients before importing the service, which
+is what the services did at import time before gemeos_common.clients;
+"lazy" imports the service as it is now. The median of --repeat runs is
+printed. Client creation needs SUPABASE_URL, SUPABASE_SERVICE_KEY,
+GEMINI_API_KEY and GCP credentials in the environment, as in the services;
+without them the error is reported next to the timings, and a run that
+fails outright is reported instead of its timings.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+SERVICES = ["concept-chunker", "concept-structurer", "learning-goals-generation"]
+
+# Runs in the child interpreter; argv: service directory, mode
+CHILD = r"""
+import json, os, sys, time
+start = time.perf_counter()
+service_dir, mode = sys.argv[1], sys.argv[2]
+sys.path.insert(0, service_dir)
+os.chdir(service_dir)
+from gemeos_common import clients
+
+def create_clients():
+    try:
+        clients.get_supabase()
+        clients.get_storage_client()
+        clients.get_gemini_model(os.getenv("GEMINI_MODEL", "gemini-1.5-pro"))
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+
+result = {}
+if mode == "eager":
+    create_clients()
+import main
+result["import"] = time.perf_counter() - start
+
+t = time.perf_counter()
+main.app.test_client().get("/")
+result["first"] = time.perf_counter() - t
+
+t = time.perf_counter()
+create_clients()
+result["clients"] = time.perf_counter() - t
+print(json.dumps(result))
+"""
+
+
+def run_once(service, mode):
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(ROOT), PYTHONDONTWRITEBYTECODE="1")
+    proc = subprocess.run(
+        [sys.executable, "-c", CHILD, os.path.abspath(os.path.join(ROOT, service)), mode],
+        env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        lines = proc.stderr.strip().splitlines()
+        return {"failed": lines[-1] if lines else f"exit status {proc.returncode}"}
+    # The service logs JSON lines too; the result is the last line
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--services", nargs="+", default=SERVICES)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for service in args.services:
+        print(f"{service}:")
+        for mode in ("eager", "lazy"):
+            runs = [run_once(service, mode) for _ in range(args.repeat)]
+            failed = [r["failed"] for r in runs if "failed" in r]
+            if failed:
+                print(f"  {mode:<6} failed: {failed[0]}")
+                continue
+            median = {key: statistics.median(r[key] for r in runs) * 1000 for key in ("import", "first", "clients")}
+            errors = {r["error"] for r in runs if "error" in r}
+            note = f"  ({errors.pop()})" if errors else ""
+            print(f"  {mode:<6} {median['import']:8.0f} ms import {median['first']:7.1f} ms first request "
+                  f"{median['import'] + median['first']:8.0f} ms to first request "
+                  f"{median['clients']:8.0f} ms clients{note}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Benchmark: monolithic vs clustered concept structuring in the concept structurer.
+
+Usage:
+    python benchmarks/bench_structuring.py [--sizes 100 1000 5000] [--cluster-size 150]
+                                           [--concurrency 4] [--time-scale 0.001]
+
+Runs structuring.structure_hierarchically and the single-prompt path against
+a simulated Gemini whose latency grows with input and output tokens, and
+prints the simulated wall-clock latency, total tokens, the largest prompt and
+the largest response per strategy. Token counts come from the real prompts;
+only the model is simulated. Responses over the model's output limit
+(8192 tokens for gemini-1.5-pro) are flagged: that is where the monolithic
+call starts failing in production.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "..", "concept-structurer"))
+
+from gemeos_common.fewshot import count_tokens
+import structuring
+
+MAX_OUTPUT_TOKENS = 8192
+GUIDANCE = "You are structuring music theory concepts into a prerequisite hierarchy. " * 20
+
+TOPICS = [
+    "scale", "chord", "interval", "rhythm", "meter", "cadence", "mode", "harmony", "melody",
+    "counterpoint", "voice leading", "key signature", "tempo", "dynamics", "articulation",
+    "form", "motif", "phrase", "texture", "timbre", "notation", "clef", "triad", "seventh chord",
+    "modulation", "syncopation", "ornament", "tuning", "overtone", "improvisation",
+]
+MODIFIERS = [
+    "major", "minor", "diminished", "augmented", "dominant", "perfect", "compound", "simple",
+    "chromatic", "diatonic", "parallel", "relative", "harmonic", "melodic", "natural",
+    "advanced", "introductory", "jazz", "baroque", "romantic", "modal", "tonal", "atonal",
+    "secondary", "borrowed", "extended", "altered", "suspended", "irregular", "polyrhythmic",
+]
+SUFFIXES = ["", " in practice", " analysis", " ear training", " exercises", " history", " theory"]
+
+
+def synthetic_concepts(count, seed=7):
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < count:
+        names.add(f"{rng.choice(MODIFIERS)} {rng.choice(TOPICS)}{rng.choice(SUFFIXES)}".strip().title())
+    return sorted(names)
+
+
+class SimulatedGemini:
+    """Latency = overhead + input/throughput_in + output/throughput_out (scaled)."""
+
+    def __init__(self, time_scale, overhead=1.5, input_tps=20000, output_tps=120):
+        self.time_scale = time_scale
+        self.overhead = overhead
+        self.input_tps = input_tps
+        self.output_tps = output_tps
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.max_input = 0
+        self.max_output = 0
+
+    def __call__(self, prompt):
+        names = json.loads(prompt[prompt.rindex("\n[") + 1:])
+        # Parent = the first earlier concept sharing a word, a plausible stand-in for the model
+        first_by_word = {}
+        hierarchy = []
+        for name in names:
+            words = name.lower().split()
+            parent = next((first_by_word[w] for w in words if w in first_by_word), None)
+            hierarchy.append({"concept": name, "parent": parent})
+            for w in words:
+                first_by_word.setdefault(w, name)
+
+        tokens_in = count_tokens(prompt)
+        tokens_out = count_tokens(json.dumps({"hierarchy": hierarchy}))
+        latency = self.overhead + tokens_in / self.input_tps + tokens_out / self.output_tps
+        with self.lock:
+            self.calls += 1
+            self.input_tokens += tokens_in
+            self.output_tokens += tokens_out
+            self.max_input = max(self.max_input, tokens_in)
+            self.max_output = max(self.max_output, tokens_out)
+        time.sleep(latency * self.time_scale)
+        return hierarchy
+
+
+def run(label, model, time_scale, fn):
+    model.reset()
+    start = time.perf_counter()
+    hierarchy = fn()
+    simulated = (time.perf_counter() - start) / time_scale
+    flag = "  over output limit!" if model.max_output > MAX_OUTPUT_TOKENS else ""
+    print(f"  {label:<12} {simulated:8.1f}s {model.calls:6d} calls {model.input_tokens + model.output_tokens:10d} tokens"
+          f" {model.max_input:9d} max in {model.max_output:9d} max out{flag}")
+    return hierarchy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--cluster-size", type=int, default=150)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--time-scale", type=float, default=0.001,
+                        help="real seconds slept per simulated second")
+    args = parser.parse_args()
+
+    model = SimulatedGemini(args.time_scale)
+    for size in args.sizes:
+        names = synthetic_concepts(size)
+        start = time.perf_counter()
+        clusters = structuring.cluster_concepts(names, args.cluster_size)
+        cluster_ms = (time.perf_counter() - start) * 1000
+        print(f"{size} concepts: {len(clusters)} clusters (largest {max(map(len, clusters))}), "
+              f"clustered locally in {cluster_ms:.1f} ms")
+
+        run("monolithic", model, args.time_scale, lambda: structuring.merge_placements(
+            names, model(structuring.build_structuring_prompt(GUIDANCE, names))))
+        hierarchy = run("clustered", model, args.time_scale, lambda: structuring.structure_hierarchically(
+            names, GUIDANCE, model, args.cluster_size, args.concurrency))
+        assert len(hierarchy) == len(names), "clustered structuring lost concepts"
+
+
+if __name__ == "__main__":
+    main()
@@ -3,37 +3,155 @@ import json
 import base64
 import traceback
 import sys
-import time
-from flask import Flask, request
-from supabase import create_client
-import google.generativeai as genai
-from google.cloud import storage
-from google.api_core import exceptions as google_exceptions
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request, jsonify
+
+# gemeos_common sits next to the service directories (and next to main.py in the container)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from gemeos_common.chunks import read_text as read_sidecar_text
+from gemeos_common.clients import get_gemini_model, get_storage_client, get_supabase, warm_up
+from gemeos_common.clients import stats as client_stats
+from gemeos_common.concept_index import ConceptNameIndex
+from gemeos_common.fewshot import ExampleSelector
+from gemeos_common.guidance import GuidanceCache
+from gemeos_common.instrumentation import Instrumentation
+from gemeos_common.ledger import ProcessingLedger, skip_response
+from gemeos_common.llm_cache import cached_call, open_response_cache
+from gemeos_common.messages import decode_extraction_request, resolve_text
+from gemeos_common.metrics import CONTENT_TYPE
+from gemeos_common.ratelimit import RateLimitExceeded, RateLimiter
+from gemeos_common.text import normalize_name, split_into_chunks
 
 # --- Flask App ---
 app = Flask(__name__)
 
-# --- Config / Secrets ---
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") 
-
 # --- Clients ---
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-storage_client = storage.Client()
-genai.configure(api_key=GEMINI_API_KEY)
+# Supabase (SUPABASE_URL, SUPABASE_SERVICE_KEY), GCS and Gemini (GEMINI_API_KEY) clients
+# are created on first use and shared by all threads; see gemeos_common/clients.py
 
 # --- Constants ---
 GUIDANCE_BUCKET = "gemeos-guidance"
+GEMINI_MODEL = "gemini-1.5-pro-latest"
+# "auto" map-reduces texts longer than CONCEPT_CHUNK_CHARS; "single" always sends one prompt
+CONCEPT_EXTRACTION_MODE = os.getenv("CONCEPT_EXTRACTION_MODE", "auto")
+CONCEPT_CHUNK_CHARS = int(os.getenv("CONCEPT_CHUNK_CHARS", 12000))
+CONCEPT_CHUNK_CONCURRENCY = int(os.getenv("CONCEPT_CHUNK_CONCURRENCY", 4))
+# Files longer than the 50k characters kept in extracted_text are read from their chunk
+# sidecar, up to this many characters (0 uses extracted_text only)
+CONCEPT_SOURCE_MAX_CHARS = int(os.getenv("CONCEPT_SOURCE_MAX_CHARS", 200000))
+GUIDANCE_CACHE_TTL_SECONDS = float(os.getenv("GUIDANCE_CACHE_TTL_SECONDS", 300))
+GUIDANCE_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("GUIDANCE_CACHE_NEGATIVE_TTL_SECONDS", 60))
+GUIDANCE_CACHE_MAX_ENTRIES = int(os.getenv("GUIDANCE_CACHE_MAX_ENTRIES", 256))
+
+# Structured logs (LOG_SAMPLE_RATE, LOG_DEBUG), per-stage timings and /metrics
+instrumentation = Instrumentation("concept-chunker")
+instrumentation.capture_logging()
+
+# Gemini quota share for this instance (the project quota divided by max instances)
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", 60))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", 0)) or None
+GEMINI_MAX_WAIT_SECONDS = float(os.getenv("GEMINI_MAX_WAIT_SECONDS", 30))
+
+gemini_limiter = RateLimiter(
+    GEMINI_RPM, GEMINI_TPM, max_wait=GEMINI_MAX_WAIT_SECONDS, metrics=instrumentation.metrics
+)
+
+# Gemini response cache. /tmp on Cloud Run is an in-memory filesystem, so the
+# cache counts against the instance's memory limit: keep LLM_CACHE_MAX_MB small,
+# or point LLM_CACHE_PATH at a mounted volume to allow a larger one
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_BYPASS = os.getenv("LLM_CACHE_BYPASS", "false").lower() == "true"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "/tmp/gemeos-llm-cache/concept-chunker.sqlite")
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", 32))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+
+response_cache = open_response_cache(
+    LLM_CACHE_PATH, LLM_CACHE_MAX_MB * 1024 * 1024, LLM_CACHE_TTL_SECONDS
+) if LLM_CACHE_ENABLED else None
+
+# Few-shot examples: only the most relevant ones that fit the token budget
+FEW_SHOT_TOKEN_BUDGET = int(os.getenv("FEW_SHOT_TOKEN_BUDGET", 2000))
+FEW_SHOT_MAX_EXAMPLES = int(os.getenv("FEW_SHOT_MAX_EXAMPLES", 8))
+
+def render_concept_example(example):
+    input_text = example.get("input")
+    output_json = example.get("output")
+    if input_text and output_json:
+        return f"EXAMPLE INPUT:\n{input_text}\nEXAMPLE OUTPUT:\n{json.dumps(output_json)}\n\n"
+    return None
+
+few_shot_selector = ExampleSelector(
+    render_concept_example,
+    token_budget=FEW_SHOT_TOKEN_BUDGET,
+    max_examples=FEW_SHOT_MAX_EXAMPLES
+)
+
+# Concept-name index used by save_concepts to skip duplicates
+CONCEPT_INDEX_REFRESH_SECONDS = float(os.getenv("CONCEPT_INDEX_REFRESH_SECONDS", 30))
+CONCEPT_INDEX_FULL_RELOAD_SECONDS = float(os.getenv("CONCEPT_INDEX_FULL_RELOAD_SECONDS", 3600))
+CONCEPT_SIMILARITY_THRESHOLD = float(os.getenv("CONCEPT_SIMILARITY_THRESHOLD", 0.85))
+
+concept_index = ConceptNameIndex(
+    get_supabase,
+    refresh=CONCEPT_INDEX_REFRESH_SECONDS,
+    full_reload=CONCEPT_INDEX_FULL_RELOAD_SECONDS,
+    similarity_threshold=CONCEPT_SIMILARITY_THRESHOLD
+)
+
+guidance_cache = GuidanceCache(
+    get_storage_client,
+    GUIDANCE_BUCKET,
+    ttl=GUIDANCE_CACHE_TTL_SECONDS,
+    negative_ttl=GUIDANCE_CACHE_NEGATIVE_TTL_SECONDS,
+    max_entries=GUIDANCE_CACHE_MAX_ENTRIES
+)
+
+# Processing ledger: redeliveries and duplicate publishes skip the Gemini call
+PROCESSING_LEDGER_ENABLED = os.getenv("PROCESSING_LEDGER_ENABLED", "true").lower() == "true"
+PROCESSING_LEASE_SECONDS = int(os.getenv("PROCESSING_LEASE_SECONDS", 600))
+
+ledger = ProcessingLedger(
+    get_supabase,
+    "concept-chunker",
+    lease_seconds=PROCESSING_LEASE_SECONDS,
+    enabled=PROCESSING_LEDGER_ENABLED
+)
 
 # --- Healthcheck Route ---
 @app.route("/", methods=["GET"])
 def health_check():
     return "Gemeos concept chunker is running", 200
 
+# --- Stats Route ---
+def collect_stats():
+    return {
+        "guidance_cache": guidance_cache.stats(),
+        "concept_index": concept_index.stats(),
+        "few_shot": few_shot_selector.stats(),
+        "processing_ledger": ledger.stats(),
+        "instrumentation": instrumentation.stats(),
+        "gemini_rate_limiter": gemini_limiter.stats(),
+        "clients": client_stats(),
+        "llm_response_cache": response_cache.stats() if response_cache else None
+    }
+
+# Every numeric stat is also exported on /metrics
+instrumentation.metrics.export_stats("", collect_stats)
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify(collect_stats()), 200
+
+# --- Metrics Route ---
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(instrumentation.metrics.render(), content_type=CONTENT_TYPE)
+
 # --- Main Ingestion Route ---
 @app.route("/", methods=["POST"])
 def handle_pubsub():
+    lease = None
+    trace = instrumentation.trace("file")
     try:
         envelope = request.get_json()
         if not envelope or "message" not in envelope:
@@ -43,9 +161,16 @@ def handle_pubsub():
         if "data" not in pubsub_message:
             return "Bad Request: No data in message", 400
 
+        message_id = pubsub_message.get("messageId") or pubsub_message.get("message_id")
+        trace.annotate(message_id=message_id)
+        instrumentation.observe_message(pubsub_message)
+        if ledger.seen_message(message_id):
+            trace.finish("already_processed")
+            return "OK (already processed)", 200
+
         data = base64.b64decode(pubsub_message["data"]).decode("utf-8")
-        attrs = json.loads(data)
-        
+        attrs, extraction_request = parse_request(data)
+
         file_id = attrs.get("file_id")
         domain_id = attrs.get("domain_id")
         domain_slug = attrs.get("domain_slug")
@@ -53,60 +178,133 @@ def handle_pubsub():
         if not file_id or not domain_id or not domain_slug:
             return "Missing file_id, domain_id, or domain_slug", 400
 
-        print(f"📥 Received request for file_id={file_id}, domain_id={domain_id}, domain_slug={domain_slug}")
+        trace.annotate(file_id=file_id, domain_id=domain_id, domain_slug=domain_slug)
+        trace.log("📥 Received request")
 
-        extracted_text = fetch_extracted_text(file_id)
+        extracted_text = trace.timed("fetch", fetch_extracted_text, file_id, extraction_request)
         if not extracted_text:
+            trace.finish("not_found", "WARNING")
             return f"No extracted text found for file_id: {file_id}", 404
 
-        guidance, examples = fetch_guidance_from_gcs(domain_slug)
+        guidance, examples = trace.timed("guidance", fetch_guidance_from_gcs, domain_slug)
+
+        bypass_cache = bool(attrs.get("bypass_cache"))
+        outcome, lease = ledger.claim(
+            ledger.work_key("file", file_id, domain_id, extracted_text, guidance), message_id, force=bypass_cache
+        )
+        skip = skip_response(outcome)
+        if skip:
+            trace.finish("skipped", reason=skip[0])
+            return skip
         
-        concepts = extract_concepts_with_gemini(extracted_text, domain_slug, guidance, examples)
-        print(f"✅ Concepts extracted by AI: {concepts}")
+        with trace.stage("gemini"):
+            concepts = extract_concepts_with_gemini(
+                extracted_text, domain_slug, guidance, examples, bypass_cache=bypass_cache
+            )
+        trace.log("Concepts extracted by AI", "DEBUG", concepts=concepts)
 
-        if concepts:
-            save_concepts(concepts, domain_id, file_id)
+        with trace.stage("save"):
+            if concepts:
+                save_concepts(concepts, domain_id, file_id)
 
+        ledger.complete(lease, {"concepts": len(concepts)})
+        trace.finish(text_chars=len(extracted_text), concepts=len(concepts))
         return "OK", 200
 
+    except RateLimitExceeded as e:
+        # Let Pub/Sub redeliver later instead of holding this worker while the quota recovers
+        trace.finish("deferred", "WARNING", error=str(e))
+        ledger.fail(lease, e)
+        return f"Too Many Requests: {str(e)}", 429
+
     except Exception as e:
-        print(f"❌ Error processing message: {str(e)}")
-        traceback.print_exc()
+        trace.finish("error", error=str(e), traceback=traceback.format_exc())
+        ledger.fail(lease, e)
         return f"Internal Server Error: {str(e)}", 500
 
 # --- Utilities ---
-def fetch_extracted_text(file_id):
-    response = supabase.table("domain_extracted_files").select("extracted_text").eq("id", file_id).single().execute()
-    return response.data.get("extracted_text") if response.data else None
+def parse_request(data):
+    """Return (attrs, extraction_request) for a message body.
+
+    content-extraction-requests claim checks (any version) are decoded with
+    the shared decoder and name the file record_id; other requests carry
+    file_id, domain_id and domain_slug directly.
+    """
+    attrs = json.loads(data)
+    if "record_id" not in attrs:
+        return attrs, None
+    extraction_request = decode_extraction_request(data)
+    return dict(extraction_request, file_id=extraction_request["record_id"]), extraction_request
+
+def fetch_extracted_text(file_id, extraction_request=None):
+    if extraction_request:
+        metadata = extraction_request.get("metadata") or {}
+        stored_chars = extraction_request.get("text_chars") or 0
+    else:
+        response = get_supabase().table("domain_extracted_files")\
+            .select("extracted_text, metadata_json").eq("id", file_id).single().execute()
+        if not response.data:
+            return None
+        metadata = response.data.get("metadata_json") or {}
+        text = response.data.get("extracted_text")
+        stored_chars = len(text or "")
+
+    # extracted_text is cut at 50k characters; the sidecar has the rest of the file
+    sidecar = metadata.get("chunks") or {}
+    if CONCEPT_SOURCE_MAX_CHARS > stored_chars and sidecar.get("uri") and (sidecar.get("chars") or 0) > stored_chars:
+        try:
+            return read_sidecar_text(get_storage_client(), sidecar["uri"], CONCEPT_SOURCE_MAX_CHARS)
+        except Exception as e:
+            instrumentation.log(f"⚠️ Could not read chunk sidecar {sidecar['uri']}, using extracted_text: {e}", "WARNING")
+
+    if extraction_request:
+        # Legacy messages carry the text inline; version 2 points at the stored column
+        return resolve_text(extraction_request, get_supabase())
+    return text
 
 def fetch_guidance_from_gcs(domain_slug):
     try:
-        bucket = storage_client.bucket(GUIDANCE_BUCKET)
-        
-        guidance_blob = bucket.blob(f"{domain_slug}/guidance/concepts/concepts_guidance.md")
-        guidance_text = guidance_blob.download_as_text()
+        guidance_text = guidance_cache.get_text(domain_slug, f"{domain_slug}/guidance/concepts/concepts_guidance.md")
+        examples = guidance_cache.get_jsonl(domain_slug, f"{domain_slug}/guidance/concepts/concepts_examples.jsonl")
+        if guidance_text is None or examples is None:
+            instrumentation.log(f"⚠️ No guidance files in GCS for domain '{domain_slug}'. Using default prompt.", "WARNING")
+            return None, None
         
-        examples_blob = bucket.blob(f"{domain_slug}/guidance/concepts/concepts_examples.jsonl")
-        examples_text = examples_blob.download_as_text()
-        examples = [json.loads(line) for line in examples_text.strip().split('\n')]
-        
-        print(f"✅ Successfully loaded guidance and {len(examples)} examples from GCS.")
+        instrumentation.log(f"✅ Loaded guidance and {len(examples)} examples (cache: {guidance_cache.stats()['hit_ratio']:.0%} hits).")
         return guidance_text, examples
     except Exception as e:
-        print(f"⚠️ Warning: Could not load guidance files from GCS for domain '{domain_slug}'. Using default prompt. Error: {e}")
+        instrumentation.log(f"⚠️ Could not load guidance files from GCS for domain '{domain_slug}'. Using default prompt. Error: {e}", "WARNING")
         return None, None
 
-def extract_concepts_with_gemini(text, domain, guidance, examples):
+def extract_concepts_with_gemini(text, domain, guidance, examples, bypass_cache=False):
+    """Extract concepts in one prompt, or map-reduce over chunks for long texts.
+
+    Texts longer than CONCEPT_CHUNK_CHARS are split on paragraph boundaries;
+    the chunk prompts run concurrently (at most CONCEPT_CHUNK_CONCURRENCY at a
+    time) and their concept lists are merged locally. Every prompt carries
+    the few-shot examples most similar to its own text, within
+    FEW_SHOT_TOKEN_BUDGET. Each prompt's response
+    is served from the LLM response cache when an identical call was made
+    before, unless bypass_cache is set.
+    """
     system_prompt = guidance if guidance else "You are an expert educational assistant. Extract key learning concepts from the provided text."
-    
-    few_shot_examples = ""
-    if examples:
-        for example in examples:
-            input_text = example.get("input")
-            output_json = example.get("output")
-            if input_text and output_json:
-                few_shot_examples += f"EXAMPLE INPUT:\n{input_text}\nEXAMPLE OUTPUT:\n{json.dumps(output_json)}\n\n"
 
+    model = get_gemini_model(GEMINI_MODEL)
+
+    if CONCEPT_EXTRACTION_MODE == "single" or len(text) <= CONCEPT_CHUNK_CHARS:
+        return extract_concepts_from_chunk(model, system_prompt, examples, text, domain, bypass_cache)
+
+    chunks = split_into_chunks(text, CONCEPT_CHUNK_CHARS)
+    instrumentation.log(f"🧩 Extracting concepts from {len(chunks)} chunks (concurrency {CONCEPT_CHUNK_CONCURRENCY})")
+    with ThreadPoolExecutor(max_workers=CONCEPT_CHUNK_CONCURRENCY) as executor:
+        per_chunk = list(executor.map(
+            lambda chunk: extract_concepts_from_chunk(model, system_prompt, examples, chunk, domain, bypass_cache),
+            chunks
+        ))
+    return merge_concept_lists(per_chunk)
+
+def extract_concepts_from_chunk(model, system_prompt, examples, text, domain, bypass_cache=False):
+    few_shot_examples = few_shot_selector.select(examples, text)
     prompt = f"""{few_shot_examples}Analyze the following educational material for the domain '{domain}'. 
 Extract the key learning concepts discussed in the text.
 Return your response as a JSON object with a single key "concepts", which contains a list of strings.
@@ -114,72 +312,91 @@ Return your response as a JSON object with a single key "concepts", which contai
 TEXT TO ANALYZE:
 {text}"""
 
-    model = genai.GenerativeModel('gemini-1.5-pro-latest')
-    
-    for attempt in range(3):
-        try:
-            response = model.generate_content(
+    prompt_tokens = few_shot_selector.record_prompt(system_prompt, prompt)
+    instrumentation.debug_prompt(system_prompt, prompt)
+
+    config = {
+        "response_mime_type": "application/json",
+        "temperature": 0.2  # Ensures consistent, predictable output
+    }
+    content = cached_call(
+        response_cache, GEMINI_MODEL, system_prompt, prompt, config,
+        lambda: gemini_limiter.call(
+            lambda: model.generate_content(
                 [system_prompt, prompt],
-                generation_config=genai.types.GenerationConfig(
-                    response_mime_type="application/json",
-                    temperature=0.2  # Ensures consistent, predictable output
-                )
-            )
-            content = response.text
-            try:
-                parsed_json = json.loads(content)
-                return parsed_json.get("concepts", [])
-            except (json.JSONDecodeError, TypeError):
-                print(f"⚠️ Failed to parse Gemini JSON response: {content}")
-                return []
-        except google_exceptions.ResourceExhausted as e:
-            print(f"Rate limit hit. Waiting for 5 seconds before retry {attempt + 1}/3... Error: {e}")
-            time.sleep(5)
-        except Exception as e:
-            print(f"An unexpected error occurred with Gemini: {e}")
-            return []
-    
-    print("❌ Failed to get response from Gemini after multiple retries.")
-    return []
+                generation_config=config
+            ),
+            estimated_tokens=prompt_tokens
+        ).text,
+        bypass=bypass_cache or LLM_CACHE_BYPASS
+    )
+    try:
+        parsed_json = json.loads(content)
+        return parsed_json.get("concepts", [])
+    except (json.JSONDecodeError, TypeError):
+        instrumentation.log("⚠️ Failed to parse Gemini JSON response", "WARNING", response=content)
+        return []
+
+def merge_concept_lists(concept_lists):
+    """Merge per-chunk concept lists, dropping case/whitespace duplicates.
+
+    Keeps the first spelling seen, in document order.
+    """
+    merged = []
+    seen = set()
+    for concepts in concept_lists:
+        for name in concepts:
+            if not isinstance(name, str):
+                continue
+            key = normalize_name(name)
+            if key and key not in seen:
+                seen.add(key)
+                merged.append(name.strip())
+    return merged
 
 def save_concepts(concepts, domain_id, file_id):
     if not concepts:
-        print("No concepts to save.")
+        instrumentation.log("No concepts to save.")
         return
 
-    try:
-        existing_concepts_res = supabase.table("concepts").select("name").eq("domain_id", domain_id).eq("status", "approved").execute()
-        existing_names = {item['name'].lower() for item in existing_concepts_res.data}
-        print(f"[DEBUG] Found {len(existing_names)} existing APPROVED concepts for this domain.")
-
-        new_concepts_to_insert = []
-        for concept_name in concepts:
-            if concept_name.lower() not in existing_names:
-                new_concepts_to_insert.append(concept_name)
-                existing_names.add(concept_name.lower())
-
-        if not new_concepts_to_insert:
-            print("✅ No new concepts to add. All extracted concepts already exist as approved concepts.")
-            return
-
-        print(f"[INFO] Found {len(new_concepts_to_insert)} new concepts to save.")
-
-        rows = [{
-            "domain_id": domain_id, 
-            "source_file_id": file_id, 
-            "name": name, 
-            "status": "suggested",
-            "teacher_id": "00000000-0000-0000-0000-000000000000"
-        } for name in new_concepts_to_insert]
-        
-        supabase.table("concepts").insert(rows).execute()
-        print(f"✅ Successfully saved {len(rows)} new concepts to Supabase.")
+    new_concepts_to_insert = []
+    skipped = 0
+    for concept_name in concepts:
+        match = concept_index.find_duplicate(domain_id, concept_name)
+        if match:
+            existing_name, reason = match
+            if reason != "exact":
+                instrumentation.log(f"Skipping '{concept_name}': near-duplicate of '{existing_name}' ({reason})", "DEBUG")
+            skipped += 1
+            continue
+        new_concepts_to_insert.append(concept_name)
+        concept_index.add_local(domain_id, concept_name)
 
-    except Exception as e:
-        print(f"❌ Supabase insert error during save_concepts: {e}")
-        traceback.print_exc()
+    if not new_concepts_to_insert:
+        instrumentation.log("✅ No new concepts to add. All extracted concepts already exist in this domain.")
+        return
+
+    instrumentation.log(f"Found {len(new_concepts_to_insert)} new concepts to save ({skipped} duplicates skipped).")
+
+    rows = [{
+        "domain_id": domain_id, 
+        "source_file_id": file_id, 
+        "name": name, 
+        "status": "suggested",
+        "teacher_id": "00000000-0000-0000-0000-000000000000"
+    } for name in new_concepts_to_insert]
+    
+    try:
+        get_supabase().table("concepts").insert(rows).execute()
+    except Exception:
+        # The names were indexed optimistically; reload the domain next time
+        concept_index.invalidate(domain_id)
+        raise
+    instrumentation.log(f"✅ Successfully saved {len(rows)} new concepts to Supabase.")
 
 # --- Start App ---
 if __name__ == "__main__":
-    print("🚀 Starting gemeos-concept-chunker service...")
-    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 8080)))
+    port = int(os.getenv("PORT", 8080))
+    instrumentation.log("🚀 Starting gemeos-concept-chunker service", port=port)
+    warm_up(get_supabase, get_storage_client, lambda: get_gemini_model(GEMINI_MODEL))
+    app.run(host="0.0.0.0", port=port)
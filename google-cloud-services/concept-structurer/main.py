@@ -3,35 +3,136 @@ import json
 import base64
 import traceback
 import sys
-from flask import Flask, request
-from supabase import create_client
-import google.generativeai as genai
-from google.cloud import storage
+from flask import Flask, Response, request, jsonify
+
+# gemeos_common sits next to the service directories (and next to main.py in the container)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from gemeos_common.clients import get_gemini_model, get_storage_client, get_supabase, warm_up
+from gemeos_common.clients import stats as client_stats
+from gemeos_common.coalesce import Coalescer
+from gemeos_common.concept_graph import ConceptGraph
+from gemeos_common.guidance import GuidanceCache
+from gemeos_common.instrumentation import Instrumentation
+from gemeos_common.ledger import ProcessingLedger, skip_response
+from gemeos_common.llm_cache import cached_call, open_response_cache
+from gemeos_common.metrics import CONTENT_TYPE
+from gemeos_common.ratelimit import RateLimitExceeded, RateLimiter, estimate_tokens
+from gemeos_common.text import normalize_name
+from structuring import build_structuring_prompt, merge_placements, structure_hierarchically
 
 # --- Flask App ---
 app = Flask(__name__)
 
-# --- Config / Secrets ---
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") 
-
 # --- Clients ---
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-storage_client = storage.Client()
-genai.configure(api_key=GEMINI_API_KEY)
+# Supabase (SUPABASE_URL, SUPABASE_SERVICE_KEY), GCS and Gemini (GEMINI_API_KEY) clients
+# are created on first use and shared by all threads; see gemeos_common/clients.py
 
 # --- Constants ---
 GUIDANCE_BUCKET = "gemeos-guidance"
+GEMINI_MODEL = "gemini-1.5-pro-latest"
+GUIDANCE_CACHE_TTL_SECONDS = float(os.getenv("GUIDANCE_CACHE_TTL_SECONDS", 300))
+GUIDANCE_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("GUIDANCE_CACHE_NEGATIVE_TTL_SECONDS", 60))
+GUIDANCE_CACHE_MAX_ENTRIES = int(os.getenv("GUIDANCE_CACHE_MAX_ENTRIES", 256))
+
+# "incremental" places only concepts missing from the last approved hierarchy;
+# "full" rebuilds the whole hierarchy (also per message with full_restructure)
+STRUCTURING_MODE = os.getenv("STRUCTURING_MODE", "incremental")
+HIERARCHY_SUMMARY_MAX_CHARS = int(os.getenv("HIERARCHY_SUMMARY_MAX_CHARS", 20000))
+
+# Full structuring of more than STRUCTURING_CLUSTER_THRESHOLD concepts is split
+# into lexical clusters structured in parallel, then the cluster roots are linked.
+# A single-call response passes gemini-1.5-pro's 8192 output tokens at around
+# 300 concepts (benchmarks/bench_structuring.py), so keep the threshold below that
+STRUCTURING_CLUSTER_THRESHOLD = int(os.getenv("STRUCTURING_CLUSTER_THRESHOLD", 250))
+STRUCTURING_CLUSTER_SIZE = int(os.getenv("STRUCTURING_CLUSTER_SIZE", 150))
+STRUCTURING_CONCURRENCY = int(os.getenv("STRUCTURING_CONCURRENCY", 4))
+
+# Structuring requests for a domain within this many seconds share one run. The
+# window must stay below the push subscription's ack deadline (10s unless set
+# otherwise on the subscription), or messages are redelivered while they wait.
+STRUCTURING_COALESCE_SECONDS = float(os.getenv("STRUCTURING_COALESCE_SECONDS", 2))
+PUBSUB_ACK_DEADLINE_SECONDS = float(os.getenv("PUBSUB_ACK_DEADLINE_SECONDS", 10))
+
+structuring_coalescer = Coalescer(window=STRUCTURING_COALESCE_SECONDS, ack_deadline=PUBSUB_ACK_DEADLINE_SECONDS)
+
+# Structured logs (LOG_SAMPLE_RATE, LOG_DEBUG), per-stage timings and /metrics
+instrumentation = Instrumentation("concept-structurer")
+instrumentation.capture_logging()
+
+# Gemini quota share for this instance (the project quota divided by max instances)
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", 60))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", 0)) or None
+GEMINI_MAX_WAIT_SECONDS = float(os.getenv("GEMINI_MAX_WAIT_SECONDS", 30))
+
+gemini_limiter = RateLimiter(
+    GEMINI_RPM, GEMINI_TPM, max_wait=GEMINI_MAX_WAIT_SECONDS, metrics=instrumentation.metrics
+)
+
+# Gemini response cache. /tmp on Cloud Run is an in-memory filesystem, so the
+# cache counts against the instance's memory limit: keep LLM_CACHE_MAX_MB small,
+# or point LLM_CACHE_PATH at a mounted volume to allow a larger one
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_BYPASS = os.getenv("LLM_CACHE_BYPASS", "false").lower() == "true"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "/tmp/gemeos-llm-cache/concept-structurer.sqlite")
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", 32))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+
+response_cache = open_response_cache(
+    LLM_CACHE_PATH, LLM_CACHE_MAX_MB * 1024 * 1024, LLM_CACHE_TTL_SECONDS
+) if LLM_CACHE_ENABLED else None
+
+guidance_cache = GuidanceCache(
+    get_storage_client,
+    GUIDANCE_BUCKET,
+    ttl=GUIDANCE_CACHE_TTL_SECONDS,
+    negative_ttl=GUIDANCE_CACHE_NEGATIVE_TTL_SECONDS,
+    max_entries=GUIDANCE_CACHE_MAX_ENTRIES
+)
+
+# Processing ledger: redeliveries and duplicate publishes skip the Gemini call
+PROCESSING_LEDGER_ENABLED = os.getenv("PROCESSING_LEDGER_ENABLED", "true").lower() == "true"
+PROCESSING_LEASE_SECONDS = int(os.getenv("PROCESSING_LEASE_SECONDS", 600))
+
+ledger = ProcessingLedger(
+    get_supabase,
+    "concept-structurer",
+    lease_seconds=PROCESSING_LEASE_SECONDS,
+    enabled=PROCESSING_LEDGER_ENABLED
+)
 
 # --- Healthcheck Route ---
 @app.route("/", methods=["GET"])
 def health_check():
     return "Gemeos concept structurer is running", 200
 
+# --- Stats Route ---
+def collect_stats():
+    return {
+        "guidance_cache": guidance_cache.stats(),
+        "processing_ledger": ledger.stats(),
+        "structuring_coalescer": structuring_coalescer.stats(),
+        "instrumentation": instrumentation.stats(),
+        "gemini_rate_limiter": gemini_limiter.stats(),
+        "clients": client_stats(),
+        "llm_response_cache": response_cache.stats() if response_cache else None
+    }
+
+# Every numeric stat is also exported on /metrics
+instrumentation.metrics.export_stats("", collect_stats)
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify(collect_stats()), 200
+
+# --- Metrics Route ---
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(instrumentation.metrics.render(), content_type=CONTENT_TYPE)
+
 # --- Main Ingestion Route ---
 @app.route("/", methods=["POST"])
 def handle_pubsub():
+    trace = instrumentation.trace("message")
     try:
         envelope = request.get_json()
         if not envelope or "message" not in envelope:
@@ -41,6 +142,13 @@ def handle_pubsub():
         if "data" not in pubsub_message:
             return "Bad Request: No data in message", 400
 
+        message_id = pubsub_message.get("messageId") or pubsub_message.get("message_id")
+        trace.annotate(message_id=message_id)
+        instrumentation.observe_message(pubsub_message)
+        if ledger.seen_message(message_id):
+            trace.finish("already_processed")
+            return "OK (already processed)", 200
+
         data = base64.b64decode(pubsub_message["data"]).decode("utf-8")
         attrs = json.loads(data)
         
@@ -50,96 +158,279 @@ def handle_pubsub():
         if not domain_id or not domain_slug:
             return "Missing domain_id or domain_slug", 400
 
-        print(f"📥 Received structuring request for domain_id={domain_id}")
+        trace.annotate(domain_id=domain_id, domain_slug=domain_slug)
+
+        outcome, response = structuring_coalescer.submit(
+            domain_id, attrs, lambda requests: run_structuring(domain_id, domain_slug, requests, message_id)
+        )
+        trace.finish(outcome)
+        return response
+
+    except RateLimitExceeded as e:
+        # Let Pub/Sub redeliver later instead of holding this worker while the quota recovers
+        trace.finish("deferred", "WARNING", error=str(e))
+        return f"Too Many Requests: {str(e)}", 429
 
+    except Exception as e:
+        trace.finish("error", error=str(e), traceback=traceback.format_exc())
+        return f"Internal Server Error: {str(e)}", 500
+
+def run_structuring(domain_id, domain_slug, requests, message_id):
+    """One structuring pass for a domain, covering every coalesced request in requests."""
+    trace = instrumentation.trace("domain", message_id=message_id, domain_id=domain_id, requests=len(requests))
+    lease = None
+    try:
         # 1. Fetch all approved concepts for the domain
-        concepts = fetch_approved_concepts(domain_id)
+        concepts = trace.timed("fetch", fetch_approved_concepts, domain_id)
         if not concepts:
-            print("✅ No approved concepts found to structure.")
+            trace.finish("no_concepts")
             return "OK", 200
 
         # 2. Fetch the structuring guidance from GCS
-        structuring_guidance = fetch_structuring_guidance(domain_slug)
+        structuring_guidance = trace.timed("guidance", fetch_structuring_guidance, domain_slug)
         if not structuring_guidance:
+            trace.finish("no_guidance", "ERROR")
             return "Could not load structuring guidance from GCS", 500
 
-        # 3. Call Gemini to get the concept hierarchy
-        hierarchy = structure_concepts_with_gemini(concepts, structuring_guidance)
-        print(f"✅ AI suggested hierarchy: {hierarchy}")
+        bypass_cache = any(attrs.get("bypass_cache") for attrs in requests)
+        full_restructure = STRUCTURING_MODE == "full" or any(attrs.get("full_restructure") for attrs in requests)
+        accepted = None if full_restructure else trace.timed("fetch_hierarchy", fetch_accepted_hierarchy, domain_id)
+
+        outcome, lease = ledger.claim(
+            ledger.work_key("domain", domain_id, concepts, structuring_guidance, accepted),
+            message_id, force=bypass_cache
+        )
+        skip = skip_response(outcome)
+        if skip:
+            trace.finish("skipped", reason=skip[0])
+            return skip
+
+        # 3. Call Gemini to get the concept hierarchy (or just the new placements)
+        with trace.stage("gemini"):
+            if accepted:
+                hierarchy = place_new_concepts_with_gemini(
+                    concepts, accepted, structuring_guidance, bypass_cache=bypass_cache
+                )
+            else:
+                hierarchy = structure_concepts_with_gemini(
+                    concepts, structuring_guidance, bypass_cache=bypass_cache
+                )
+        trace.log("AI suggested hierarchy", "DEBUG", hierarchy=hierarchy)
 
         # 4. --- MODIFIED: Save the suggestion to the new table ---
-        if hierarchy:
-            save_suggested_hierarchy(domain_id, hierarchy)
+        with trace.stage("save"):
+            if hierarchy:
+                save_suggested_hierarchy(domain_id, hierarchy, concepts)
 
+        ledger.complete(lease, {"hierarchy_nodes": len(hierarchy) if hierarchy else 0})
+        trace.finish(
+            concepts=len(concepts), hierarchy_nodes=len(hierarchy) if hierarchy else 0,
+            mode="incremental" if accepted else "full"
+        )
         return "OK", 200
 
+    except RateLimitExceeded as e:
+        ledger.fail(lease, e)
+        trace.finish("deferred", "WARNING", error=str(e))
+        raise
+
     except Exception as e:
-        print(f"❌ Error processing message: {str(e)}")
-        traceback.print_exc()
-        return f"Internal Server Error: {str(e)}", 500
+        ledger.fail(lease, e)
+        trace.finish("error", error=str(e))
+        raise
 
 # --- Utilities ---
 def fetch_approved_concepts(domain_id):
-    response = supabase.table("concepts").select("id, name").eq("domain_id", domain_id).eq("status", "approved").execute()
+    response = get_supabase().table("concepts").select("id, name").eq("domain_id", domain_id).eq("status", "approved").execute()
     return response.data if response.data else []
 
 def fetch_structuring_guidance(domain_slug):
     try:
-        bucket = storage_client.bucket(GUIDANCE_BUCKET)
-        blob = bucket.blob(f"{domain_slug}/guidance/concepts/concept-structuring_guidance.md")
-        return blob.download_as_text()
+        guidance = guidance_cache.get_text(domain_slug, f"{domain_slug}/guidance/concepts/concept-structuring_guidance.md")
+        if guidance is None:
+            instrumentation.log(f"⚠️ No structuring guidance in GCS for domain '{domain_slug}'.", "WARNING")
+        return guidance
     except Exception as e:
-        print(f"⚠️ Error: Could not load structuring guidance from GCS. Error: {e}")
+        instrumentation.log(f"⚠️ Could not load structuring guidance from GCS. Error: {e}", "WARNING")
         return None
 
-def structure_concepts_with_gemini(concepts, guidance):
+def structure_concepts_with_gemini(concepts, guidance, bypass_cache=False):
     concept_list = [concept['name'] for concept in concepts]
-    
-    prompt = f"""{guidance}
-
-Based on the rules above, analyze the following list of learning concepts. Determine the parent-child relationships between them to form a logical learning hierarchy.
 
-Return your response as a JSON object with a single key "hierarchy", which contains a list of objects. Each object must have two keys: "concept" and "parent". If a concept is a top-level (root) concept, its parent should be null.
+    if len(concept_list) > STRUCTURING_CLUSTER_THRESHOLD:
+        instrumentation.log(f"🧩 Structuring {len(concept_list)} concepts in clusters of up to {STRUCTURING_CLUSTER_SIZE}")
+        return structure_hierarchically(
+            concept_list, guidance,
+            lambda prompt: call_gemini_for_hierarchy(prompt, bypass_cache),
+            max_cluster_size=STRUCTURING_CLUSTER_SIZE,
+            concurrency=STRUCTURING_CONCURRENCY
+        )
 
-LIST OF CONCEPTS:
-{json.dumps(concept_list)}"""
+    placements = call_gemini_for_hierarchy(build_structuring_prompt(guidance, concept_list), bypass_cache)
+    return merge_placements(concept_list, placements) if placements else []
 
-    model = genai.GenerativeModel('gemini-1.5-pro-latest')
+def call_gemini_for_hierarchy(prompt, bypass_cache=False):
+    model = get_gemini_model(GEMINI_MODEL)
+    instrumentation.debug_prompt(None, prompt)
     
-    response = model.generate_content(
-        prompt,
-        generation_config=genai.types.GenerationConfig(
-            response_mime_type="application/json"
-        )
+    config = {"response_mime_type": "application/json"}
+    content = cached_call(
+        response_cache, GEMINI_MODEL, None, prompt, config,
+        lambda: gemini_limiter.call(
+            lambda: model.generate_content(
+                prompt,
+                generation_config=config
+            ),
+            estimated_tokens=estimate_tokens(prompt)
+        ).text,
+        bypass=bypass_cache or LLM_CACHE_BYPASS
     )
     
-    content = response.text
     try:
         parsed_json = json.loads(content)
         return parsed_json.get("hierarchy", [])
     except (json.JSONDecodeError, TypeError):
-        print(f"⚠️ Failed to parse Gemini JSON response for hierarchy: {content}")
+        instrumentation.log("⚠️ Failed to parse Gemini JSON response for hierarchy", "WARNING", response=content)
         return []
 
+def fetch_accepted_hierarchy(domain_id):
+    """The most recently approved hierarchy for the domain, or None."""
+    response = get_supabase().table("suggested_concept_hierarchies")\
+        .select("suggested_structure")\
+        .eq("domain_id", domain_id)\
+        .eq("status", "approved")\
+        .order("updated_at", desc=True)\
+        .limit(1)\
+        .execute()
+    if not response.data:
+        return None
+    structure = response.data[0].get("suggested_structure")
+    return structure if isinstance(structure, list) and structure else None
+
+def prune_hierarchy(hierarchy, concepts):
+    """Drop entries for concepts that are no longer approved.
+
+    Children of a dropped concept move up to its nearest surviving ancestor.
+    Names are canonicalized to the current concept names.
+    """
+    current = {normalize_name(c["name"]): c["name"] for c in concepts}
+    parents = {}
+    for entry in hierarchy:
+        name = entry.get("concept") if isinstance(entry, dict) else None
+        if name:
+            parent = entry.get("parent")
+            parents[normalize_name(name)] = normalize_name(parent) if parent else None
+
+    pruned = []
+    for key, parent in parents.items():
+        if key not in current:
+            continue
+        seen = {key}
+        while parent is not None and parent not in current and parent not in seen:
+            seen.add(parent)
+            parent = parents.get(parent)
+        if parent in seen or parent not in current:
+            parent = None
+        pruned.append({"concept": current[key], "parent": current[parent] if parent else None})
+    return pruned
+
+def summarize_hierarchy(hierarchy, max_chars):
+    """Indented outline of the tree, collapsing the deepest levels to fit max_chars."""
+    children = {}
+    for entry in hierarchy:
+        children.setdefault(entry["parent"], []).append(entry["concept"])
+
+    def count(name):
+        return sum(1 + count(child) for child in children.get(name, []))
+
+    def render(depth_limit):
+        lines = []
+        stack = [(name, 0) for name in reversed(children.get(None, []))]
+        while stack:
+            name, depth = stack.pop()
+            below = children.get(name, [])
+            if depth + 1 >= depth_limit and below:
+                lines.append(f"{'  ' * depth}- {name} (+{count(name)} more below)")
+                continue
+            lines.append(f"{'  ' * depth}- {name}")
+            stack.extend((child, depth + 1) for child in reversed(below))
+        return "\n".join(lines)
+
+    depths = []
+    stack = [(name, 0) for name in children.get(None, [])]
+    while stack:
+        name, depth = stack.pop()
+        depths.append(depth)
+        stack.extend((child, depth + 1) for child in children.get(name, []))
+
+    depth_limit = max(depths, default=0) + 1
+    outline = render(depth_limit)
+    while len(outline) > max_chars and depth_limit > 1:
+        depth_limit -= 1
+        outline = render(depth_limit)
+    return outline
+
+def place_new_concepts_with_gemini(concepts, accepted, guidance, bypass_cache=False):
+    """Extend the approved hierarchy with concepts it does not contain yet.
+
+    Gemini only sees the new concept names and an outline of the existing
+    tree; the placements it returns are merged into the pruned approved
+    hierarchy locally. Returns [] when there is nothing new to suggest.
+    """
+    existing = prune_hierarchy(accepted, concepts)
+    placed = {normalize_name(entry["concept"]) for entry in existing}
+    new_names = [c["name"] for c in concepts if normalize_name(c["name"]) not in placed]
+
+    if not new_names:
+        if len(existing) == len(accepted):
+            instrumentation.log("✅ Approved hierarchy already covers every approved concept.")
+            return []
+        return existing
+
+    instrumentation.log(f"🧩 Placing {len(new_names)} new concepts into a hierarchy of {len(existing)}")
+    prompt = f"""{guidance}
+
+Based on the rules above, place the NEW learning concepts below into the EXISTING concept hierarchy. Do not change the existing hierarchy. A new concept's parent may be an existing concept or another new concept.
+
+Return your response as a JSON object with a single key "hierarchy", which contains a list of objects, one per NEW concept. Each object must have two keys: "concept" and "parent". If a new concept is a top-level (root) concept, its parent should be null.
+
+EXISTING HIERARCHY:
+{summarize_hierarchy(existing, HIERARCHY_SUMMARY_MAX_CHARS)}
+
+NEW CONCEPTS:
+{json.dumps(new_names)}"""
+
+    placements = call_gemini_for_hierarchy(prompt, bypass_cache)
+    if not placements:
+        return []
+
+    # Merge locally: only accept parents that exist, and never a cycle among the new concepts
+    return existing + merge_placements(new_names, placements, known=[entry["concept"] for entry in existing])
+
 # --- NEW: Function to save the AI's suggestion ---
-def save_suggested_hierarchy(domain_id, hierarchy):
+def save_suggested_hierarchy(domain_id, hierarchy, concepts):
     if not hierarchy:
-        print("No hierarchy data to save.")
+        instrumentation.log("No hierarchy data to save.")
         return
 
-    try:
-        supabase.table("suggested_concept_hierarchies").insert({
-            "domain_id": domain_id,
-            "suggested_structure": hierarchy,
-            "status": "pending"
-        }).execute()
-        print(f"✅ Successfully saved suggested hierarchy to the database.")
-    except Exception as e:
-        print(f"❌ Error saving suggested hierarchy: {e}")
-        traceback.print_exc()
+    # Resolve names to the approved concept IDs and repair cycles/orphans before saving
+    graph = ConceptGraph.from_hierarchy(hierarchy, concepts)
+    if graph.issues:
+        instrumentation.log(f"⚠️ Repaired suggested hierarchy: { {k: len(v) for k, v in graph.issues.items()} }", "WARNING")
+
+    # Errors propagate so the ledger entry fails and Pub/Sub redelivers the message
+    get_supabase().table("suggested_concept_hierarchies").insert({
+        "domain_id": domain_id,
+        "suggested_structure": graph.to_hierarchy(),
+        "graph": graph.to_dict(),
+        "status": "pending"
+    }).execute()
+    instrumentation.log(f"✅ Successfully saved suggested hierarchy to the database.")
 
 
 # --- Start App ---
 if __name__ == "__main__":
-    print("🚀 Starting gemeos-concept-structurer service...")
-    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 8080)))
+    port = int(os.getenv("PORT", 8080))
+    instrumentation.log("🚀 Starting gemeos-concept-structurer service", port=port)
+    warm_up(get_supabase, get_storage_client, lambda: get_gemini_model(GEMINI_MODEL))
+    app.run(host="0.0.0.0", port=port)
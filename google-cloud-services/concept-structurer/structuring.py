@@ -0,0 +1,165 @@
+"""Prompt building, local clustering and merging for concept hierarchies.
+
+Kept free of the Flask/Supabase/Gemini clients so the benchmarks can drive
+the same code with a simulated model.
+"""
+import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from gemeos_common.concept_index import stem_key
+from gemeos_common.text import normalize_name
+
+_STOPWORDS = {
+    "a", "an", "and", "as", "at", "by", "for", "from", "in", "into", "of", "on", "or",
+    "the", "to", "vs", "with", "without", "de", "la", "le", "les", "des", "et", "du",
+}
+
+
+def build_structuring_prompt(guidance, names):
+    return f"""{guidance}
+
+Based on the rules above, analyze the following list of learning concepts. Determine the parent-child relationships between them to form a logical learning hierarchy.
+
+Return your response as a JSON object with a single key "hierarchy", which contains a list of objects. Each object must have two keys: "concept" and "parent". If a concept is a top-level (root) concept, its parent should be null.
+
+LIST OF CONCEPTS:
+{json.dumps(names)}"""
+
+
+def build_linking_prompt(guidance, roots):
+    return f"""{guidance}
+
+The following learning concepts are the top-level concepts of separately structured parts of one domain. Determine the parent-child relationships between them so that the parts form one logical learning hierarchy. Only use concepts from this list as parents.
+
+Return your response as a JSON object with a single key "hierarchy", which contains a list of objects. Each object must have two keys: "concept" and "parent". If a concept stays top-level (root), its parent should be null.
+
+TOP-LEVEL CONCEPTS:
+{json.dumps(roots)}"""
+
+
+def merge_placements(names, placements, known=None):
+    """Turn raw model placements for names into a clean list of {concept, parent}.
+
+    Every name gets exactly one entry. A parent must be another name in the
+    list or one of the known (already placed) names, otherwise the concept
+    becomes a root. Cycles among names are broken at the first concept that
+    closes one.
+    """
+    known = {normalize_name(name): name for name in (known or [])}
+    keys = {}
+    for name in names:
+        keys.setdefault(normalize_name(name), name)
+
+    suggested = {}
+    for entry in placements or []:
+        if not isinstance(entry, dict) or not isinstance(entry.get("concept"), str):
+            continue
+        key = normalize_name(entry["concept"])
+        parent = entry.get("parent")
+        parent = normalize_name(parent) if isinstance(parent, str) and parent.strip() else None
+        if key in keys and key not in suggested and parent != key and \
+                (parent is None or parent in keys or parent in known):
+            suggested[key] = parent
+
+    merged = []
+    for key, name in keys.items():
+        parent = suggested.get(key)
+        seen = {key}
+        walk = parent
+        while walk in keys and walk not in seen:
+            seen.add(walk)
+            walk = suggested.get(walk)
+        if walk in seen:
+            parent = suggested[key] = None
+        merged.append({"concept": name, "parent": known.get(parent) or keys.get(parent)})
+    return merged
+
+
+def _terms(name):
+    return {t for t in stem_key(name).split() if t not in _STOPWORDS and len(t) > 1}
+
+
+def cluster_concepts(names, max_cluster_size=150, min_cluster_size=5):
+    """Group concept names into clusters of at most max_cluster_size by shared terms.
+
+    Each name is filed under its most common (stemmed) term, so "Major
+    Scale", "Minor Scales" and "Scale Degrees" land together; oversized
+    groups are split again on their next most common term. Names that share
+    nothing useful, and groups smaller than min_cluster_size, are put
+    together in term order. Finally, neighbouring groups (which share their
+    parent's term) are packed back together up to max_cluster_size.
+    """
+    terms = [_terms(name) for name in names]
+
+    def split(indices, exclude):
+        if len(indices) <= max_cluster_size:
+            return [indices]
+        df = Counter(t for i in indices for t in terms[i] if t not in exclude)
+        groups = {}
+        for i in indices:
+            candidates = [t for t in terms[i] if t not in exclude and 1 < df[t] < len(indices)]
+            anchor = max(candidates, key=lambda t: (df[t], t)) if candidates else None
+            groups.setdefault(anchor, []).append(i)
+
+        clusters = []
+        leftovers = []
+        for anchor in sorted(groups, key=lambda a: (a is None, a or "")):
+            members = groups[anchor]
+            if anchor is None or len(members) < min_cluster_size:
+                leftovers.extend(members)
+            else:
+                clusters.extend(split(members, exclude | {anchor}))
+        if leftovers and not clusters:
+            # Nothing left to split on lexically
+            return [leftovers[k:k + max_cluster_size] for k in range(0, len(leftovers), max_cluster_size)]
+        for k in range(0, len(leftovers), max_cluster_size):
+            clusters.extend(split(leftovers[k:k + max_cluster_size], exclude))
+        return clusters
+
+    # Splitting leaves many small neighbouring groups; pack them back up to the size limit
+    packed = []
+    for cluster in split(list(range(len(names))), frozenset()):
+        if packed and len(packed[-1]) + len(cluster) <= max_cluster_size:
+            packed[-1].extend(cluster)
+        else:
+            packed.append(list(cluster))
+    return [[names[i] for i in cluster] for cluster in packed]
+
+
+def structure_hierarchically(names, guidance, call_model, max_cluster_size=150, concurrency=4, max_levels=3):
+    """Structure a large concept list cluster by cluster, then link the cluster roots.
+
+    call_model(prompt) returns the raw "hierarchy" list from the model. The
+    clusters are structured concurrently; the roots of all clusters are then
+    linked by one more call (recursively, if there are too many roots for
+    one prompt, up to max_levels deep). If the clusters link nothing (an
+    empty or unparseable response) the roots are left unlinked rather than
+    structured again.
+    """
+    if len(names) <= max_cluster_size:
+        return merge_placements(names, call_model(build_structuring_prompt(guidance, names)))
+
+    clusters = cluster_concepts(names, max_cluster_size)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        results = list(executor.map(
+            lambda cluster: merge_placements(cluster, call_model(build_structuring_prompt(guidance, cluster))),
+            clusters
+        ))
+
+    hierarchy = [entry for result in results for entry in result]
+    roots = [entry["concept"] for entry in hierarchy if entry["parent"] is None]
+    if len(roots) <= 1 or len(roots) >= len(names):
+        return hierarchy
+
+    if len(roots) <= max_cluster_size:
+        links = merge_placements(roots, call_model(build_linking_prompt(guidance, roots)))
+    elif max_levels > 1:
+        links = structure_hierarchically(roots, guidance, call_model, max_cluster_size, concurrency, max_levels - 1)
+    else:
+        return hierarchy
+    root_parents = {entry["concept"]: entry["parent"] for entry in links}
+    for entry in hierarchy:
+        if entry["parent"] is None:
+            entry["parent"] = root_parents.get(entry["concept"])
+    return hierarchy
@@ -0,0 +1,78 @@
+"""Page-indexed chunk sidecars for extracted text.
+
+Splits the extracted pages into chunks with character offsets and writes
+them as a gzip JSONL sidecar next to the upload. The format, and the
+reader for consumers, are in gemeos_common/chunks.py.
+"""
+import os
+import io
+import gzip
+import json
+
+from gemeos_common.chunks import SIDECAR_SUFFIX, SIDECAR_VERSION
+
+CHUNK_TARGET_CHARS = int(os.getenv("CHUNK_TARGET_CHARS", 4000))
+
+
+def _split_text(text, target_chars):
+    """Yield (offset, piece) pieces of roughly target_chars, split at line ends."""
+    start = 0
+    length = 0
+    for line in text.splitlines(keepends=True):
+        if length and length + len(line) > target_chars:
+            yield start, text[start:start + length]
+            start += length
+            length = 0
+        length += len(line)
+        # A single line longer than the target is hard-split
+        while length > target_chars:
+            yield start, text[start:start + target_chars]
+            start += target_chars
+            length -= target_chars
+    if length:
+        yield start, text[start:start + length]
+
+
+def build_chunks(pages, paged=True, target_chars=CHUNK_TARGET_CHARS):
+    """Split page texts into chunks with page numbers and character offsets.
+
+    Offsets refer to "\\n".join(pages). Whitespace-only chunks are dropped.
+    """
+    chunks = []
+    offset = 0
+    for page_index, page_text in enumerate(pages):
+        for piece_offset, piece in _split_text(page_text, target_chars):
+            if piece.strip():
+                chunks.append({
+                    "id": len(chunks),
+                    "page": page_index + 1 if paged else None,
+                    "start": offset + piece_offset,
+                    "end": offset + piece_offset + len(piece),
+                    "text": piece
+                })
+        offset += len(page_text) + 1
+    return chunks
+
+
+def write_chunks_sidecar(bucket, object_path, chunks):
+    """Upload chunks as a gzip JSONL sidecar next to object_path.
+
+    Returns the metadata_json["chunks"] pointer describing the sidecar.
+    """
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb", mtime=0) as gz:
+        for chunk in chunks:
+            gz.write(json.dumps(chunk, ensure_ascii=False).encode("utf-8"))
+            gz.write(b"\n")
+
+    blob = bucket.blob(object_path + SIDECAR_SUFFIX)
+    blob.upload_from_string(buf.getvalue(), content_type="application/gzip")
+    return {
+        "uri": f"gs://{bucket.name}/{blob.name}",
+        "format": "jsonl+gzip",
+        "version": SIDECAR_VERSION,
+        "count": len(chunks),
+        "chars": chunks[-1]["end"] if chunks else 0,
+        "pages": max((c["page"] or 0 for c in chunks), default=0) or None,
+        "compressed_bytes": buf.tell()
+    }
@@ -0,0 +1,414 @@
+"""Streaming download and text extraction helpers for the preprocessor."""
+import os
+import math
+import time
+import signal
+import shutil
+import hashlib
+import logging
+import resource
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import PyPDF2
+from chunking import build_chunks
+
+logger = logging.getLogger(__name__)
+
+# Streaming download limits
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 512 * 1024 * 1024))
+SPOOL_MAX_MEMORY_BYTES = int(os.getenv("SPOOL_MAX_MEMORY_BYTES", 8 * 1024 * 1024))
+SPOOL_DIR = os.getenv("SPOOL_DIR")  # None -> system temp dir
+MAX_TEXT_CHARS = 50000
+
+# Parallel PDF extraction
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", os.cpu_count() or 1))
+# Documents of at most this many pages are extracted inline, without the pool
+PARALLEL_MIN_PAGES = int(os.getenv("PARALLEL_MIN_PAGES", 32))
+MIN_PAGES_PER_TASK = 8
+
+# Per-document extraction budgets
+EXTRACTION_DEADLINE_SECONDS = float(os.getenv("EXTRACTION_DEADLINE_SECONDS", 120))
+EXTRACTION_MAX_RSS_MB = int(os.getenv("EXTRACTION_MAX_RSS_MB", 1024))
+EXTRACTION_MAX_PAGES = int(os.getenv("EXTRACTION_MAX_PAGES", 2000))
+# Stop parsing once this much text has been extracted instead of parsing
+# everything and discarding the tail
+EXTRACTION_MAX_CHARS = int(os.getenv("EXTRACTION_MAX_CHARS", 2_000_000))
+# Extra time the supervisor waits past the deadline before killing workers
+DEADLINE_GRACE_SECONDS = 5
+
+# Extraction statuses recorded in metadata_json["extraction"]["status"]
+STATUS_COMPLETE = "complete"
+STATUS_TRUNCATED = "truncated"
+STATUS_TIMEOUT = "timeout"
+STATUS_MEMORY_LIMIT = "memory_limit"
+STATUS_FAILED = "failed"
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when a GCS object exceeds MAX_UPLOAD_BYTES."""
+
+
+class _HashingSpoolWriter:
+    """File-like sink that hashes and size-checks chunks while spooling them."""
+
+    def __init__(self, spool, max_bytes):
+        self.spool = spool
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadTooLargeError(f"Upload exceeds {self.max_bytes} bytes")
+        self.sha256.update(chunk)
+        return self.spool.write(chunk)
+
+    def flush(self):
+        self.spool.flush()
+
+
+def download_blob_to_spool(blob, max_bytes=MAX_UPLOAD_BYTES):
+    """Stream a blob into a size-capped spooled temp file.
+
+    Small files stay in memory; anything above SPOOL_MAX_MEMORY_BYTES rolls
+    over to disk. The SHA-256 is computed chunk by chunk during the download.
+
+    Returns (spool, size_bytes, content_hash). The caller owns the spool and
+    must close it.
+    """
+    if blob.size is not None and blob.size > max_bytes:
+        raise UploadTooLargeError(f"Upload is {blob.size} bytes, limit is {max_bytes}")
+
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY_BYTES, dir=SPOOL_DIR)
+    writer = _HashingSpoolWriter(spool, max_bytes)
+    try:
+        blob.download_to_file(writer)
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, writer.size, writer.sha256.hexdigest()
+
+class _DeadlineExceeded(Exception):
+    """Raised inside a worker by SIGALRM when the document deadline passes."""
+
+
+def _raise_deadline_exceeded(signum, frame):
+    raise _DeadlineExceeded()
+
+
+def _init_extraction_worker(max_rss_mb):
+    """Pool initializer: cap the worker's address space as a hard memory backstop.
+
+    The soft RSS check in _extract_page_range normally stops a range first;
+    RLIMIT_AS (set at twice the RSS budget to leave room for the interpreter's
+    virtual mappings) turns a runaway allocation into a MemoryError instead of
+    an OOM kill of the whole instance.
+    """
+    limit = max_rss_mb * 2 * 1024 * 1024
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError) as e:
+        logger.warning(f"Could not set worker memory limit: {e}")
+
+
+def _current_rss_mb():
+    """Resident set size of this process in MiB, read from /proc."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # Not Linux: fall back to the peak RSS (KiB on Linux, bytes on macOS)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def get_process_pool():
+    """Lazily create the shared, bounded PDF extraction pool.
+
+    Uses the forkserver start method so workers are forked from a clean,
+    single-threaded server process rather than from the Flask process.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PDF_WORKERS,
+                mp_context=multiprocessing.get_context("forkserver"),
+                initializer=_init_extraction_worker,
+                initargs=(EXTRACTION_MAX_RSS_MB,),
+            )
+        return _process_pool
+
+def _reset_process_pool(kill=False):
+    """Drop the shared pool so the next document gets fresh workers.
+
+    With kill=True, workers still busy with an unresponsive page are
+    terminated; ProcessPoolExecutor has no public API for that.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        pool, _process_pool = _process_pool, None
+    if pool is None:
+        return
+    if kill:
+        for process in list((getattr(pool, "_processes", None) or {}).values()):
+            process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _extract_page_range(path, start, stop, deadline, max_rss_mb, max_chars):
+    """Worker task: extract pages [start, stop) of the PDF at path within budget.
+
+    Returns (page_count, pages, status). Stops early, keeping the pages done
+    so far, when the wall-clock deadline passes, the worker's RSS exceeds
+    max_rss_mb, the range alone has produced max_chars characters, or a page
+    fails to parse.
+    """
+    pages = []
+    page_count = None
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        return None, pages, STATUS_TIMEOUT
+
+    signal.signal(signal.SIGALRM, _raise_deadline_exceeded)
+    signal.setitimer(signal.ITIMER_REAL, remaining)
+    try:
+        pdf_reader = PyPDF2.PdfReader(path)
+        page_count = len(pdf_reader.pages)
+        chars = 0
+        for i in range(start, min(stop, page_count)):
+            pages.append(pdf_reader.pages[i].extract_text())
+            chars += len(pages[-1])
+            if _current_rss_mb() > max_rss_mb:
+                return page_count, pages, STATUS_MEMORY_LIMIT
+            if chars >= max_chars:
+                return page_count, pages, STATUS_TRUNCATED
+        return page_count, pages, STATUS_COMPLETE
+    except _DeadlineExceeded:
+        return None, pages, STATUS_TIMEOUT
+    except MemoryError:
+        return None, pages, STATUS_MEMORY_LIMIT
+    except Exception as e:
+        # A malformed page (PdfReadError, KeyError, ...): keep the pages before it
+        logger.error(f"Extraction of pages {start}-{stop} failed at page {start + len(pages)}: {e!r}")
+        return page_count, pages, STATUS_FAILED
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+def _extract_pages_inline(path, max_pages, deadline, max_chars):
+    """Extract a document of at most PARALLEL_MIN_PAGES pages on the calling thread.
+
+    Small documents are the common upload and finish faster without a worker
+    round trip. The deadline and max_chars are checked between pages (SIGALRM
+    only works on the main thread), which the page limit keeps bounded.
+    Returns (page_count, pages, status), or None if the document is longer
+    and belongs in the pool.
+    """
+    pages = []
+    page_count = None
+    try:
+        pdf_reader = PyPDF2.PdfReader(path)
+        page_count = len(pdf_reader.pages)
+        if page_count > PARALLEL_MIN_PAGES:
+            return None
+        chars = 0
+        for i in range(min(page_count, max_pages)):
+            if time.time() >= deadline:
+                return page_count, pages, STATUS_TIMEOUT
+            pages.append(pdf_reader.pages[i].extract_text())
+            chars += len(pages[-1])
+            if chars >= max_chars:
+                return page_count, pages, STATUS_TRUNCATED
+        return page_count, pages, STATUS_COMPLETE
+    except MemoryError:
+        return page_count, pages, STATUS_MEMORY_LIMIT
+    except Exception as e:
+        logger.error(f"Inline extraction failed at page {len(pages)}: {e!r}")
+        return page_count, pages, STATUS_FAILED
+
+def split_page_ranges(start, stop, workers):
+    """Split range(start, stop) into contiguous (start, stop) ranges.
+
+    Aims for roughly four ranges per worker so a slow range does not leave
+    the other workers idle, but never fewer than MIN_PAGES_PER_TASK pages each.
+    """
+    size = max(MIN_PAGES_PER_TASK, math.ceil((stop - start) / (workers * 4)))
+    return [(lo, min(lo + size, stop)) for lo in range(start, stop, size)]
+
+def _result_or_failure(future):
+    try:
+        return future.result()
+    except BrokenProcessPool as e:
+        # Most likely killed by the kernel for exceeding its memory limit
+        logger.error(f"Extraction worker died: {e}")
+        _reset_process_pool()
+        return None, [], STATUS_FAILED
+    except Exception as e:
+        # Raised outside the worker's own handling (e.g. pickling the task or result);
+        # fail this range only so the pages of the others are kept
+        logger.error(f"Extraction range failed: {e!r}")
+        return None, [], STATUS_FAILED
+
+def _run_ranges(ranges, path, deadline, max_rss_mb, max_chars, chars_so_far, workers):
+    """Run page ranges on the pool, at most `workers` at a time, in a sliding window.
+
+    New ranges are only submitted while the text extracted so far (counting
+    only the contiguous prefix of finished ranges) is under max_chars, so a
+    long document stops being parsed once the budget is met. Ranges still
+    running at the hard deadline are reported as timeouts; their workers are
+    stuck outside Python code (where SIGALRM cannot reach them), so the pool
+    is killed and rebuilt.
+
+    Returns a list of (page_count, pages, status), one per range that was run,
+    in range order.
+    """
+    results = {}
+    running = {}
+    next_range = 0
+    prefix = 0  # ranges [0, prefix) have finished
+    while next_range < len(ranges) or running:
+        while next_range < len(ranges) and len(running) < workers and chars_so_far < max_chars:
+            lo, hi = ranges[next_range]
+            future = get_process_pool().submit(_extract_page_range, path, lo, hi, deadline, max_rss_mb, max_chars)
+            running[future] = next_range
+            next_range += 1
+        if not running:
+            break
+
+        timeout = max(0, deadline + DEADLINE_GRACE_SECONDS - time.time())
+        done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            logger.warning(f"{len(running)} extraction ranges overran the deadline; restarting workers")
+            _reset_process_pool(kill=True)
+            for index in running.values():
+                results[index] = (None, [], STATUS_TIMEOUT)
+            break
+
+        for future in done:
+            results[running.pop(future)] = _result_or_failure(future)
+        while prefix in results:
+            chars_so_far += sum(len(page) for page in results[prefix][1])
+            prefix += 1
+        if any(results[i][2] != STATUS_COMPLETE for i in results):
+            # Budgets are per document: once one range hits one, stop submitting
+            chars_so_far = max_chars
+
+    return [results[i] for i in sorted(results)]
+
+def extract_pages_supervised(path, max_pages=EXTRACTION_MAX_PAGES,
+                             deadline_seconds=EXTRACTION_DEADLINE_SECONDS,
+                             max_rss_mb=EXTRACTION_MAX_RSS_MB, workers=PDF_WORKERS,
+                             max_chars=EXTRACTION_MAX_CHARS):
+    """Extract PDF pages under per-document budgets.
+
+    Documents of at most PARALLEL_MIN_PAGES pages are extracted inline (see
+    _extract_pages_inline). For longer ones the first PARALLEL_MIN_PAGES pages
+    are extracted by a single pool worker, which also reports the page count,
+    and the remaining pages (up to max_pages) are fanned out across the pool
+    and reassembled in page order, stopping once max_chars of text have been
+    extracted.
+
+    Returns (pages, page_count, info) where info is the structured status
+    stored in metadata_json["extraction"].
+    """
+    started = time.time()
+    deadline = started + deadline_seconds
+
+    first_stop = min(PARALLEL_MIN_PAGES, max_pages)
+    inline = _extract_pages_inline(path, first_stop, deadline, max_chars)
+    if inline is not None:
+        results = [inline]
+    else:
+        results = _run_ranges([(0, first_stop)], path, deadline, max_rss_mb, max_chars, 0, 1)
+    page_count = results[0][0]
+
+    if page_count is not None and results[0][2] == STATUS_COMPLETE:
+        stop = min(page_count, max_pages)
+        chars = sum(len(page) for page in results[0][1])
+        if stop > first_stop:
+            ranges = split_page_ranges(first_stop, stop, workers)
+            results.extend(_run_ranges(ranges, path, deadline, max_rss_mb, max_chars, chars, workers))
+
+    pages = [page for _, range_pages, _ in results for page in range_pages]
+    statuses = [status for _, _, status in results]
+    status = next((s for s in statuses if s != STATUS_COMPLETE), STATUS_COMPLETE)
+    if status == STATUS_COMPLETE and page_count is not None and len(pages) < page_count:
+        # Either the page cap or the character budget stopped extraction
+        status = STATUS_TRUNCATED
+
+    info = {
+        "status": status,
+        "pages_extracted": len(pages),
+        "pages_total": page_count,
+        "chars_extracted": sum(len(page) for page in pages),
+        "elapsed_ms": int((time.time() - started) * 1000),
+    }
+    return pages, page_count, info
+
+def _pdf_path_for_workers(pdf_file):
+    """Return (path, tmp) where path is readable by worker processes.
+
+    Worker processes cannot share an in-memory or unnamed spool, so those are
+    copied to a named temp file. tmp is that file (to be closed by the caller)
+    or None when pdf_file already has a usable path.
+    """
+    name = getattr(pdf_file, "name", None)
+    if isinstance(name, str) and os.path.isfile(name):
+        return name, None
+    tmp = tempfile.NamedTemporaryFile(dir=SPOOL_DIR, suffix=".pdf")
+    pdf_file.seek(0)
+    shutil.copyfileobj(pdf_file, tmp)
+    tmp.flush()
+    return tmp.name, tmp
+
+def extract_text_from_pdf(pdf_file):
+    """Extract text from a PDF file object under per-document budgets.
+
+    Only short documents are parsed on the request thread; longer ones go to
+    supervised worker processes, so a huge PDF can only exhaust its own
+    budget. Returns (text, page_count, info, chunks):
+    text is the first MAX_TEXT_CHARS characters and chunks index everything
+    that was extracted by page and character offset.
+    """
+    try:
+        path, tmp = _pdf_path_for_workers(pdf_file)
+        try:
+            pages, page_count, info = extract_pages_supervised(path)
+        finally:
+            if tmp is not None:
+                tmp.close()
+        
+        if info["status"] != STATUS_COMPLETE:
+            logger.warning("PDF extraction stopped early", extra={"fields": {"extraction": info}})
+        logger.info("PDF text extracted", extra={"fields": {
+            "chars_extracted": info["chars_extracted"],
+            "pages_extracted": info["pages_extracted"],
+            "page_count": page_count,
+        }})
+        return _head("\n".join(pages)), page_count, info, build_chunks(pages)
+    except Exception as e:
+        logger.error(f"PDF extraction failed: {e}")
+        return f"[PDF extraction failed: {str(e)}]", None, {"status": STATUS_FAILED, "error": str(e)}, []
+
+def _head(text):
+    return text[:MAX_TEXT_CHARS]
+
+def extract_text_from_file(file_obj, mime_type):
+    """Extract text based on mime type. Returns (text, page_count, info, chunks)."""
+    if mime_type == "application/pdf":
+        return extract_text_from_pdf(file_obj)
+    elif mime_type and "text" in mime_type:
+        # 4 bytes per char is the UTF-8 worst case, so this is enough for EXTRACTION_MAX_CHARS
+        decoded = file_obj.read(EXTRACTION_MAX_CHARS * 4).decode('utf-8', errors='ignore')
+        truncated = len(decoded) > EXTRACTION_MAX_CHARS or file_obj.read(1) != b""
+        text = decoded[:EXTRACTION_MAX_CHARS]
+        info = {"status": STATUS_TRUNCATED if truncated else STATUS_COMPLETE, "chars_extracted": len(text)}
+        return _head(text), None, info, build_chunks([text], paged=False)
+    else:
+        return f"Unsupported file type: {mime_type}", None, {"status": STATUS_FAILED}, []
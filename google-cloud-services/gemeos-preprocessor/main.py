@@ -1,115 +1,213 @@
 import os
 import json
 import logging
+import re
+import sys
 import base64
-import hashlib
+import signal
+import threading
+import traceback
 from datetime import datetime
-from flask import Flask, request, jsonify
-from google.cloud import storage
+from flask import Flask, Response, request, jsonify
 from google.cloud import pubsub_v1
-from supabase import create_client
-import PyPDF2
-import io
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# gemeos_common sits next to the service directories (and next to main.py in the container)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from gemeos_common.chunks import is_sidecar
+from gemeos_common.clients import get_storage_client, get_supabase
+from gemeos_common.instrumentation import Instrumentation
+from gemeos_common.messages import encode_extraction_request
+from gemeos_common.metrics import CONTENT_TYPE
+from gemeos_common.passages import PassageIndex, is_passage_index, write_passage_index
+from publishing import AsyncPublisher
+from chunking import write_chunks_sidecar
+from extraction import STATUS_FAILED, UploadTooLargeError, download_blob_to_spool, extract_text_from_file
+
+# Structured logs (LOG_SAMPLE_RATE, LOG_DEBUG), per-stage timings and /metrics;
+# the logging module (extraction, publishing) goes through the same JSON lines
+instrumentation = Instrumentation("gemeos-preprocessor")
+instrumentation.capture_logging()
+extraction_outcomes = instrumentation.metrics.counter(
+    "extractions_total", "Text extractions by status (complete, truncated, timeout, ...).", ("status",)
+)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-# Initialize clients
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
-
-# Lazy initialization to avoid startup errors
-supabase = None
-storage_client = None
+# Lazy initialization to avoid startup errors; Supabase and GCS clients
+# come from gemeos_common.clients
 publisher_client = None
+extraction_publisher = None
 
-def get_supabase():
-    global supabase
-    if supabase is None and SUPABASE_URL and SUPABASE_KEY:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-    return supabase
+# Pub/Sub publishing: "sync" waits for each message ID before responding;
+# "async" hands messages to the batching client and returns immediately. Async
+# needs CPU allocated outside requests (Cloud Run --no-cpu-throttling), or the
+# client's batch, callback and retry threads stall once the response is sent
+PROJECT_ID = "gemeos-467015"
+EXTRACTION_TOPIC = "content-extraction-requests"
+DEAD_LETTER_TOPIC = os.getenv("PUBLISH_DEAD_LETTER_TOPIC", "content-extraction-requests-dead-letter")
+PUBLISH_MODE = os.getenv("PUBLISH_MODE", "sync")
+PUBLISH_MAX_MESSAGES = int(os.getenv("PUBLISH_MAX_MESSAGES", 100))
+PUBLISH_MAX_BYTES = int(os.getenv("PUBLISH_MAX_BYTES", 1024 * 1024))
+PUBLISH_MAX_LATENCY_SECONDS = float(os.getenv("PUBLISH_MAX_LATENCY_SECONDS", 0.05))
+PUBLISH_MAX_ATTEMPTS = int(os.getenv("PUBLISH_MAX_ATTEMPTS", 3))
 
-def get_storage_client():
-    global storage_client
-    if storage_client is None:
-        storage_client = storage.Client()
-    return storage_client
+# Content-hash dedup counters, reported by /health
+DEDUP_CANDIDATE_LIMIT = 10
+dedup_stats = {"redelivery": 0, "republished": 0, "reused_same_domain": 0, "reused_other_domain": 0, "miss": 0}
+_dedup_stats_lock = threading.Lock()
+
+# domain_id -> slug for the domain_slug in extraction requests, kept for the life of the instance
+domain_slugs = {}
 
 def get_publisher_client():
     global publisher_client
     if publisher_client is None:
-        publisher_client = pubsub_v1.PublisherClient()
+        publisher_client = pubsub_v1.PublisherClient(
+            batch_settings=pubsub_v1.types.BatchSettings(
+                max_messages=PUBLISH_MAX_MESSAGES,
+                max_bytes=PUBLISH_MAX_BYTES,
+                max_latency=PUBLISH_MAX_LATENCY_SECONDS,
+            )
+        )
     return publisher_client
 
-def extract_text_from_pdf(content_bytes):
-    """Extract text from PDF content."""
+def get_extraction_publisher():
+    global extraction_publisher
+    if extraction_publisher is None:
+        publisher = get_publisher_client()
+        dead_letter_topic_path = publisher.topic_path(PROJECT_ID, DEAD_LETTER_TOPIC) if DEAD_LETTER_TOPIC else None
+        if dead_letter_topic_path:
+            try:
+                publisher.get_topic(topic=dead_letter_topic_path)
+            except Exception as e:
+                instrumentation.log(
+                    f"⚠️ Dead-letter topic {dead_letter_topic_path} is not usable, failed publishes will only be counted: {e}",
+                    "WARNING"
+                )
+                dead_letter_topic_path = None
+        extraction_publisher = AsyncPublisher(
+            publisher,
+            publisher.topic_path(PROJECT_ID, EXTRACTION_TOPIC),
+            dead_letter_topic_path=dead_letter_topic_path,
+            max_attempts=PUBLISH_MAX_ATTEMPTS,
+        )
+    return extraction_publisher
+
+def record_dedup(outcome):
+    """Count a dedup outcome: redelivery, republished, reused_same_domain, reused_other_domain or miss."""
+    with _dedup_stats_lock:
+        dedup_stats[outcome] += 1
+
+def get_dedup_stats():
+    with _dedup_stats_lock:
+        return dict(dedup_stats)
+
+instrumentation.metrics.export_stats("dedup", get_dedup_stats)
+instrumentation.metrics.export_stats("publisher", lambda: extraction_publisher.stats() if extraction_publisher else {})
+
+def find_existing_extraction(supabase, content_hash, record):
+    """Find another record with the same content hash whose extraction can be reused.
+
+    Prefers a record in the same domain. Records whose extraction failed are
+    ignored. Returns the record (including extracted_text) or None.
+    """
+    candidates = supabase.table("domain_extracted_files")\
+        .select("id, domain_id, metadata_json")\
+        .eq("content_hash", content_hash)\
+        .neq("id", record["id"])\
+        .not_.is_("extracted_text", "null")\
+        .limit(DEDUP_CANDIDATE_LIMIT)\
+        .execute()
+    
+    usable = [
+        c for c in candidates.data or []
+        if ((c.get("metadata_json") or {}).get("extraction") or {}).get("status") != STATUS_FAILED
+    ]
+    if not usable:
+        return None
+    
+    best = next((c for c in usable if c["domain_id"] == record["domain_id"]), usable[0])
+    text_res = supabase.table("domain_extracted_files")\
+        .select("extracted_text")\
+        .eq("id", best["id"])\
+        .single()\
+        .execute()
+    best["extracted_text"] = text_res.data.get("extracted_text") if text_res.data else None
+    return best if best["extracted_text"] else None
+
+def fetch_domain_slug(supabase, domain_id):
+    """Slug the app uses for a domain (its name, slugified like src/lib/domainUtils.ts), or None."""
+    if domain_id not in domain_slugs:
+        try:
+            res = supabase.table("domains").select("name").eq("id", domain_id).single().execute()
+            name = (res.data or {}).get("name") or ""
+        except Exception as e:
+            instrumentation.log(f"⚠️ Could not look up domain {domain_id}: {e}", "WARNING")
+            return None
+        slug = re.sub(r"[^a-z0-9\s-]", "", name.lower().strip())
+        slug = re.sub(r"-+", "-", re.sub(r"\s+", "-", slug)).strip("-")
+        domain_slugs[domain_id] = slug or None
+    return domain_slugs[domain_id]
+
+def mark_published(supabase, record_id, metadata, message_id):
+    """Record the confirmed message ID in metadata_json.published.
+
+    Redeliveries of the upload notification only skip publishing once this is set.
+    """
+    published = {"message_id": message_id, "published_at": datetime.utcnow().isoformat()}
     try:
-        pdf_file = io.BytesIO(content_bytes)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        
-        text = []
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            text.append(page.extract_text())
-        
-        full_text = "\n".join(text)
-        print(f"📄 Extracted {len(full_text)} characters from PDF")
-        return full_text[:50000]  # Limit to 50k chars
+        supabase.table("domain_extracted_files")\
+            .update({"metadata_json": {**metadata, "published": published}})\
+            .eq("id", record_id)\
+            .execute()
     except Exception as e:
-        logger.error(f"PDF extraction failed: {e}")
-        return f"[PDF extraction failed: {str(e)}]"
-
-def extract_text_from_file(content_bytes, mime_type):
-    """Extract text based on mime type."""
-    if mime_type == "application/pdf":
-        return extract_text_from_pdf(content_bytes)
-    elif mime_type and "text" in mime_type:
-        return content_bytes.decode('utf-8', errors='ignore')[:50000]
-    else:
-        return f"Unsupported file type: {mime_type}"
-
-def calculate_content_hash(content_bytes):
-    """Calculate SHA-256 hash of content."""
-    return hashlib.sha256(content_bytes).hexdigest()
-
-def publish_extraction_request(record_id, domain_id, file_path, extracted_text, content_hash, metadata):
-    """Publish message to content-extraction-requests topic for extractor services."""
+        instrumentation.log(f"⚠️ Could not record published extraction request {message_id}: {e}", "WARNING")
+
+def publish_extraction_request(record_id, domain_id, file_path, content_hash, metadata, text_chars=None,
+                               domain_slug=None, on_published=None):
+    """Publish a claim-check message to content-extraction-requests for extractor services.
+
+    The message points at the text stored in domain_extracted_files instead of
+    embedding it; see gemeos_common/messages.py for the schema. Returns the message ID in
+    sync mode, "queued" in async mode, or None if publishing failed. on_published is
+    called with the message ID once Pub/Sub has confirmed the message.
+    """
     try:
-        publisher = get_publisher_client()
-        topic_path = publisher.topic_path("gemeos-467015", "content-extraction-requests")
-        
-        message_data = {
-            "record_id": record_id,
-            "domain_id": domain_id, 
-            "file_path": file_path,
-            "extracted_text": extracted_text,
-            "content_hash": content_hash,
-            "metadata": metadata,
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        
-        # Publish the message
-        future = publisher.publish(
-            topic_path,
-            json.dumps(message_data).encode('utf-8'),
+        data, attributes = encode_extraction_request(
             record_id=record_id,
-            domain_id=domain_id
+            domain_id=domain_id,
+            domain_slug=domain_slug,
+            file_path=file_path,
+            content_hash=content_hash,
+            metadata=metadata,
+            text_chars=text_chars
         )
         
+        if PUBLISH_MODE == "async":
+            # Delivery is tracked by the publisher's completion callbacks
+            get_extraction_publisher().publish(data, on_published=on_published, **attributes)
+            instrumentation.log(f"📢 Queued extraction request ({len(data)} bytes)")
+            return "queued"
+        
+        publisher = get_publisher_client()
+        topic_path = publisher.topic_path(PROJECT_ID, EXTRACTION_TOPIC)
+        future = publisher.publish(topic_path, data, **attributes)
+        
         message_id = future.result()
-        print(f"📢 Published extraction request: {message_id}")
+        instrumentation.log(f"📢 Published extraction request: {message_id} ({len(data)} bytes)")
+        if on_published:
+            on_published(message_id)
         return message_id
         
     except Exception as e:
-        print(f"❌ Failed to publish extraction request: {e}")
+        instrumentation.log(f"❌ Failed to publish extraction request: {e}", "ERROR")
         return None
 
 @app.route("/", methods=["POST"])
 def handle_pubsub():
     """Handle Pub/Sub messages from GCS."""
+    trace = instrumentation.trace("upload")
     try:
         envelope = request.get_json()
         if not envelope:
@@ -120,6 +218,8 @@ def handle_pubsub():
 
         pubsub_message = envelope["message"]
         
+        instrumentation.observe_message(pubsub_message)
+        
         # Decode the Pub/Sub message
         if "data" in pubsub_message:
             data = base64.b64decode(pubsub_message["data"]).decode("utf-8")
@@ -131,96 +231,171 @@ def handle_pubsub():
         bucket_name = message_data.get("bucket")
         file_path = message_data.get("name")
         
-        print(f"📥 File uploaded: gs://{bucket_name}/{file_path}")
+        trace.annotate(object=f"gs://{bucket_name}/{file_path}")
         
         # Skip .keep files
         if file_path.endswith('.keep'):
-            print("Skipping .keep file")
+            trace.finish("skipped", reason="keep file")
+            return "", 200
+        
+        # Skip the chunk sidecars and passage indexes this service writes itself
+        if is_sidecar(file_path) or is_passage_index(file_path):
+            trace.finish("skipped", reason="chunk sidecar / passage index")
             return "", 200
         
         # Download file from GCS
         storage_client = get_storage_client()
         bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(file_path)
-        
-        # Download to memory
-        content_bytes = blob.download_as_bytes()
-        print(f"✅ File downloaded to memory")
+        blob = trace.timed("gcs_metadata", bucket.get_blob, file_path)
+        if blob is None:
+            trace.finish("not_found", "ERROR")
+            return jsonify({"error": "Object not found"}), 404
         
         # Get file metadata
         mime_type = blob.content_type or "application/octet-stream"
-        print(f"📄 Detected MIME type: {mime_type}")
+        trace.annotate(mime_type=mime_type)
         
-        # Extract text content
-        extracted_text = extract_text_from_file(content_bytes, mime_type)
-        print(f"📄 Extracted content preview:")
-        print(extracted_text[:500])  # Show first 500 chars
+        # Stream to a spooled temp file, hashing as we go
+        try:
+            spool, size_bytes, content_hash = trace.timed("download", download_blob_to_spool, blob)
+        except UploadTooLargeError as e:
+            # Ack the message: redelivering an oversized upload can never succeed
+            trace.finish("too_large", "ERROR", error=str(e))
+            return jsonify({"skipped": True, "error": str(e)}), 200
+        trace.annotate(size_bytes=size_bytes, sha256=content_hash[:12])
         
-        # Calculate content hash
-        content_hash = calculate_content_hash(content_bytes)
+        supabase = get_supabase(required=False)
+        if not supabase:
+            spool.close()
+            trace.finish("error", error="Supabase client not initialized")
+            return jsonify({"error": "Database not configured"}), 500
         
-        # Find matching record in database by bucket_path
-        supabase = get_supabase()
-        if supabase:
+        with spool:
             try:
-                # Query using bucket_path which should match the file path from GCS
-                result = supabase.table("domain_extracted_files")\
-                    .select("*")\
-                    .eq("bucket_path", file_path)\
-                    .single()\
-                    .execute()
+                # Find matching record in database by bucket_path
+                with trace.stage("lookup"):
+                    result = supabase.table("domain_extracted_files")\
+                        .select("*")\
+                        .eq("bucket_path", file_path)\
+                        .single()\
+                        .execute()
+                
+                if not result.data:
+                    trace.finish("no_record", "ERROR")
+                    return jsonify({"error": "No matching database record found"}), 404
+                
+                record = result.data
+                trace.annotate(record_id=record["id"])
+                
+                # Redelivery of a notification we already processed: nothing to do once
+                # its extraction request was confirmed, otherwise publish that again
+                already_extracted = record.get("content_hash") == content_hash and record.get("extracted_text")
+                if already_extracted and (record.get("metadata_json") or {}).get("published"):
+                    record_dedup("redelivery")
+                    trace.finish("redelivery")
+                    return jsonify({
+                        "success": True,
+                        "record_id": record["id"],
+                        "deduplicated": "redelivery"
+                    }), 200
                 
-                if result.data:
-                    record = result.data
-                    print(f"✅ Found matching database record: {record['id']}")
+                if already_extracted:
+                    record_dedup("republished")
+                    trace.log("🔁 Extraction request was never confirmed; publishing it again")
+                    extracted_text = record["extracted_text"]
+                    metadata = dict(record.get("metadata_json") or {})
+                    same_domain = False
+                else:
+                    existing = trace.timed("dedup", find_existing_extraction, supabase, content_hash, record)
+                    if existing:
+                        same_domain = existing["domain_id"] == record["domain_id"]
+                        record_dedup("reused_same_domain" if same_domain else "reused_other_domain")
+                        trace.log(f"♻️ Reusing extraction from record {existing['id']}")
+                        extracted_text = existing["extracted_text"]
+                        metadata = dict(existing.get("metadata_json") or {})
+                        metadata["deduplicated_from"] = existing["id"]
+                        if not same_domain:
+                            # This record's own extraction request has not been published yet
+                            metadata.pop("published", None)
+                    else:
+                        same_domain = False
+                        record_dedup("miss")
+                        # Extract text content and page count in one parse
+                        extracted_text, page_count, extraction_info, chunks = trace.timed(
+                            "extract", extract_text_from_file, spool, mime_type
+                        )
+                        trace.log("📄 Extracted content preview", "DEBUG", preview=extracted_text[:500])
+                        extraction_outcomes.inc(status=(extraction_info or {}).get("status", "unknown"))
+                        metadata = {
+                            "mime_type": mime_type,
+                            "pages": page_count,
+                            "extraction": extraction_info
+                        }
+                        if chunks:
+                            try:
+                                metadata["chunks"] = trace.timed("sidecar", write_chunks_sidecar, bucket, file_path, chunks)
+                                trace.log(f"✅ Wrote {len(chunks)} chunks to {metadata['chunks']['uri']}")
+                            except Exception as e:
+                                trace.log(f"⚠️ Could not write chunk sidecar: {e}", "WARNING")
+                            # BM25 index so learning-goal prompts only carry the passages about a concept
+                            try:
+                                with trace.stage("passages"):
+                                    metadata["passages"] = write_passage_index(bucket, file_path, PassageIndex.build(chunks))
+                                trace.log(f"✅ Indexed {metadata['passages']['count']} passages to {metadata['passages']['uri']}")
+                            except Exception as e:
+                                trace.log(f"⚠️ Could not write passage index: {e}", "WARNING")
+                    metadata["size_bytes"] = size_bytes
+                    metadata["extraction_timestamp"] = datetime.utcnow().isoformat()
                     
                     # Update the record with extracted content (without status field for now)
                     update_data = {
                         "extracted_text": extracted_text,
                         "content_hash": content_hash,
-                        "metadata_json": {
-                            "mime_type": mime_type,
-                            "size_bytes": len(content_bytes),
-                            "extraction_timestamp": datetime.utcnow().isoformat(),
-                            "pages": len(PyPDF2.PdfReader(io.BytesIO(content_bytes)).pages) if mime_type == "application/pdf" else None
-                        }
+                        "metadata_json": metadata
                     }
                     
-                    update_result = supabase.table("domain_extracted_files")\
-                        .update(update_data)\
-                        .eq("id", record["id"])\
-                        .execute()
-                    
-                    print(f"✅ Updated database record with extracted content")
-                    
-                    # Publish extraction request for the three extractor services
+                    with trace.stage("save"):
+                        supabase.table("domain_extracted_files")\
+                            .update(update_data)\
+                            .eq("id", record["id"])\
+                            .execute()
+                
+                # The domain already has concepts for this exact content, so
+                # don't trigger the downstream Gemini services again
+                if same_domain:
+                    trace.finish("reused_same_domain", text_chars=len(extracted_text))
+                    return jsonify({
+                        "success": True,
+                        "record_id": record["id"],
+                        "deduplicated": "reused_same_domain"
+                    }), 200
+                
+                # Publish extraction request for the three extractor services
+                with trace.stage("publish"):
                     message_id = publish_extraction_request(
                         record_id=record["id"],
                         domain_id=record["domain_id"],
+                        domain_slug=fetch_domain_slug(supabase, record["domain_id"]),
                         file_path=f"gs://{bucket_name}/{file_path}",
-                        extracted_text=extracted_text,
                         content_hash=content_hash,
-                        metadata=update_data["metadata_json"]
+                        metadata=metadata,
+                        text_chars=len(extracted_text),
+                        on_published=lambda message_id: mark_published(supabase, record["id"], metadata, message_id)
                     )
-                    
-                    return jsonify({
-                        "success": True, 
-                        "record_id": record["id"],
-                        "message_id": message_id
-                    }), 200
-                else:
-                    print(f"❌ No matching record found for path: {file_path}")
-                    return jsonify({"error": "No matching database record found"}), 404
+                trace.finish(text_chars=len(extracted_text), message_id=message_id)
+                
+                return jsonify({
+                    "success": True, 
+                    "record_id": record["id"],
+                    "message_id": message_id
+                }), 200
                     
             except Exception as e:
-                print(f"❌ Database error: {str(e)}")
+                trace.finish("error", error=f"Database error: {e}", traceback=traceback.format_exc())
                 return jsonify({"error": str(e)}), 500
-        else:
-            print("❌ Supabase client not initialized")
-            return jsonify({"error": "Database not configured"}), 500
             
     except Exception as e:
-        print(f"❌ Error processing message: {e}")
+        trace.finish("error", error=str(e), traceback=traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
 @app.route("/health", methods=["GET"])
@@ -229,10 +404,26 @@ def health():
     return jsonify({
         "status": "healthy",
         "service": "gemeos-preprocessor-gcs",
-        "timestamp": datetime.utcnow().isoformat()
+        "timestamp": datetime.utcnow().isoformat(),
+        "dedup": get_dedup_stats(),
+        "publisher": extraction_publisher.stats() if extraction_publisher else None,
+        "instrumentation": instrumentation.stats()
     }), 200
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus metrics: request outcomes, stage durations, queue lag, dedup and publisher counters."""
+    return Response(instrumentation.metrics.render(), content_type=CONTENT_TYPE)
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8080))
-    print(f"Starting GCS Preprocessor on port {port}")
+    instrumentation.log("Starting GCS Preprocessor", port=port)
+    
+    def _flush_and_exit(signum, frame):
+        # Cloud Run sends SIGTERM before stopping the instance; drain queued publishes
+        if extraction_publisher and not extraction_publisher.flush(timeout=8):
+            instrumentation.log("Shutdown with extraction requests still in flight", "WARNING")
+        sys.exit(0)
+    
+    signal.signal(signal.SIGTERM, _flush_and_exit)
     app.run(host="0.0.0.0", port=port, debug=False)
\ No newline at end of file
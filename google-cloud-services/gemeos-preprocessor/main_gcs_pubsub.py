@@ -1,18 +1,22 @@
 import os
+import sys
 import json
-import logging
 import base64
-import hashlib
 from datetime import datetime
 from flask import Flask, request, jsonify
 from google.cloud import storage
 from supabase import create_client
-import PyPDF2
-import io
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+# gemeos_common sits next to the service directories (and next to main.py in the container)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from gemeos_common.chunks import is_sidecar
+from gemeos_common.instrumentation import Instrumentation
+from gemeos_common.passages import is_passage_index
+from extraction import UploadTooLargeError, download_blob_to_spool, extract_text_from_file
+
+# Structured JSON logs (LOG_SAMPLE_RATE, LOG_DEBUG), as in main.py
+instrumentation = Instrumentation("gemeos-preprocessor-gcs")
+instrumentation.capture_logging()
 
 app = Flask(__name__)
 
@@ -22,37 +26,6 @@ SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY) if SUPABASE_URL and SUPABASE_KEY else None
 storage_client = storage.Client()
 
-def extract_text_from_pdf(content_bytes):
-    """Extract text from PDF content."""
-    try:
-        pdf_file = io.BytesIO(content_bytes)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        
-        text = []
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            text.append(page.extract_text())
-        
-        full_text = "\n".join(text)
-        print(f"📄 Extracted {len(full_text)} characters from PDF")
-        return full_text[:50000]  # Limit to 50k chars
-    except Exception as e:
-        logger.error(f"PDF extraction failed: {e}")
-        return f"[PDF extraction failed: {str(e)}]"
-
-def extract_text_from_file(content_bytes, mime_type):
-    """Extract text based on mime type."""
-    if mime_type == "application/pdf":
-        return extract_text_from_pdf(content_bytes)
-    elif mime_type and "text" in mime_type:
-        return content_bytes.decode('utf-8', errors='ignore')[:50000]
-    else:
-        return f"Unsupported file type: {mime_type}"
-
-def calculate_content_hash(content_bytes):
-    """Calculate SHA-256 hash of content."""
-    return hashlib.sha256(content_bytes).hexdigest()
-
 @app.route("/", methods=["POST"])
 def handle_pubsub():
     """Handle Pub/Sub messages from GCS."""
@@ -77,32 +50,44 @@ def handle_pubsub():
         bucket_name = message_data.get("bucket")
         file_path = message_data.get("name")
         
-        print(f"📥 File uploaded: gs://{bucket_name}/{file_path}")
+        instrumentation.log("File uploaded", bucket=bucket_name, file_path=file_path)
         
         # Skip .keep files
         if file_path.endswith('.keep'):
-            print("Skipping .keep file")
+            instrumentation.log("Skipping .keep file", file_path=file_path)
+            return "", 200
+        
+        # Skip the chunk sidecars and passage indexes the preprocessor writes next to each upload
+        if is_sidecar(file_path) or is_passage_index(file_path):
+            instrumentation.log("Skipping chunk sidecar / passage index", file_path=file_path)
             return "", 200
         
         # Download file from GCS
         bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(file_path)
-        
-        # Download to memory
-        content_bytes = blob.download_as_bytes()
-        print(f"✅ File downloaded to memory")
+        blob = bucket.get_blob(file_path)
+        if blob is None:
+            instrumentation.log("Object not found", "ERROR", bucket=bucket_name, file_path=file_path)
+            return jsonify({"error": "Object not found"}), 404
         
         # Get file metadata
         mime_type = blob.content_type or "application/octet-stream"
-        print(f"📄 Detected MIME type: {mime_type}")
         
-        # Extract text content
-        extracted_text = extract_text_from_file(content_bytes, mime_type)
-        print(f"📄 Extracted content preview:")
-        print(extracted_text[:500])  # Show first 500 chars
+        # Stream to a spooled temp file, hashing as we go
+        try:
+            spool, size_bytes, content_hash = download_blob_to_spool(blob)
+        except UploadTooLargeError as e:
+            # Ack the message: redelivering an oversized upload can never succeed
+            instrumentation.log("Upload too large", "WARNING", file_path=file_path, error=str(e))
+            return jsonify({"skipped": True, "error": str(e)}), 200
+        instrumentation.log("File streamed to spool", file_path=file_path, mime_type=mime_type, size_bytes=size_bytes)
         
-        # Calculate content hash
-        content_hash = calculate_content_hash(content_bytes)
+        # Extract text content and page count in one parse
+        with spool:
+            extracted_text, page_count, extraction_info, _ = extract_text_from_file(spool, mime_type)
+        instrumentation.log(
+            "Text extracted", file_path=file_path, chars=len(extracted_text),
+            status=extraction_info.get("status")
+        )
         
         # Find matching record in database by bucket_path
         if supabase:
@@ -116,7 +101,7 @@ def handle_pubsub():
                 
                 if result.data:
                     record = result.data
-                    print(f"✅ Found matching database record: {record['id']}")
+                    instrumentation.log("Found matching database record", file_path=file_path, record_id=record["id"])
                     
                     # Update the record with extracted content
                     update_data = {
@@ -125,9 +110,10 @@ def handle_pubsub():
                         "status": "completed",
                         "metadata_json": {
                             "mime_type": mime_type,
-                            "size_bytes": len(content_bytes),
+                            "size_bytes": size_bytes,
                             "extraction_timestamp": datetime.utcnow().isoformat(),
-                            "pages": len(PyPDF2.PdfReader(io.BytesIO(content_bytes)).pages) if mime_type == "application/pdf" else None
+                            "pages": page_count,
+                            "extraction": extraction_info
                         }
                     }
                     
@@ -136,21 +122,21 @@ def handle_pubsub():
                         .eq("id", record["id"])\
                         .execute()
                     
-                    print(f"✅ Updated database record with extracted content")
+                    instrumentation.log("Updated database record with extracted content", record_id=record["id"])
                     return jsonify({"success": True, "record_id": record["id"]}), 200
                 else:
-                    print(f"❌ No matching record found for path: {file_path}")
+                    instrumentation.log("No matching database record", "ERROR", file_path=file_path)
                     return jsonify({"error": "No matching database record found"}), 404
                     
             except Exception as e:
-                print(f"❌ Database error: {str(e)}")
+                instrumentation.log("Database error", "ERROR", file_path=file_path, error=str(e))
                 return jsonify({"error": str(e)}), 500
         else:
-            print("❌ Supabase client not initialized")
+            instrumentation.log("Supabase client not initialized", "ERROR")
             return jsonify({"error": "Database not configured"}), 500
             
     except Exception as e:
-        print(f"❌ Error processing message: {e}")
+        instrumentation.log("Error processing message", "ERROR", error=str(e))
         return jsonify({"error": str(e)}), 500
 
 @app.route("/health", methods=["GET"])
@@ -164,5 +150,5 @@ def health():
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8080))
-    print(f"Starting GCS Preprocessor on port {port}")
+    instrumentation.log("Starting GCS Preprocessor", port=port)
     app.run(host="0.0.0.0", port=port, debug=False)
\ No newline at end of file
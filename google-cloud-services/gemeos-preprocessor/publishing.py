@@ -0,0 +1,164 @@
+"""Non-blocking, batched Pub/Sub publishing with retry and dead-letter handling."""
+import time
+import random
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPublisher:
+    """Publishes without waiting for the server acknowledgement.
+
+    Messages are handed to the client library, which batches them according
+    to the client's BatchSettings. Completion callbacks record latency and,
+    on failure, schedule a re-publish with exponential backoff. After
+    max_attempts the message goes to the dead-letter topic. on_published,
+    if given to publish, is called with the message ID once the server has
+    acknowledged the message (after any retries).
+    """
+
+    def __init__(self, client, topic_path, dead_letter_topic_path=None, max_attempts=3, retry_base_delay=1.0):
+        self.client = client
+        self.topic_path = topic_path
+        self.dead_letter_topic_path = dead_letter_topic_path
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._idle = threading.Condition(self._lock)
+        self._stats = {
+            "published": 0,
+            "failed_attempts": 0,
+            "retried": 0,
+            "dead_lettered": 0,
+            "dead_letter_failed": 0,
+            "latency_ms_sum": 0.0,
+            "latency_ms_max": 0.0,
+            "bytes_sum": 0,
+            # Messages still in flight when each one was handed over; a proxy
+            # for how full the client's current batch was
+            "in_flight_at_publish_sum": 0,
+            "publish_calls": 0
+        }
+
+    def publish(self, data, attempt=1, on_published=None, **attributes):
+        """Hand a message to the client and return immediately."""
+        with self._lock:
+            self._stats["in_flight_at_publish_sum"] += self._in_flight
+            self._stats["publish_calls"] += 1
+            self._stats["bytes_sum"] += len(data)
+            self._in_flight += 1
+        started = time.monotonic()
+        try:
+            future = self.client.publish(self.topic_path, data, **attributes)
+        except Exception:
+            self._settle()
+            raise
+        future.add_done_callback(lambda f: self._on_done(f, started, data, attempt, attributes, on_published))
+
+    def _on_done(self, future, started, data, attempt, attributes, on_published=None):
+        latency_ms = (time.monotonic() - started) * 1000
+        error = future.exception()
+        with self._lock:
+            if error is None:
+                self._stats["published"] += 1
+                self._stats["latency_ms_sum"] += latency_ms
+                self._stats["latency_ms_max"] = max(self._stats["latency_ms_max"], latency_ms)
+            else:
+                self._stats["failed_attempts"] += 1
+
+        try:
+            if error is not None:
+                self._handle_failure(error, data, attempt, attributes, on_published)
+            elif on_published is not None:
+                on_published(future.result())
+        except Exception as e:
+            logger.error(f"Publish completion handling failed: {e}")
+        finally:
+            self._settle()
+
+    def _settle(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._idle.notify_all()
+
+    def _handle_failure(self, error, data, attempt, attributes, on_published=None):
+        if attempt < self.max_attempts:
+            delay = self.retry_base_delay * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+            logger.warning(f"Publish attempt {attempt} failed ({error}); retrying in {delay:.1f}s")
+            with self._lock:
+                self._stats["retried"] += 1
+                # Keep the message counted as in flight until the retry is handed over
+                self._in_flight += 1
+
+            def retry():
+                try:
+                    self.publish(data, attempt=attempt + 1, on_published=on_published, **attributes)
+                except Exception as e:
+                    # The client refused the message outright; count it as a failed attempt
+                    with self._lock:
+                        self._stats["failed_attempts"] += 1
+                    self._handle_failure(e, data, attempt + 1, attributes, on_published)
+                finally:
+                    self._settle()
+
+            timer = threading.Timer(delay, retry)
+            timer.daemon = True
+            timer.start()
+            return
+
+        logger.error(f"Publish failed after {attempt} attempts: {error}")
+        self._dead_letter(data, attributes, error)
+
+    def _dead_letter(self, data, attributes, error):
+        if not self.dead_letter_topic_path:
+            with self._lock:
+                self._stats["dead_letter_failed"] += 1
+            return
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = self.client.publish(
+                self.dead_letter_topic_path, data, publish_error=str(error)[:1024], **attributes
+            )
+        except Exception as e:
+            with self._lock:
+                self._stats["dead_letter_failed"] += 1
+            self._settle()
+            logger.error(f"Dead-letter publish failed, message lost: {e} attributes={attributes}")
+            return
+        future.add_done_callback(lambda f: self._on_dead_letter_done(f, attributes))
+
+    def _on_dead_letter_done(self, future, attributes):
+        error = future.exception()
+        with self._lock:
+            if error is None:
+                self._stats["dead_lettered"] += 1
+            else:
+                self._stats["dead_letter_failed"] += 1
+        self._settle()
+        if error is not None:
+            logger.error(f"Dead-letter publish failed, message lost: {error} attributes={attributes}")
+
+    def flush(self, timeout=30):
+        """Block until every in-flight message (including retries) has settled."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._in_flight > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = self._in_flight
+        published = stats["published"]
+        calls = stats["publish_calls"]
+        stats["latency_ms_avg"] = stats["latency_ms_sum"] / published if published else 0.0
+        stats["avg_in_flight_at_publish"] = stats["in_flight_at_publish_sum"] / calls if calls else 0.0
+        stats["avg_message_bytes"] = stats["bytes_sum"] / calls if calls else 0.0
+        return stats
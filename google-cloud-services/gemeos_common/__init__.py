@@ -0,0 +1,5 @@
+"""Helpers shared by the Gemeos Cloud Run services.
+
+The services are built with google-cloud-services/ as the Docker build
+context so this package is copied next to each service's main.py.
+"""
@@ -0,0 +1,71 @@
+"""Reading the page-indexed chunk sidecars the preprocessor writes.
+
+Besides the first 50,000 characters stored in
+domain_extracted_files.extracted_text, the preprocessor writes every
+extracted chunk to a gzip-compressed JSONL sidecar next to the upload:
+
+    gs://<bucket>/<object>.chunks.jsonl.gz
+
+One JSON object per line, ordered by offset:
+
+    {"id": 0, "page": 1, "start": 0, "end": 3987, "text": "..."}
+
+"page" is 1-based (null for non-paged files). "start"/"end" are character
+offsets into the full text, with pages joined by a single newline.
+metadata_json.chunks points at the sidecar. Consumers stream it with
+iter_chunks and stop reading as soon as they have the pages or character
+range they need.
+"""
+import gzip
+import json
+
+SIDECAR_SUFFIX = ".chunks.jsonl.gz"
+SIDECAR_VERSION = 1
+
+
+def is_sidecar(object_path):
+    return object_path.endswith(SIDECAR_SUFFIX)
+
+
+def iter_chunks(storage_client, uri, pages=None, start=None, end=None):
+    """Stream chunks from a sidecar, optionally filtered.
+
+    pages is a collection of 1-based page numbers; start/end select chunks
+    overlapping that character range. Reading stops once chunks are past the
+    requested pages or range, so only the needed prefix is downloaded.
+    """
+    if not uri.startswith("gs://"):
+        raise ValueError(f"Unsupported sidecar URI: {uri}")
+    bucket_name, _, object_path = uri[len("gs://"):].partition("/")
+    blob = storage_client.bucket(bucket_name).blob(object_path)
+    last_page = max(pages) if pages else None
+
+    with blob.open("rb") as raw, gzip.GzipFile(fileobj=raw) as gz:
+        for line in gz:
+            chunk = json.loads(line)
+            if end is not None and chunk["start"] >= end:
+                return
+            if last_page is not None and chunk["page"] is not None and chunk["page"] > last_page:
+                return
+            if start is not None and chunk["end"] <= start:
+                continue
+            if pages is not None and chunk["page"] not in pages:
+                continue
+            yield chunk
+
+
+def read_text(storage_client, uri, max_chars=None):
+    """Return the first max_chars characters of the text a sidecar indexes.
+
+    Whitespace-only stretches the preprocessor dropped between chunks come
+    back as a single newline, so offsets are only approximate past a gap.
+    """
+    parts = []
+    position = 0
+    for chunk in iter_chunks(storage_client, uri, end=max_chars):
+        if chunk["start"] > position:
+            parts.append("\n")
+        parts.append(chunk["text"])
+        position = chunk["end"]
+    text = "".join(parts)
+    return text[:max_chars] if max_chars is not None else text
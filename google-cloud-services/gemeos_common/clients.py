@@ -0,0 +1,124 @@
+"""Process-wide API clients, created on first use.
+
+The client libraries (supabase, google-cloud-storage, google-generativeai)
+are imported inside the factories, so importing a service module no longer
+pays for them and the container starts listening sooner. Each client is
+created once per process, under a lock, however many request threads ask
+for it at the same time.
+
+warm_up() builds them in a background thread right after startup, so the
+first request usually finds them ready without holding up the port.
+"""
+import os
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LazyClient:
+    """A value built by factory() on the first get(), once, thread-safely."""
+
+    def __init__(self, factory, name=None):
+        self.factory = factory
+        self.name = name or getattr(factory, "__name__", "client")
+        self.created_seconds = None
+        self._value = None
+        self._created = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._created:
+            return self._value
+        with self._lock:
+            if not self._created:
+                started = time.perf_counter()
+                self._value = self.factory()
+                self.created_seconds = time.perf_counter() - started
+                self._created = True
+        return self._value
+
+    @property
+    def created(self):
+        return self._created
+
+
+def _create_supabase():
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_SERVICE_KEY")
+    if not (url and key):
+        return None
+    from supabase import create_client
+    return create_client(url, key)
+
+
+def _create_storage_client():
+    from google.cloud import storage
+    return storage.Client()
+
+
+def _configure_genai():
+    import google.generativeai as genai
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    return genai
+
+
+_supabase = LazyClient(_create_supabase, "supabase")
+_storage = LazyClient(_create_storage_client, "storage")
+_genai = LazyClient(_configure_genai, "genai")
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_supabase(required=True):
+    """The Supabase client; None if SUPABASE_URL/SUPABASE_SERVICE_KEY are unset and not required."""
+    client = _supabase.get()
+    if client is None and required:
+        raise RuntimeError("SUPABASE_URL and SUPABASE_SERVICE_KEY must be set")
+    return client
+
+
+def get_storage_client():
+    return _storage.get()
+
+
+def get_gemini_model(model_name):
+    """A GenerativeModel per model name, shared by every request thread.
+
+    Generation settings are passed per call (generate_content(...,
+    generation_config=...)), so one model object serves all prompts.
+    """
+    model = _models.get(model_name)
+    if model is None:
+        genai = _genai.get()
+        with _models_lock:
+            model = _models.get(model_name)
+            if model is None:
+                model = _models[model_name] = genai.GenerativeModel(model_name)
+    return model
+
+
+def warm_up(*getters):
+    """Call getters (e.g. get_supabase, get_storage_client) in a daemon thread; returns the thread."""
+    def run():
+        for getter in getters:
+            try:
+                getter()
+            except Exception as e:
+                logger.warning(f"Client warm-up failed for {getattr(getter, '__name__', getter)}: {e}")
+
+    thread = threading.Thread(target=run, name="client-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def stats():
+    """Whether each client exists yet and how long it took to create."""
+    clients = [_supabase, _storage, _genai]
+    stats = {
+        client.name: {"created": client.created, "created_ms": round((client.created_seconds or 0) * 1000, 1)}
+        for client in clients
+    }
+    stats["gemini_models"] = len(_models)
+    return stats
@@ -0,0 +1,114 @@
+"""Per-key request coalescing with a single-flight guard."""
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+# submit() outcomes
+LEADER = "leader"        # this request ran the work
+COALESCED = "coalesced"  # another in-flight request for the key ran it
+
+
+# Resolves a waiting request's future when it is handed the next run
+_PROMOTED = object()
+
+
+class _KeyState:
+    def __init__(self):
+        self.pending = []  # (payload, future) not yet handed to fn
+        self.running = False
+
+
+class Coalescer:
+    """Collapse requests for the same key arriving within window seconds into one run.
+
+    The first request for a key becomes the leader: it waits window seconds,
+    then calls fn(payloads) with the payloads of every request received so
+    far. Requests arriving meanwhile add their payload and wait for the run
+    that includes it. If any arrive while fn is running, the leader returns
+    once its own run is done and hands the next run to the first of them,
+    which starts it straight away (the run it waited for served as its
+    window). A request is therefore held for at most a window or the rest
+    of the previous run, plus its own run. Only one run per key is ever in
+    flight in this process.
+
+    Every request returns the result of the run that covered its payload, or
+    raises that run's exception, so a coalesced Pub/Sub message is only
+    acknowledged once its work is done. If a run fails, only its requests
+    fail and get redelivered; the next batch still runs.
+    """
+
+    def __init__(self, window=2.0, ack_deadline=None):
+        # Every request is held for at least the window; at or past the
+        # subscription's ack deadline Pub/Sub redelivers it mid-wait
+        if ack_deadline is not None and window >= ack_deadline:
+            raise ValueError(
+                f"Coalescing window ({window}s) must be shorter than the Pub/Sub ack deadline ({ack_deadline}s)"
+            )
+        self.window = window
+        self._states = {}
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    def submit(self, key, payload, fn):
+        """Returns (LEADER or COALESCED, the covering run's result); raises its exception."""
+        future = Future()
+        with self._lock:
+            self._stats["requests"] += 1
+            state = self._states.get(key)
+            leader = state is None
+            if leader:
+                state = self._states[key] = _KeyState()
+            else:
+                self._stats["coalesced"] += 1
+                if state.running:
+                    self._stats["coalesced_during_run"] += 1
+            state.pending.append((payload, future))
+
+        if leader:
+            if self.window > 0:
+                time.sleep(self.window)
+        else:
+            result = future.result()
+            if result is not _PROMOTED:
+                return COALESCED, result
+        return LEADER, self._run(key, state, fn, future)
+
+    def _run(self, key, state, fn, own):
+        with self._lock:
+            batch, state.pending = state.pending, []
+            state.running = True
+            self._stats["runs"] += 1
+        others = [future for _, future in batch if future is not own]
+        try:
+            result = fn([payload for payload, _ in batch])
+        except BaseException as e:
+            self._hand_off(key, state, failed=True)
+            for future in others:
+                future.set_exception(e)
+            raise
+        self._hand_off(key, state)
+        for future in others:
+            future.set_result(result)
+        return result
+
+    def _hand_off(self, key, state, failed=False):
+        with self._lock:
+            state.running = False
+            if failed:
+                self._stats["failed_runs"] += 1
+            if not state.pending:
+                del self._states[key]
+                return
+            self._stats["handoffs"] += 1
+            successor = state.pending[0][1]
+        successor.set_result(_PROMOTED)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._states)
+        stats["window_seconds"] = self.window
+        requests = stats.get("requests", 0)
+        stats["coalesced_ratio"] = stats.get("coalesced", 0) / requests if requests else 0.0
+        return stats
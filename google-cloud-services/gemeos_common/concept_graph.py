@@ -0,0 +1,196 @@
+"""Array-backed concept hierarchy: validation, topological order, depths and ancestors."""
+from array import array
+from collections import deque
+
+from gemeos_common.text import normalize_name
+
+GRAPH_VERSION = 1
+
+
+class ConceptGraph:
+    """A forest over a domain's concepts, built from a [{concept, parent}] list.
+
+    Node i has ids[i], names[i], parent[i] (-1 for a root) and depth[i].
+    Children are stored CSR-style: the children of i are
+    child_index[child_offsets[i]:child_offsets[i + 1]]. order is a
+    topological (breadth-first) order, parents before children; pre/post
+    are DFS entry/exit numbers, so a is an ancestor of b iff
+    pre[a] < pre[b] and post[b] < post[a].
+
+    from_hierarchy() repairs the model's output rather than rejecting it;
+    what it changed is listed in issues.
+    """
+
+    def __init__(self, ids, names, parent, issues=None):
+        n = len(ids)
+        self.ids = list(ids)
+        self.names = list(names)
+        self.parent = array("i", parent)
+        self.issues = issues or {}
+        self.index = {concept_id: i for i, concept_id in enumerate(self.ids)}
+
+        counts = array("i", [0]) * (n + 1)
+        for p in self.parent:
+            if p >= 0:
+                counts[p + 1] += 1
+        for i in range(n):
+            counts[i + 1] += counts[i]
+        self.child_offsets = counts
+        self.child_index = array("i", [0]) * counts[n]
+        fill = array("i", counts[:n])
+        for i, p in enumerate(self.parent):
+            if p >= 0:
+                self.child_index[fill[p]] = i
+                fill[p] += 1
+
+        self.roots = [i for i in range(n) if self.parent[i] < 0]
+        self.depth = array("i", [0]) * n
+        self.order = array("i")
+        queue = deque(self.roots)
+        while queue:
+            i = queue.popleft()
+            self.order.append(i)
+            for c in self.children(i):
+                self.depth[c] = self.depth[i] + 1
+                queue.append(c)
+
+        self.pre = array("i", [0]) * n
+        self.post = array("i", [0]) * n
+        clock = 0
+        for root in self.roots:
+            stack = [(root, False)]
+            while stack:
+                i, done = stack.pop()
+                if done:
+                    self.post[i] = clock
+                    clock += 1
+                    continue
+                self.pre[i] = clock
+                clock += 1
+                stack.append((i, True))
+                stack.extend((c, False) for c in reversed(self.children(i)))
+
+    @classmethod
+    def from_hierarchy(cls, hierarchy, concepts):
+        """Resolve names to concept IDs and repair the hierarchy.
+
+        concepts are the domain's {id, name} rows. Entries naming unknown
+        concepts are dropped, unknown parents and self-parents become roots,
+        repeated entries keep the first placement, every cycle is broken by
+        making one of its concepts a root, and concepts missing from the
+        hierarchy (orphans) are added as roots.
+        """
+        ids = []
+        names = []
+        by_name = {}
+        for concept in concepts:
+            key = normalize_name(concept["name"])
+            if key not in by_name:
+                by_name[key] = len(ids)
+                ids.append(concept["id"])
+                names.append(concept["name"])
+
+        n = len(ids)
+        parent = [-1] * n
+        placed = [False] * n
+        issues = {"unknown_concepts": [], "unknown_parents": [], "duplicates": [], "cycles_broken": [], "orphans": []}
+        for entry in hierarchy or []:
+            if not isinstance(entry, dict) or not isinstance(entry.get("concept"), str):
+                continue
+            i = by_name.get(normalize_name(entry["concept"]))
+            if i is None:
+                issues["unknown_concepts"].append(entry["concept"])
+                continue
+            if placed[i]:
+                issues["duplicates"].append(names[i])
+                continue
+            placed[i] = True
+            parent_name = entry.get("parent")
+            if isinstance(parent_name, str) and parent_name.strip():
+                p = by_name.get(normalize_name(parent_name))
+                if p is None or p == i:
+                    issues["unknown_parents"].append(parent_name)
+                else:
+                    parent[i] = p
+
+        # Break cycles: walk up from each node, colouring the path
+        state = [0] * n  # 0 unvisited, 1 on the current path, 2 done
+        for start in range(n):
+            path = []
+            i = start
+            while i >= 0 and state[i] == 0:
+                state[i] = 1
+                path.append(i)
+                i = parent[i]
+            if i >= 0 and state[i] == 1:
+                issues["cycles_broken"].append(names[i])
+                parent[i] = -1
+            for j in path:
+                state[j] = 2
+
+        issues["orphans"] = [names[i] for i in range(n) if not placed[i]]
+        return cls(ids, names, parent, {k: v for k, v in issues.items() if v})
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a graph stored by to_dict()."""
+        nodes = data["nodes"]
+        index = {node["id"]: i for i, node in enumerate(nodes)}
+        parent = [index.get(node["parent_id"], -1) if node.get("parent_id") is not None else -1 for node in nodes]
+        return cls([node["id"] for node in nodes], [node["name"] for node in nodes], parent, data.get("issues"))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def children(self, i):
+        return self.child_index[self.child_offsets[i]:self.child_offsets[i + 1]]
+
+    def ancestors(self, i):
+        """Node indices from the root down to i's parent."""
+        chain = []
+        p = self.parent[i]
+        while p >= 0:
+            chain.append(p)
+            p = self.parent[p]
+        chain.reverse()
+        return chain
+
+    def is_ancestor(self, a, b):
+        return self.pre[a] < self.pre[b] and self.post[b] < self.post[a]
+
+    def learning_path(self, concept_id):
+        """Concept IDs to study, in order, up to and including concept_id."""
+        i = self.index[concept_id]
+        return [self.ids[a] for a in self.ancestors(i)] + [concept_id]
+
+    def to_hierarchy(self):
+        """The repaired hierarchy in the original [{concept, parent}] shape, with IDs."""
+        return [{
+            "concept": self.names[i],
+            "parent": self.names[self.parent[i]] if self.parent[i] >= 0 else None,
+            "concept_id": self.ids[i],
+            "parent_id": self.ids[self.parent[i]] if self.parent[i] >= 0 else None,
+        } for i in self.order]
+
+    def to_dict(self):
+        """Serializable form with precomputed order, depth and ancestors.
+
+        nodes are in topological order; "order" is each node's position, so
+        a learning path is ancestor_ids + [id] and "is a prerequisite of"
+        is a membership test.
+        """
+        return {
+            "version": GRAPH_VERSION,
+            "roots": [self.ids[i] for i in self.roots],
+            "max_depth": max(self.depth, default=0),
+            "nodes": [{
+                "id": self.ids[i],
+                "name": self.names[i],
+                "parent_id": self.ids[self.parent[i]] if self.parent[i] >= 0 else None,
+                "depth": self.depth[i],
+                "order": position,
+                "ancestor_ids": [self.ids[a] for a in self.ancestors(i)],
+                "child_ids": [self.ids[c] for c in self.children(i)],
+            } for position, i in enumerate(self.order)],
+            "issues": self.issues,
+        }
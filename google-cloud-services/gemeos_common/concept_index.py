@@ -0,0 +1,198 @@
+"""Per-domain index of concept names with local near-duplicate detection."""
+import re
+import time
+import logging
+import threading
+from collections import Counter
+
+from gemeos_common.text import normalize_name
+
+logger = logging.getLogger(__name__)
+
+INDEXED_STATUSES = ("approved", "suggested")
+_WORD = re.compile(r"[^\W_]+")
+
+
+def _stem_word(word):
+    """Very light English stemmer: enough to fold plurals and common suffixes."""
+    for suffix, replacement in (("ies", "y"), ("sses", "ss"), ("ches", "ch"), ("shes", "sh"), ("xes", "x")):
+        if word.endswith(suffix) and len(word) > len(suffix) + 1:
+            return word[:-len(suffix)] + replacement
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")) and len(word) > 3:
+        word = word[:-1]
+    for suffix in ("ing", "ed"):
+        if word.endswith(suffix) and len(word) > len(suffix) + 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def stem_key(name):
+    """Order-preserving stemmed form, e.g. "Major Scales" and "major scale" match."""
+    return " ".join(_stem_word(w) for w in _WORD.findall(name.casefold()))
+
+
+def trigrams(normalized):
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _DomainIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.names = {}       # concept id -> display name
+        self.exact = {}       # normalized name -> set of ids
+        self.stems = {}       # stem key -> set of ids
+        self.postings = {}    # trigram -> set of ids
+        self.grams = {}       # concept id -> trigram set
+        self.loaded_at = 0.0
+        self.refreshed_at = 0.0
+        self.high_water = None  # latest updated_at seen
+
+    def add(self, concept_id, name):
+        self.remove(concept_id)
+        normalized = normalize_name(name)
+        if not normalized:
+            return
+        grams = trigrams(normalized)
+        self.names[concept_id] = name
+        self.grams[concept_id] = grams
+        self.exact.setdefault(normalized, set()).add(concept_id)
+        self.stems.setdefault(stem_key(name), set()).add(concept_id)
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(concept_id)
+        # A row from the database supersedes the placeholder added on insert
+        if not concept_id.startswith("local:"):
+            self.remove(f"local:{normalized}")
+
+    def remove(self, concept_id):
+        name = self.names.pop(concept_id, None)
+        if name is None:
+            return
+        for mapping, key in ((self.exact, normalize_name(name)), (self.stems, stem_key(name))):
+            ids = mapping.get(key)
+            if ids:
+                ids.discard(concept_id)
+                if not ids:
+                    del mapping[key]
+        for gram in self.grams.pop(concept_id, ()):
+            ids = self.postings.get(gram)
+            if ids:
+                ids.discard(concept_id)
+                if not ids:
+                    del self.postings[gram]
+
+    def find_duplicate(self, name, threshold):
+        """Return (existing name, reason) for the closest duplicate, or None."""
+        normalized = normalize_name(name)
+        if not normalized:
+            return None
+        ids = self.exact.get(normalized)
+        if ids:
+            return self.names[next(iter(ids))], "exact"
+        ids = self.stems.get(stem_key(name))
+        if ids:
+            return self.names[next(iter(ids))], "stem"
+
+        grams = trigrams(normalized)
+        overlaps = Counter()
+        for gram in grams:
+            for concept_id in self.postings.get(gram, ()):
+                overlaps[concept_id] += 1
+        best = None
+        best_score = threshold
+        for concept_id, overlap in overlaps.items():
+            score = overlap / (len(grams) + len(self.grams[concept_id]) - overlap)
+            if score >= best_score:
+                best, best_score = concept_id, score
+        return (self.names[best], f"trigram {best_score:.2f}") if best else None
+
+
+class ConceptNameIndex:
+    """Normalized names of approved and suggested concepts, per domain.
+
+    A domain is loaded in full on first use and every full_reload seconds
+    (to pick up deletions). In between, at most every refresh seconds, only
+    rows whose updated_at moved past the last one seen are fetched: new
+    concepts are added, renamed ones re-indexed and ones that left the
+    approved/suggested statuses dropped. Names inserted by this process are
+    added immediately via add_local.
+    """
+
+    def __init__(self, get_supabase, refresh=30, full_reload=3600, similarity_threshold=0.85):
+        self.get_supabase = get_supabase
+        self.refresh = refresh
+        self.full_reload = full_reload
+        self.similarity_threshold = similarity_threshold
+        self._domains = {}
+        self._lock = threading.Lock()
+        self._hits = Counter()
+        self._checks = 0
+
+    def _domain(self, domain_id):
+        with self._lock:
+            return self._domains.setdefault(domain_id, _DomainIndex())
+
+    def _fetch(self, domain_id, since=None):
+        query = self.get_supabase().table("concepts")\
+            .select("id, name, status, updated_at")\
+            .eq("domain_id", domain_id)
+        if since is not None:
+            query = query.gt("updated_at", since)
+        else:
+            query = query.in_("status", list(INDEXED_STATUSES))
+        return query.execute().data or []
+
+    def _sync(self, domain_id, index):
+        now = time.monotonic()
+        if index.loaded_at and now - index.loaded_at < self.full_reload:
+            if now - index.refreshed_at < self.refresh:
+                return
+            rows = self._fetch(domain_id, since=index.high_water)
+        else:
+            rows = self._fetch(domain_id)
+            index.reset()
+            index.loaded_at = now
+        index.refreshed_at = now
+
+        for row in rows:
+            if row.get("status") in INDEXED_STATUSES and row.get("name"):
+                index.add(str(row["id"]), row["name"])
+            else:
+                index.remove(str(row["id"]))
+            updated_at = row.get("updated_at")
+            if updated_at and (index.high_water is None or updated_at > index.high_water):
+                index.high_water = updated_at
+
+    def find_duplicate(self, domain_id, name):
+        """Return (existing name, reason) if name duplicates a known concept, else None."""
+        index = self._domain(domain_id)
+        with index.lock:
+            self._sync(domain_id, index)
+            match = index.find_duplicate(name, self.similarity_threshold)
+        with self._lock:
+            self._checks += 1
+            if match:
+                self._hits[match[1].split()[0]] += 1
+        return match
+
+    def add_local(self, domain_id, name):
+        """Index a name this process is about to insert, before the DB reports it."""
+        index = self._domain(domain_id)
+        with index.lock:
+            index.add(f"local:{normalize_name(name)}", name)
+
+    def invalidate(self, domain_id):
+        with self._lock:
+            self._domains.pop(domain_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "domains": len(self._domains),
+                "names": sum(len(index.names) for index in self._domains.values()),
+                "checks": self._checks,
+                "duplicates": dict(self._hits),
+            }
@@ -0,0 +1,166 @@
+"""Reviewer feedback for learning-goal prompts: capped diverse samples and a rejected-goal filter."""
+import logging
+import threading
+from collections import Counter
+
+from gemeos_common.concept_index import stem_key
+
+logger = logging.getLogger(__name__)
+
+SHINGLE_CHARS = 5
+
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "be", "by", "for", "from", "in", "is", "of", "on", "or",
+    "that", "the", "their", "to", "with", "will", "student", "students", "learner", "learners", "able",
+}
+
+
+def normalize_goal(text):
+    """Stemmed words without filler ("Students will be able to ..."), space-joined."""
+    return " ".join(w for w in stem_key(text or "").split() if w not in _STOPWORDS)
+
+
+def shingles(text):
+    """Character SHINGLE_CHARS-grams of the normalized goal."""
+    normalized = normalize_goal(text)
+    if len(normalized) <= SHINGLE_CHARS:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + SHINGLE_CHARS] for i in range(len(normalized) - SHINGLE_CHARS + 1)}
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def diverse_sample(goals, limit):
+    """Up to limit goals that are as different from each other as possible.
+
+    Greedy max-min selection on shingle Jaccard distance, seeded with the
+    newest goal (the lists come oldest first), so repeated phrasings of the
+    same goal use up one slot instead of many. Returns goals in their
+    original order.
+    """
+    goals = [g for g in dict.fromkeys(goals) if isinstance(g, str) and g.strip()]
+    if len(goals) <= limit:
+        return goals
+    if limit <= 0:
+        return []
+
+    sets = [shingles(g) for g in goals]
+    chosen = [len(goals) - 1]
+    closest = [1.0 - jaccard(s, sets[chosen[0]]) for s in sets]
+    while len(chosen) < limit:
+        # Ties go to the newer goal
+        best = max(range(len(goals)), key=lambda i: (closest[i], i))
+        if closest[best] <= 0.0:
+            break
+        chosen.append(best)
+        for i, s in enumerate(sets):
+            closest[i] = min(closest[i], 1.0 - jaccard(s, sets[best]))
+    return [goals[i] for i in sorted(chosen)]
+
+
+class RejectedGoalIndex:
+    """Inverted shingle index of one concept's rejected goals.
+
+    match() counts shared shingles through the postings, which gives the
+    exact Jaccard similarity against every rejected goal sharing at least
+    one shingle, without comparing against the rest.
+    """
+
+    def __init__(self, rejected_goals, threshold=0.7):
+        self.threshold = threshold
+        self.goals = []
+        self.sizes = []
+        self.exact = {}
+        self.postings = {}
+        for goal in dict.fromkeys(rejected_goals or []):
+            if not isinstance(goal, str):
+                continue
+            shingle_set = shingles(goal)
+            if not shingle_set:
+                continue
+            i = len(self.goals)
+            self.goals.append(goal)
+            self.sizes.append(len(shingle_set))
+            self.exact.setdefault(normalize_goal(goal), i)
+            for shingle in shingle_set:
+                self.postings.setdefault(shingle, []).append(i)
+
+    def __len__(self):
+        return len(self.goals)
+
+    def match(self, text):
+        """The rejected goal text resembles, or None."""
+        if not self.goals:
+            return None
+        i = self.exact.get(normalize_goal(text))
+        if i is not None:
+            return self.goals[i]
+        shingle_set = shingles(text)
+        shared = Counter()
+        for shingle in shingle_set:
+            shared.update(self.postings.get(shingle, ()))
+        best, best_score = None, 0.0
+        for i, count in shared.items():
+            score = count / (len(shingle_set) + self.sizes[i] - count)
+            if score > best_score:
+                best, best_score = i, score
+        return self.goals[best] if best is not None and best_score >= self.threshold else None
+
+
+class FeedbackSelector:
+    """Bounded reviewer feedback for prompts, with rejections enforced locally.
+
+    prompt_feedback() returns diverse samples of at most max_approved
+    approved and max_rejected rejected goals for the prompt, so its size
+    stays flat as review history grows. filter_rejected() then drops every
+    generated goal that is a near duplicate of any rejected goal, including
+    the ones left out of the prompt.
+    """
+
+    def __init__(self, max_approved=10, max_rejected=5, threshold=0.7):
+        self.max_approved = max_approved
+        self.max_rejected = max_rejected
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    def prompt_feedback(self, approved_goals, rejected_goals):
+        approved = diverse_sample(approved_goals or [], self.max_approved)
+        rejected = diverse_sample(rejected_goals or [], self.max_rejected)
+        with self._lock:
+            self._stats["selections"] += 1
+            self._stats["approved_available"] += len(approved_goals or [])
+            self._stats["approved_in_prompt"] += len(approved)
+            self._stats["rejected_available"] += len(rejected_goals or [])
+            self._stats["rejected_in_prompt"] += len(rejected)
+        return approved, rejected
+
+    def filter_rejected(self, goals, rejected_goals):
+        """goals (model output dicts) without the near duplicates of rejected goals."""
+        index = RejectedGoalIndex(rejected_goals, self.threshold)
+        if not len(index):
+            return goals
+        kept = []
+        for goal in goals:
+            description = goal.get("goal_description") if isinstance(goal, dict) else None
+            match = index.match(description) if isinstance(description, str) else None
+            if match is None:
+                kept.append(goal)
+            else:
+                logger.info("Dropped generated goal %r, resembles rejected goal %r", description, match)
+        with self._lock:
+            self._stats["goals_checked"] += len(goals)
+            self._stats["goals_dropped"] += len(goals) - len(kept)
+        return kept
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["max_approved"] = self.max_approved
+        stats["max_rejected"] = self.max_rejected
+        stats["similarity_threshold"] = self.threshold
+        return stats
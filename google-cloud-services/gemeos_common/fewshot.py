@@ -0,0 +1,131 @@
+"""Few-shot example selection: rank examples against the input, pack to a token budget."""
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+
+_TOKEN = re.compile(r"[^\W_]+|[^\w\s]", re.UNICODE)
+_WORD = re.compile(r"[^\W\d_]{3,}", re.UNICODE)
+
+
+def count_tokens(text):
+    """Local approximation of the model's token count.
+
+    Words count as one token per four characters (rounded up), punctuation
+    and symbols as one token each. Closer than a flat chars/4 for JSON-heavy
+    prompts, which are mostly quotes, brackets and short words.
+    """
+    if not text:
+        return 0
+    return sum((len(t) + 3) // 4 for t in _TOKEN.findall(text))
+
+
+def _terms(text):
+    return Counter(w.casefold() for w in _WORD.findall(text or ""))
+
+
+class _ExampleIndex:
+    """TF-IDF vectors (sparse dicts, unit length) for one list of rendered examples."""
+
+    def __init__(self, documents):
+        term_counts = [_terms(doc) for doc in documents]
+        df = Counter()
+        for counts in term_counts:
+            df.update(counts.keys())
+        n = len(documents)
+        self.idf = {term: math.log((1 + n) / (1 + freq)) + 1 for term, freq in df.items()}
+        self.vectors = [self._weigh(counts) for counts in term_counts]
+        self.tokens = [count_tokens(doc) for doc in documents]
+
+    def _weigh(self, counts):
+        vector = {t: (1 + math.log(c)) * self.idf[t] for t, c in counts.items() if t in self.idf}
+        norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+        return {t: w / norm for t, w in vector.items()}
+
+    def scores(self, text):
+        query = self._weigh(_terms(text))
+        return [sum(w * query.get(t, 0.0) for t, w in vector.items()) if query else 0.0 for vector in self.vectors]
+
+
+class ExampleSelector:
+    """Pick the few-shot examples most similar to a prompt's input text.
+
+    render turns an example record into its prompt block (or None to skip
+    it). Rendered examples are indexed once per examples list; lists come
+    from the guidance cache, so the same object is reused until the file
+    changes. select() ranks by TF-IDF cosine similarity and greedily packs
+    the best examples that fit token_budget, at most max_examples of them.
+    """
+
+    def __init__(self, render, token_budget=2000, max_examples=8, max_indexes=32):
+        self.render = render
+        self.token_budget = token_budget
+        self.max_examples = max_examples
+        self.max_indexes = max_indexes
+        self._indexes = OrderedDict()  # id(examples) -> (examples, rendered, index)
+        self._lock = threading.Lock()
+        self._stats = Counter()
+        self._max_prompt_tokens = 0
+
+    def _index_for(self, examples):
+        key = id(examples)
+        with self._lock:
+            entry = self._indexes.get(key)
+            if entry and entry[0] is examples:
+                self._indexes.move_to_end(key)
+                return entry[1], entry[2]
+
+        rendered = [block for block in (self.render(e) for e in examples) if block]
+        index = _ExampleIndex(rendered)
+        with self._lock:
+            # Holding a reference to the list keeps its id from being reused
+            self._indexes[key] = (examples, rendered, index)
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+            self._stats["indexes_built"] += 1
+        return rendered, index
+
+    def select(self, examples, text):
+        """Return the few-shot prompt prefix for text (possibly empty)."""
+        if not examples:
+            return ""
+        rendered, index = self._index_for(examples)
+        scores = index.scores(text)
+        ranked = sorted(range(len(rendered)), key=lambda i: -scores[i])
+
+        chosen = []
+        used = 0
+        for i in ranked:
+            if len(chosen) >= self.max_examples:
+                break
+            if used + index.tokens[i] > self.token_budget:
+                continue
+            chosen.append(i)
+            used += index.tokens[i]
+
+        with self._lock:
+            self._stats["selections"] += 1
+            self._stats["examples_available"] += len(rendered)
+            self._stats["examples_selected"] += len(chosen)
+            self._stats["example_tokens"] += used
+        return "".join(rendered[i] for i in chosen)
+
+    def record_prompt(self, *texts):
+        """Count the final prompt size; returns the estimated token count."""
+        tokens = sum(count_tokens(t) for t in texts)
+        with self._lock:
+            self._stats["prompts"] += 1
+            self._stats["prompt_tokens"] += tokens
+            self._max_prompt_tokens = max(self._max_prompt_tokens, tokens)
+        return tokens
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["max_prompt_tokens"] = self._max_prompt_tokens
+        selections = stats.get("selections", 0)
+        prompts = stats.get("prompts", 0)
+        stats["avg_examples_selected"] = stats.get("examples_selected", 0) / selections if selections else 0.0
+        stats["avg_prompt_tokens"] = stats.get("prompt_tokens", 0) / prompts if prompts else 0.0
+        stats["token_budget"] = self.token_budget
+        return stats
@@ -0,0 +1,127 @@
+"""In-process cache for guidance and few-shot example files in GCS."""
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from google.api_core import exceptions as google_exceptions
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("value", "generation", "checked_at")
+
+    def __init__(self, value, generation, checked_at):
+        self.value = value
+        self.generation = generation
+        self.checked_at = checked_at
+
+
+class GuidanceCache:
+    """TTL + LRU cache of parsed guidance blobs, keyed by (domain slug, path).
+
+    Within the TTL an entry is served without touching GCS. After that it is
+    revalidated with a conditional download (if_generation_not_match): an
+    unchanged blob costs one request that returns 304 and no body. Missing
+    blobs are cached as negative entries for negative_ttl seconds. If GCS is
+    unreachable during revalidation the stale value keeps being served.
+    """
+
+    def __init__(self, get_storage_client, bucket_name, ttl=300, negative_ttl=60, max_entries=256):
+        self.get_storage_client = get_storage_client
+        self.bucket_name = bucket_name
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "negative_hits": 0,
+            "misses": 0,
+            "revalidated_unchanged": 0,
+            "revalidated_changed": 0,
+            "stale_served": 0,
+            "evictions": 0,
+            "errors": 0
+        }
+
+    def get_text(self, domain_slug, path):
+        """Return the blob's text, or None if it does not exist."""
+        return self._get(domain_slug, path, lambda raw: raw.decode("utf-8"))
+
+    def get_jsonl(self, domain_slug, path):
+        """Return the blob parsed as JSON lines, or None if it does not exist."""
+        return self._get(domain_slug, path, _parse_jsonl)
+
+    def invalidate(self, domain_slug=None):
+        """Drop all entries, or only those for one domain."""
+        with self._lock:
+            for key in [k for k in self._entries if domain_slug is None or k[0] == domain_slug]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["negative_hits"] + stats["misses"] + \
+            stats["revalidated_unchanged"] + stats["revalidated_changed"]
+        stats["hit_ratio"] = (lookups - stats["misses"] - stats["revalidated_changed"]) / lookups if lookups else 0.0
+        return stats
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _get(self, domain_slug, path, parse):
+        key = (domain_slug, path)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                ttl = self.ttl if entry.generation is not None else self.negative_ttl
+                if now - entry.checked_at < ttl:
+                    self._stats["hits" if entry.generation is not None else "negative_hits"] += 1
+                    return entry.value
+
+        blob = self.get_storage_client().bucket(self.bucket_name).blob(path)
+        try:
+            if entry is not None and entry.generation is not None:
+                raw = blob.download_as_bytes(if_generation_not_match=entry.generation)
+            else:
+                raw = blob.download_as_bytes()
+        except google_exceptions.NotModified:
+            self._count("revalidated_unchanged")
+            self._store(key, entry.value, entry.generation)
+            return entry.value
+        except google_exceptions.NotFound:
+            self._count("misses")
+            self._store(key, None, None)
+            return None
+        except Exception as e:
+            self._count("errors")
+            if entry is not None:
+                logger.warning(f"Could not revalidate gs://{self.bucket_name}/{path}, serving cached copy: {e}")
+                self._count("stale_served")
+                return entry.value
+            raise
+
+        value = parse(raw)
+        self._count("revalidated_changed" if entry is not None else "misses")
+        self._store(key, value, blob.generation or blob.etag or "unknown")
+        return value
+
+    def _store(self, key, value, generation):
+        with self._lock:
+            self._entries[key] = _Entry(value, generation, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+
+def _parse_jsonl(raw):
+    return [json.loads(line) for line in raw.decode("utf-8").strip().split("\n") if line.strip()]
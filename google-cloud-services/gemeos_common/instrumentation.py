@@ -0,0 +1,201 @@
+"""Structured, sampled JSON logging and per-request stage spans.
+
+Log lines are single JSON objects on stdout, which Cloud Logging parses
+into structured entries ("severity" and "message" are recognised):
+
+    {"severity": "INFO", "message": "...", "service": "...", ...fields}
+
+Configuration (environment):
+
+    LOG_SAMPLE_RATE            share of INFO lines / requests logged (default 1.0)
+    LOG_DEBUG                  "true" to log DEBUG lines, including full prompts
+    LOG_SLOW_REQUEST_SECONDS   request summaries slower than this are always logged
+
+WARNING and ERROR lines are never sampled out. Requests are sampled as a
+whole: every INFO line logged through a Trace is kept or dropped together
+with the request's summary line.
+"""
+import json
+import logging
+import os
+import random
+import sys
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+
+from gemeos_common.metrics import LAG_BUCKETS, MetricsRegistry
+from gemeos_common.timing import StageTimer, TimingStats
+
+
+class Instrumentation:
+    """One per service: logging settings, stage timing aggregates and line counts.
+
+    metrics is the service's MetricsRegistry (served on /metrics); every
+    finished trace counts a request and observes its stage durations there.
+    """
+
+    def __init__(self, service, sample_rate=None, debug=None, slow_seconds=None, stream=None):
+        self.service = service
+        self.sample_rate = float(os.getenv("LOG_SAMPLE_RATE", 1.0)) if sample_rate is None else sample_rate
+        self.debug = (os.getenv("LOG_DEBUG", "false").lower() == "true") if debug is None else debug
+        self.slow_seconds = float(os.getenv("LOG_SLOW_REQUEST_SECONDS", 30)) if slow_seconds is None else slow_seconds
+        self.stream = stream
+        self.timings = TimingStats()
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self.metrics = MetricsRegistry(service)
+        self.requests = self.metrics.counter(
+            "requests_total", "Requests handled, by kind and outcome.", ("kind", "outcome")
+        )
+        self.stage_seconds = self.metrics.histogram(
+            "stage_duration_seconds", "Duration of each request stage (total is the whole request).", ("kind", "stage")
+        )
+        self.queue_lag = self.metrics.histogram(
+            "pubsub_queue_lag_seconds", "Time from Pub/Sub publish to the push request reaching the handler.",
+            buckets=LAG_BUCKETS
+        )
+
+    def observe_message(self, pubsub_message):
+        """Record the queue lag of a pushed Pub/Sub message; returns it in seconds (or None)."""
+        published = parse_publish_time(pubsub_message.get("publishTime") or pubsub_message.get("publish_time"))
+        if published is None:
+            return None
+        lag = max(0.0, (datetime.now(timezone.utc) - published).total_seconds())
+        self.queue_lag.observe(lag)
+        return lag
+
+    def sample(self):
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def emit(self, message, severity="INFO", **fields):
+        """Write one line unconditionally (callers decide about sampling)."""
+        entry = {"severity": severity, "message": message, "service": self.service}
+        entry.update(fields)
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with self._lock:
+            self._counts[severity] += 1
+            (self.stream or sys.stdout).write(line + "\n")
+
+    def log(self, message, severity="INFO", **fields):
+        """Log a line outside a request trace; INFO lines are sampled on their own."""
+        if severity == "DEBUG" and not self.debug:
+            return
+        if severity == "INFO" and not self.sample():
+            with self._lock:
+                self._counts["sampled_out"] += 1
+            return
+        self.emit(message, severity, **fields)
+
+    def debug_prompt(self, system_prompt, prompt, **fields):
+        """Full prompt bodies, only when LOG_DEBUG is on."""
+        if self.debug:
+            self.emit("Prompt sent to Gemini", "DEBUG", system_prompt=system_prompt, prompt=prompt, **fields)
+
+    def capture_logging(self, level=logging.INFO):
+        """Route the logging module (gemeos_common, client libraries) through emit().
+
+        Structured fields go in extra: logger.info("...", extra={"fields": {...}}).
+        """
+        root = logging.getLogger()
+        if not any(isinstance(h, _StructuredHandler) for h in root.handlers):
+            root.addHandler(_StructuredHandler(self))
+        root.setLevel(level)
+
+    def trace(self, kind, **fields):
+        return Trace(self, kind, fields)
+
+    def stats(self):
+        with self._lock:
+            lines = dict(self._counts)
+        return {
+            "log_lines": lines,
+            "sample_rate": self.sample_rate,
+            "debug": self.debug,
+            "stage_timings": self.timings.stats(),
+        }
+
+
+def parse_publish_time(value):
+    """Parse Pub/Sub's RFC 3339 publishTime ("2024-05-01T12:00:00.123456789Z")."""
+    if not value:
+        return None
+    try:
+        main, _, rest = value.rstrip("Z").partition(".")
+        fraction = "".join(c for c in rest if c.isdigit())[:6]
+        published = datetime.fromisoformat(f"{main}.{fraction or '0'}")
+        return published.replace(tzinfo=timezone.utc) if published.tzinfo is None else published
+    except ValueError:
+        return None
+
+
+class _StructuredHandler(logging.Handler):
+    def __init__(self, instrumentation):
+        super().__init__()
+        self.instrumentation = instrumentation
+
+    def emit(self, record):
+        try:
+            severity = "ERROR" if record.levelno >= logging.ERROR else logging.getLevelName(record.levelno)
+            fields = {"logger": record.name}
+            fields.update(getattr(record, "fields", None) or {})
+            if record.exc_info:
+                fields["traceback"] = self.format(record).split("\n", 1)[-1]
+            self.instrumentation.log(record.getMessage(), severity, **fields)
+        except Exception:
+            self.handleError(record)
+
+
+class Trace(StageTimer):
+    """Spans and log lines for one request.
+
+    stage(name) (a context manager) and timed(name, fn, ...) time the
+    request's stages; finish() logs one summary line with the stage
+    durations and feeds the service's timing aggregates.
+    """
+
+    def __init__(self, instrumentation, kind, fields):
+        super().__init__(instrumentation.timings)
+        self.instrumentation = instrumentation
+        self.kind = kind
+        self.fields = dict(fields)
+        self.sampled = instrumentation.sample()
+        self.finished = False
+
+    def annotate(self, **fields):
+        """Add fields to every later line of this request (e.g. IDs parsed from the message)."""
+        self.fields.update(fields)
+
+    def log(self, message, severity="INFO", **fields):
+        if severity == "DEBUG" and not self.instrumentation.debug:
+            return
+        if severity == "INFO" and not self.sampled:
+            return
+        self.instrumentation.emit(message, severity, kind=self.kind, **{**self.fields, **fields})
+
+    def finish(self, outcome="ok", severity=None, **fields):
+        """Log the request summary and return the stage timings in ms.
+
+        The summary is sampled like the request's other INFO lines, but
+        always logged for slow requests and for outcomes logged at WARNING
+        or ERROR (severity defaults to ERROR for "error", INFO otherwise).
+        """
+        if self.finished:
+            return {}
+        self.finished = True
+        super().finish()
+        with self._lock:
+            stages = dict(self.stages)
+        stages_ms = {name: round(seconds * 1000, 1) for name, seconds in stages.items()}
+        self.instrumentation.requests.inc(kind=self.kind, outcome=outcome)
+        for name, seconds in stages.items():
+            self.instrumentation.stage_seconds.observe(seconds, kind=self.kind, stage=name)
+        severity = severity or ("ERROR" if outcome == "error" else "INFO")
+        if severity == "INFO" and stages_ms["total"] >= self.instrumentation.slow_seconds * 1000:
+            severity = "WARNING"
+        if self.sampled or severity != "INFO":
+            self.instrumentation.emit(
+                f"{self.kind} request {outcome}", severity,
+                kind=self.kind, outcome=outcome, stages_ms=stages_ms, **{**self.fields, **fields}
+            )
+        return stages_ms
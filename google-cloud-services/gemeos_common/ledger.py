@@ -0,0 +1,169 @@
+"""Idempotent processing ledger for Pub/Sub push handlers (public.processing_ledger)."""
+import hashlib
+import json
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# claim() outcomes
+CLAIMED = "claimed"          # caller holds the lease and should do the work
+DONE = "done"                # work finished before: acknowledge the message
+IN_PROGRESS = "in_progress"  # a different message holds the lease: acknowledge
+RETRY_LATER = "retry_later"  # the same message is being processed elsewhere: let Pub/Sub redeliver
+
+
+def skip_response(outcome):
+    """HTTP response for a delivery that should not do the work, or None to proceed."""
+    if outcome == DONE:
+        return "OK (already processed)", 200
+    if outcome == IN_PROGRESS:
+        return "OK (being processed by another delivery)", 200
+    if outcome == RETRY_LATER:
+        return "Conflict: message is already being processed", 409
+    return None
+
+
+def input_hash(*inputs):
+    """Stable hash of the inputs that determine a unit of work's result."""
+    digest = hashlib.sha256()
+    for value in inputs:
+        if not isinstance(value, (str, bytes)):
+            value = json.dumps(value, sort_keys=True, default=str)
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        digest.update(len(value).to_bytes(8, "big"))
+        digest.update(value)
+    return digest.hexdigest()[:32]
+
+
+class Lease:
+    def __init__(self, work_key, message_id):
+        self.work_key = work_key
+        self.message_id = message_id
+
+
+class ProcessingLedger:
+    """Record units of work so redeliveries skip the Gemini call.
+
+    A handler first checks seen_message() with the Pub/Sub message ID (a
+    redelivery of a message that already completed), then, once it knows
+    its inputs, claim()s the work key built by work_key(). Only a CLAIMED
+    outcome returns a Lease; the handler must complete() or fail() it.
+
+    If the ledger itself cannot be reached the work proceeds unguarded (and
+    the error is counted): a ledger outage should not stop ingestion.
+    """
+
+    def __init__(self, get_supabase, service, lease_seconds=600, enabled=True):
+        self.get_supabase = get_supabase
+        self.service = service
+        self.lease_seconds = lease_seconds
+        self.enabled = enabled
+        self._stats = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def work_key(self, kind, entity_id, *inputs):
+        return f"{self.service}:{kind}:{entity_id}:{input_hash(*inputs)}"
+
+    def seen_message(self, message_id):
+        """True if this Pub/Sub message already completed its work."""
+        if not self.enabled or not message_id:
+            return False
+        try:
+            res = self.get_supabase().table("processing_ledger")\
+                .select("work_key")\
+                .eq("message_id", message_id)\
+                .eq("service", self.service)\
+                .eq("status", "done")\
+                .limit(1)\
+                .execute()
+        except Exception as e:
+            logger.warning("Ledger lookup for message %s failed: %s", message_id, e)
+            self._count("errors")
+            return False
+        if res.data:
+            self._count("duplicate_messages")
+            return True
+        return False
+
+    def claim(self, work_key, message_id, force=False):
+        """Try to take the lease on work_key. Returns (outcome, lease or None)."""
+        if not self.enabled:
+            return CLAIMED, None
+        try:
+            res = self.get_supabase().rpc("claim_processing_work", {
+                "p_work_key": work_key,
+                "p_service": self.service,
+                "p_message_id": message_id,
+                "p_lease_seconds": int(self.lease_seconds),
+                "p_force": bool(force),
+            }).execute()
+        except Exception as e:
+            logger.warning("Ledger claim for %s failed, processing without it: %s", work_key, e)
+            self._count("errors")
+            return CLAIMED, None
+
+        row = res.data[0] if res.data else {}
+        outcome = row.get("outcome")
+        if outcome == CLAIMED:
+            self._count("claimed")
+            return CLAIMED, Lease(work_key, message_id)
+        if outcome == DONE:
+            self._count("duplicate_work")
+            return DONE, None
+        if outcome == IN_PROGRESS:
+            if message_id and row.get("holder_message_id") == message_id:
+                self._count("retry_later")
+                return RETRY_LATER, None
+            self._count("concurrent_work")
+            return IN_PROGRESS, None
+        logger.warning("Unexpected ledger claim result for %s: %s", work_key, row)
+        self._count("errors")
+        return CLAIMED, None
+
+    def _finish(self, lease, fields, outcome):
+        if lease is None:
+            return
+        try:
+            query = self.get_supabase().table("processing_ledger")\
+                .update(fields)\
+                .eq("work_key", lease.work_key)
+            # Only the lease holder may finish the work
+            if lease.message_id:
+                query = query.eq("message_id", lease.message_id)
+            query.execute()
+            self._count(outcome)
+        except Exception as e:
+            logger.warning("Ledger update for %s failed: %s", lease.work_key, e)
+            self._count("errors")
+
+    def complete(self, lease, result=None):
+        now = datetime.now(timezone.utc).isoformat()
+        self._finish(lease, {
+            "status": "done",
+            "result": result,
+            "lease_expires_at": None,
+            "completed_at": now,
+            "updated_at": now,
+        }, "completed")
+
+    def fail(self, lease, error):
+        self._finish(lease, {
+            "status": "failed",
+            "last_error": str(error)[:1000],
+            "lease_expires_at": None,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }, "failed")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["enabled"] = self.enabled
+        return stats
@@ -0,0 +1,159 @@
+"""Content-addressed cache of Gemini responses backed by SQLite."""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(model_name, system_prompt, prompt, config):
+    """SHA-256 over the canonical JSON of everything that determines the response."""
+    payload = json.dumps(
+        {"model": model_name, "system": system_prompt, "prompt": prompt, "config": config},
+        sort_keys=True, ensure_ascii=False, separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Size-bounded LRU + TTL cache of model responses in a SQLite file.
+
+    Identical (model, system prompt, prompt, generation config) calls, as
+    happen on Pub/Sub redeliveries, retries after a failed DB write, and
+    reprocessing, return the stored response instead of calling the model.
+    Least recently used rows are evicted once the stored text exceeds
+    max_bytes; rows older than ttl seconds are treated as misses. On an
+    in-memory filesystem (Cloud Run's /tmp) the file takes up to max_bytes
+    of the instance's memory.
+    """
+
+    def __init__(self, path, max_bytes=32 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL, latency_ms REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self._stats = {"hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "evictions": 0, "saved_latency_ms": 0.0}
+
+    def get(self, key):
+        """Return the cached response text, or None on a miss or expired entry."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, created, latency_ms, size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            value, created, latency_ms, size = row
+            if now - created > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._size -= size
+                self._stats["misses"] += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._stats["hits"] += 1
+            self._stats["saved_latency_ms"] += latency_ms
+            return value
+
+    def put(self, key, value, latency_ms):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            old = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed, latency_ms)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, value, size, now, now, latency_ms)
+            )
+            self._size += size - (old[0] if old else 0)
+            self._stats["stores"] += 1
+            self._evict()
+
+    def _evict(self):
+        while self._size > self.max_bytes:
+            rows = self._db.execute(
+                "SELECT key, size FROM responses ORDER BY accessed LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._size <= self.max_bytes:
+                    break
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._size -= size
+                self._stats["evictions"] += 1
+
+    def generate(self, model_name, system_prompt, prompt, config, call, bypass=False, validate=None):
+        """Return call()'s response text, served from the cache when possible.
+
+        With bypass=True the cache is not read but the fresh response is
+        still stored. Responses failing validate(text) are never stored.
+        """
+        key = cache_key(model_name, system_prompt, prompt, config)
+        if bypass:
+            with self._lock:
+                self._stats["bypassed"] += 1
+        else:
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+
+        started = time.monotonic()
+        text = call()
+        latency_ms = (time.monotonic() - started) * 1000
+        if text is not None and (validate is None or validate(text)):
+            try:
+                self.put(key, text, latency_ms)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not store response in cache: {e}")
+        return text
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["bytes"] = self._size
+            stats["entries"] = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+def is_json(text):
+    try:
+        json.loads(text)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def open_response_cache(path, max_bytes, ttl):
+    """Open the cache, or return None (caching disabled) if the file cannot be used."""
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        return ResponseCache(path, max_bytes=max_bytes, ttl=ttl)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"LLM response cache disabled, could not open {path}: {e}")
+        return None
+
+
+def cached_call(cache, model_name, system_prompt, prompt, config, call, bypass=False, validate=is_json):
+    """ResponseCache.generate when a cache is configured, otherwise just call()."""
+    if cache is None:
+        return call()
+    return cache.generate(model_name, system_prompt, prompt, config, call, bypass=bypass, validate=validate)
@@ -0,0 +1,96 @@
+"""Wire format for messages on the content-extraction-requests topic.
+
+Messages follow the claim-check pattern: they carry the record ID, the
+content hash and a pointer to where the extracted text is stored, never the
+text itself. Consumers load the text from Supabase only if they need it.
+
+Version 2 (current):
+    {
+        "version": 2,
+        "record_id": "<domain_extracted_files.id>",
+        "domain_id": "...",
+        "domain_slug": "jazz-music",
+        "file_path": "gs://bucket/path",
+        "content_hash": "<sha256 hex>",
+        "text_ref": "supabase://domain_extracted_files/<record_id>/extracted_text",
+        "text_chars": 48213,
+        "metadata": {...},
+        "timestamp": "2025-01-01T00:00:00"
+    }
+
+Version 1 (legacy) has no "version" key and embeds the full text under
+"extracted_text". decode_extraction_request accepts both.
+"""
+import json
+from datetime import datetime
+
+CURRENT_VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)
+TEXT_REF_PREFIX = "supabase://"
+
+
+def make_text_ref(record_id, table="domain_extracted_files", column="extracted_text"):
+    """Build the pointer to a stored text column."""
+    return f"{TEXT_REF_PREFIX}{table}/{record_id}/{column}"
+
+
+def parse_text_ref(text_ref):
+    """Split a text_ref into (table, record_id, column)."""
+    if not text_ref or not text_ref.startswith(TEXT_REF_PREFIX):
+        raise ValueError(f"Unsupported text_ref: {text_ref!r}")
+    parts = text_ref[len(TEXT_REF_PREFIX):].split("/")
+    if len(parts) != 3 or not all(parts):
+        raise ValueError(f"Malformed text_ref: {text_ref!r}")
+    return tuple(parts)
+
+
+def encode_extraction_request(record_id, domain_id, file_path, content_hash, metadata, text_chars=None,
+                              domain_slug=None):
+    """Encode a version 2 extraction request. Returns (data_bytes, attributes)."""
+    message = {
+        "version": CURRENT_VERSION,
+        "record_id": record_id,
+        "domain_id": domain_id,
+        "domain_slug": domain_slug,
+        "file_path": file_path,
+        "content_hash": content_hash,
+        "text_ref": make_text_ref(record_id),
+        "text_chars": text_chars,
+        "metadata": metadata,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+    data = json.dumps(message, separators=(",", ":")).encode("utf-8")
+    attributes = {
+        "record_id": record_id,
+        "domain_id": domain_id,
+        "schema_version": str(CURRENT_VERSION)
+    }
+    return data, attributes
+
+
+def decode_extraction_request(data):
+    """Decode a message body of any supported version into the version 2 shape.
+
+    Legacy version 1 messages keep their inline text under "extracted_text"
+    so resolve_text can skip the database read.
+    """
+    message = json.loads(data.decode("utf-8") if isinstance(data, bytes) else data)
+    version = message.get("version", 1)
+    if version not in SUPPORTED_VERSIONS:
+        raise ValueError(f"Unsupported extraction request version: {version}")
+
+    if version == 1:
+        message["version"] = 1
+        message["text_ref"] = make_text_ref(message["record_id"])
+        message["text_chars"] = len(message.get("extracted_text") or "")
+    return message
+
+
+def resolve_text(message, supabase):
+    """Return the extracted text for a decoded message, loading it via text_ref."""
+    if message.get("extracted_text") is not None:
+        return message["extracted_text"]
+
+    table, record_id, column = parse_text_ref(message["text_ref"])
+    res = supabase.table(table).select(column).eq("id", record_id).single().execute()
+    return res.data.get(column) if res.data else None
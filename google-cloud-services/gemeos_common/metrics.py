@@ -0,0 +1,174 @@
+"""In-process counters and histograms rendered in the Prometheus text format.
+
+Recording is a dict lookup and an addition under a lock, so metrics can stay
+on under full load; all formatting happens when /metrics is scraped. The
+components' existing stats() dicts are exported at scrape time too (see
+export_stats), without touching their hot paths.
+"""
+import math
+import re
+import threading
+from bisect import bisect_left
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+LAG_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_INVALID_NAME_CHARS = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        if math.isnan(value):
+            return "NaN"
+        return repr(value)
+    return str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames, const_labels):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.const_labels = tuple(const_labels.items())
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        return self.const_labels + tuple(zip(self.labelnames, key)) + tuple(extra)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self._labels(key))} {_format_value(value)}" for key, value in values
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames, const_labels, buckets=DURATION_BUCKETS):
+        super().__init__(name, help_text, labelnames, const_labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket (not cumulative) counts, then sum and count
+                entry = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self):
+        with self._lock:
+            values = [(key, list(entry)) for key, entry in self._values.items()]
+        lines = self.header()
+        for key, entry in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), entry):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else _format_value(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self._labels(key, [('le', le)]))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self._labels(key))} {_format_value(entry[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self._labels(key))} {entry[-1]}")
+        return lines
+
+
+def _flatten(stats, prefix=""):
+    for key, value in stats.items():
+        name = f"{prefix}_{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            yield from _flatten(value, name)
+        elif isinstance(value, (int, float)):
+            yield name, value
+
+
+class MetricsRegistry:
+    """The metrics of one service; every series carries a service label."""
+
+    def __init__(self, service, namespace="gemeos"):
+        self.namespace = namespace
+        self.const_labels = {"service": service}
+        self._metrics = {}
+        self._exports = []
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, help_text, labelnames, **kwargs):
+        full_name = f"{self.namespace}_{name}"
+        with self._lock:
+            metric = self._metrics.get(full_name)
+            if metric is None:
+                metric = self._metrics[full_name] = cls(full_name, help_text, labelnames, self.const_labels, **kwargs)
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DURATION_BUCKETS):
+        return self._register(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def export_stats(self, component, stats_fn):
+        """Expose the numeric values of stats_fn() (a component's stats dict) at scrape time.
+
+        Nested keys are joined with "_", e.g. component "" and
+        {"gemini_rate_limiter": {"retries": 3}} give gemeos_gemini_rate_limiter_retries.
+        They are exported untyped: most are running totals, a few (entries,
+        ratios) are current values.
+        """
+        with self._lock:
+            self._exports.append((component, stats_fn))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+            exports = list(self._exports)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        labels = _format_labels(tuple(self.const_labels.items()))
+        for component, stats_fn in exports:
+            try:
+                stats = stats_fn()
+            except Exception:
+                continue
+            for key, value in _flatten(stats or {}):
+                name = _INVALID_NAME_CHARS.sub("_", "_".join(filter(None, (self.namespace, component, key))))
+                lines.append(f"# TYPE {name} untyped")
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,198 @@
+"""BM25 passage index over a file's extracted text.
+
+The preprocessor builds the index from the chunk sidecar's chunks when it
+extracts a file and stores it next to the upload:
+
+    gs://<bucket>/<object>.passages.json.gz
+
+Gzip-compressed JSON:
+
+    {"version": 1, "k1": 1.2, "b": 0.75,
+     "passages": [[page, start, text], ...],
+     "postings": {"term": [passage, tf, passage, tf, ...], ...}}
+
+Passages are paragraph groups of about PASSAGE_TARGET_CHARS; page and start
+(character offset into the full text) come from the chunk they were cut
+from. Terms are stemmed with the same stem_key used for concept names, so a
+concept name is a good query as is.
+"""
+import gzip
+import json
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+
+from gemeos_common.concept_index import stem_key
+
+INDEX_SUFFIX = ".passages.json.gz"
+INDEX_VERSION = 1
+PASSAGE_TARGET_CHARS = 1200
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n|\n(?=\s*[-•*\d]+[.)]?\s)")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "in", "is", "it",
+    "its", "of", "on", "or", "that", "the", "this", "to", "was", "were", "which", "with",
+}
+
+
+def tokenize(text):
+    return [t for t in stem_key(text).split() if len(t) > 1 and t not in _STOPWORDS]
+
+
+def split_passages(chunks, target_chars=PASSAGE_TARGET_CHARS):
+    """Cut chunk sidecar entries into (page, start, text) passages of about target_chars."""
+    passages = []
+    for chunk in chunks:
+        text = chunk["text"]
+        start = 0
+        for match in _PARAGRAPH_BREAK.finditer(text):
+            if match.end() - start >= target_chars:
+                passages.append((chunk.get("page"), chunk["start"] + start, text[start:match.end()]))
+                start = match.end()
+        if start < len(text):
+            tail = text[start:]
+            # Hard-split a paragraph-free tail that is far over the target
+            while len(tail) > 2 * target_chars:
+                cut = tail.rfind(" ", 0, target_chars) + 1 or target_chars
+                passages.append((chunk.get("page"), chunk["start"] + start, tail[:cut]))
+                start += cut
+                tail = tail[cut:]
+            passages.append((chunk.get("page"), chunk["start"] + start, tail))
+    return [p for p in passages if p[2].strip()]
+
+
+class PassageIndex:
+    def __init__(self, passages, postings, k1=1.2, b=0.75):
+        self.passages = passages
+        self.postings = postings
+        self.k1 = k1
+        self.b = b
+        lengths = [0] * len(passages)
+        for flat in postings.values():
+            for i in range(0, len(flat), 2):
+                lengths[flat[i]] += flat[i + 1]
+        self.lengths = lengths
+        self.avg_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+
+    @classmethod
+    def build(cls, chunks, target_chars=PASSAGE_TARGET_CHARS):
+        passages = split_passages(chunks, target_chars)
+        postings = {}
+        for pid, (_, _, text) in enumerate(passages):
+            for term, tf in Counter(tokenize(text)).items():
+                postings.setdefault(term, []).extend((pid, tf))
+        return cls(passages, postings)
+
+    def to_bytes(self):
+        data = {
+            "version": INDEX_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "passages": [list(p) for p in self.passages],
+            "postings": self.postings,
+        }
+        return gzip.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), mtime=0)
+
+    @classmethod
+    def from_bytes(cls, raw):
+        data = json.loads(gzip.decompress(raw))
+        if data.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported passage index version: {data.get('version')}")
+        return cls([tuple(p) for p in data["passages"]], data["postings"], data["k1"], data["b"])
+
+    def search(self, query, k=5):
+        """[(score, passage id)] for the k best passages, best first (BM25)."""
+        n = len(self.passages)
+        scores = Counter()
+        for term in set(tokenize(query)):
+            flat = self.postings.get(term)
+            if not flat:
+                continue
+            df = len(flat) // 2
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for i in range(0, len(flat), 2):
+                pid, tf = flat[i], flat[i + 1]
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[pid] / (self.avg_length or 1))
+                scores[pid] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return [(score, pid) for pid, score in scores.most_common(k)]
+
+    def select_text(self, queries, k=5, max_chars=8000):
+        """The top-k passages for each query, in document order, within max_chars.
+
+        Returns None when nothing matches, so callers can fall back to the
+        whole text.
+        """
+        ranked = []
+        for query in queries:
+            ranked.extend(self.search(query, k))
+        chosen = set()
+        used = 0
+        for score, pid in sorted(ranked, reverse=True):
+            if pid in chosen:
+                continue
+            size = len(self.passages[pid][2])
+            if used + size > max_chars and chosen:
+                continue
+            chosen.add(pid)
+            used += size
+        if not chosen:
+            return None
+        return "\n\n".join(self.passages[pid][2].strip() for pid in sorted(chosen))
+
+
+def is_passage_index(object_path):
+    return object_path.endswith(INDEX_SUFFIX)
+
+
+def write_passage_index(bucket, object_path, index):
+    """Upload the index next to object_path; returns the metadata_json["passages"] pointer."""
+    raw = index.to_bytes()
+    blob = bucket.blob(object_path + INDEX_SUFFIX)
+    blob.upload_from_string(raw, content_type="application/gzip")
+    return {
+        "uri": f"gs://{bucket.name}/{blob.name}",
+        "format": "bm25+json+gzip",
+        "version": INDEX_VERSION,
+        "count": len(index.passages),
+        "terms": len(index.postings),
+        "compressed_bytes": len(raw),
+    }
+
+
+class PassageIndexCache:
+    """Small LRU of loaded indexes by URI (the concepts of one file arrive together)."""
+
+    def __init__(self, get_storage_client, max_entries=32):
+        self.get_storage_client = get_storage_client
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    def get(self, uri):
+        with self._lock:
+            index = self._entries.get(uri)
+            if index is not None:
+                self._entries.move_to_end(uri)
+                self._stats["hits"] += 1
+                return index
+            self._stats["misses"] += 1
+
+        if not uri.startswith("gs://"):
+            raise ValueError(f"Unsupported passage index URI: {uri}")
+        bucket_name, _, object_path = uri[len("gs://"):].partition("/")
+        raw = self.get_storage_client().bucket(bucket_name).blob(object_path).download_as_bytes()
+        index = PassageIndex.from_bytes(raw)
+
+        with self._lock:
+            self._entries[uri] = index
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return index
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        return stats
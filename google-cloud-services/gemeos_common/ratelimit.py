@@ -0,0 +1,203 @@
+"""Token-bucket rate limiting and adaptive backoff for Gemini calls."""
+import re
+import time
+import random
+import logging
+import threading
+
+from google.api_core import exceptions as google_exceptions
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+)
+
+_RETRY_IN = re.compile(r"retry in ([0-9]+(?:\.[0-9]+)?)\s*s", re.IGNORECASE)
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a call cannot be made within the wait budget or retries run out.
+
+    Handlers should let the Pub/Sub message be redelivered later rather than
+    holding the worker while the quota recovers.
+    """
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate` tokens per second."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, tokens=1):
+        """Take `tokens` (possibly going into debt) and return how long to wait before using them."""
+        tokens = min(tokens, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._paused_until - now)
+
+    def refund(self, tokens=1):
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + min(tokens, self.capacity))
+
+    def pause(self, seconds):
+        """Hold every caller for `seconds`, e.g. when the server asks us to back off."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+def retry_hint_seconds(error):
+    """Extract a server-provided retry delay from an API error, if any."""
+    for detail in getattr(error, "details", None) or []:
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+    response = getattr(error, "response", None)
+    retry_after = getattr(response, "headers", {}).get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    match = _RETRY_IN.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+class RateLimiter:
+    """Shared request/token budget plus retry with exponential backoff and jitter.
+
+    One instance per process is shared by every thread that calls Gemini, so
+    concurrent chunk prompts draw from the same quota. requests_per_minute
+    and tokens_per_minute are this instance's share of the project quota.
+
+    With a MetricsRegistry as metrics, each attempt's latency and the
+    token counts reported by the API (usage_metadata) are recorded there.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute=None, max_attempts=5,
+                 base_delay=1.0, max_delay=60.0, max_wait=30.0, metrics=None):
+        self.requests = TokenBucket(requests_per_minute / 60.0, max(1, requests_per_minute / 6.0))
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute / 6.0) if tokens_per_minute else None
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._stats = {
+            "calls": 0,
+            "attempts": 0,
+            "retries": 0,
+            "server_hints": 0,
+            "throttled_seconds": 0.0,
+            "backoff_seconds": 0.0,
+            "wait_budget_exceeded": 0,
+            "failures": 0
+        }
+        self.latency = self.token_counts = None
+        if metrics is not None:
+            self.latency = metrics.histogram(
+                "gemini_call_duration_seconds", "Latency of each Gemini API attempt.", ("outcome",)
+            )
+            self.token_counts = metrics.counter(
+                "gemini_tokens_total", "Gemini tokens: prompt/output as reported by the API, estimated as budgeted.",
+                ("type",)
+            )
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _acquire(self, estimated_tokens):
+        wait = self.requests.reserve(1)
+        if self.tokens is not None and estimated_tokens:
+            wait = max(wait, self.tokens.reserve(estimated_tokens))
+        if wait > self.max_wait:
+            self.requests.refund(1)
+            if self.tokens is not None and estimated_tokens:
+                self.tokens.refund(estimated_tokens)
+            self._count("wait_budget_exceeded")
+            raise RateLimitExceeded(f"Gemini quota wait of {wait:.1f}s exceeds budget of {self.max_wait:.0f}s")
+        if wait > 0:
+            self._count("throttled_seconds", wait)
+            time.sleep(wait)
+
+    def call(self, fn, estimated_tokens=0):
+        """Run fn() under the rate limit, retrying retryable API errors.
+
+        estimated_tokens is charged against the tokens-per-minute bucket.
+        Raises RateLimitExceeded when the wait budget or attempts run out;
+        non-retryable errors propagate unchanged.
+        """
+        self._count("calls")
+        if self.token_counts is not None and estimated_tokens:
+            self.token_counts.inc(estimated_tokens, type="estimated")
+        for attempt in range(1, self.max_attempts + 1):
+            self._acquire(estimated_tokens)
+            self._count("attempts")
+            started = time.perf_counter()
+            try:
+                result = fn()
+            except RETRYABLE_ERRORS as e:
+                self._observe(started, "retryable_error")
+                if attempt == self.max_attempts:
+                    self._count("failures")
+                    raise RateLimitExceeded(f"Gemini call failed after {attempt} attempts: {e}") from e
+
+                hint = retry_hint_seconds(e)
+                if hint is not None:
+                    self._count("server_hints")
+                    delay = hint
+                    if isinstance(e, google_exceptions.ResourceExhausted):
+                        # Everyone sharing the quota should back off, not just this caller
+                        self.requests.pause(hint)
+                else:
+                    # Full jitter keeps concurrent callers from retrying in lockstep
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+                if delay > self.max_wait:
+                    self._count("wait_budget_exceeded")
+                    raise RateLimitExceeded(f"Gemini asked to retry in {delay:.1f}s: {e}") from e
+
+                logger.warning(f"Gemini call failed ({type(e).__name__}), retry {attempt}/{self.max_attempts - 1} in {delay:.1f}s")
+                self._count("retries")
+                self._count("backoff_seconds", delay)
+                time.sleep(delay)
+            except Exception:
+                self._observe(started, "error")
+                raise
+            else:
+                self._observe(started, "ok", result)
+                return result
+
+    def _observe(self, started, outcome, result=None):
+        if self.latency is None:
+            return
+        self.latency.observe(time.perf_counter() - started, outcome=outcome)
+        usage = getattr(result, "usage_metadata", None)
+        if usage is not None:
+            self.token_counts.inc(getattr(usage, "prompt_token_count", 0) or 0, type="prompt")
+            self.token_counts.inc(getattr(usage, "candidates_token_count", 0) or 0, type="output")
+
+
+def estimate_tokens(*texts):
+    """Rough token count (about four characters per token) for budgeting."""
+    return sum(len(t) for t in texts if t) // 4
@@ -0,0 +1,58 @@
+"""Text splitting helpers for building prompts from long documents."""
+import re
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def _split_long(paragraph, max_chars):
+    """Split a paragraph longer than max_chars at sentence, then line, then hard boundaries."""
+    if len(paragraph) <= max_chars:
+        return [paragraph]
+
+    pieces = []
+    current = ""
+    for sentence in _SENTENCE_END.split(paragraph):
+        for part in (sentence.split("\n") if len(sentence) > max_chars else [sentence]):
+            while len(part) > max_chars:
+                pieces.append(part[:max_chars])
+                part = part[max_chars:]
+            if current and len(current) + 1 + len(part) > max_chars:
+                pieces.append(current)
+                current = part
+            else:
+                current = f"{current} {part}" if current else part
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_into_chunks(text, max_chars):
+    """Split text into chunks of at most max_chars on paragraph boundaries.
+
+    Paragraphs (separated by blank lines) are packed greedily into chunks.
+    A paragraph that is too long on its own is split at sentence ends, then
+    at line breaks, and only as a last resort mid-line.
+    """
+    chunks = []
+    current = []
+    size = 0
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        for piece in _split_long(paragraph, max_chars):
+            if current and size + 2 + len(piece) > max_chars:
+                chunks.append("\n\n".join(current))
+                current = []
+                size = 0
+            size += len(piece) + (2 if current else 0)
+            current.append(piece)
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def normalize_name(name):
+    """Case- and whitespace-normalized form of a name, for duplicate checks."""
+    return " ".join(name.casefold().split()).strip(" .,:;-")
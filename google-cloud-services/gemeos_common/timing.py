@@ -0,0 +1,71 @@
+"""Per-request stage timings and their running aggregates."""
+import threading
+import time
+from contextlib import contextmanager
+
+
+class TimingStats:
+    """Count, total and max duration per stage across requests."""
+
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stages):
+        with self._lock:
+            for name, seconds in stages.items():
+                entry = self._stages.setdefault(name, [0, 0.0, 0.0])
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {
+                    "count": count,
+                    "avg_ms": round(total / count * 1000, 1) if count else 0.0,
+                    "max_ms": round(peak * 1000, 1),
+                }
+                for name, (count, total, peak) in self._stages.items()
+            }
+
+
+class StageTimer:
+    """Times the stages of one request.
+
+    Use stage(name) as a context manager, or timed(name, fn, ...) for work
+    submitted to another thread. Stages may overlap; "total" is wall time
+    from creation to finish().
+    """
+
+    def __init__(self, stats=None):
+        self.stats = stats
+        self.stages = {}
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def timed(self, name, fn, *args, **kwargs):
+        with self.stage(name):
+            return fn(*args, **kwargs)
+
+    def finish(self):
+        """Record the total, feed the aggregate and return a printable summary."""
+        self.record("total", time.perf_counter() - self._started)
+        with self._lock:
+            stages = dict(self.stages)
+        if self.stats is not None:
+            self.stats.observe(stages)
+        return " ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in stages.items())
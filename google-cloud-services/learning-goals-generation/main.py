@@ -3,37 +3,171 @@ import json
 import base64
 import traceback
 import sys
-import time
-from flask import Flask, request
-from supabase import create_client
-import google.generativeai as genai
-from google.cloud import storage
-from google.api_core import exceptions as google_exceptions
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request, jsonify
+
+# gemeos_common sits next to the service directories (and next to main.py in the container)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from gemeos_common.clients import get_gemini_model, get_storage_client, get_supabase, warm_up
+from gemeos_common.clients import stats as client_stats
+from gemeos_common.coalesce import Coalescer
+from gemeos_common.feedback import FeedbackSelector
+from gemeos_common.fewshot import ExampleSelector
+from gemeos_common.guidance import GuidanceCache
+from gemeos_common.instrumentation import Instrumentation
+from gemeos_common.ledger import ProcessingLedger, skip_response
+from gemeos_common.llm_cache import cached_call, is_json, open_response_cache
+from gemeos_common.metrics import CONTENT_TYPE
+from gemeos_common.passages import PassageIndexCache
+from gemeos_common.ratelimit import RateLimitExceeded, RateLimiter
 
 # --- Flask App ---
 app = Flask(__name__)
 
-# --- Config / Secrets ---
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") 
-
 # --- Clients ---
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-storage_client = storage.Client()
-genai.configure(api_key=GEMINI_API_KEY)
+# Supabase (SUPABASE_URL, SUPABASE_SERVICE_KEY), GCS and Gemini (GEMINI_API_KEY) clients
+# are created on first use and shared by all threads; see gemeos_common/clients.py
 
 # --- Constants ---
 GUIDANCE_BUCKET = "gemeos-guidance"
+GEMINI_MODEL = "gemini-1.5-pro-latest"
+GUIDANCE_CACHE_TTL_SECONDS = float(os.getenv("GUIDANCE_CACHE_TTL_SECONDS", 300))
+GUIDANCE_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("GUIDANCE_CACHE_NEGATIVE_TTL_SECONDS", 60))
+GUIDANCE_CACHE_MAX_ENTRIES = int(os.getenv("GUIDANCE_CACHE_MAX_ENTRIES", 256))
+
+# Structured logs (LOG_SAMPLE_RATE, LOG_DEBUG), per-stage timings and /metrics
+instrumentation = Instrumentation("learning-goals-generation")
+instrumentation.capture_logging()
+
+# Gemini quota share for this instance (the project quota divided by max instances)
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", 60))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", 0)) or None
+GEMINI_MAX_WAIT_SECONDS = float(os.getenv("GEMINI_MAX_WAIT_SECONDS", 30))
+
+gemini_limiter = RateLimiter(
+    GEMINI_RPM, GEMINI_TPM, max_wait=GEMINI_MAX_WAIT_SECONDS, metrics=instrumentation.metrics
+)
+
+# Gemini response cache. /tmp on Cloud Run is an in-memory filesystem, so the
+# cache counts against the instance's memory limit: keep LLM_CACHE_MAX_MB small,
+# or point LLM_CACHE_PATH at a mounted volume to allow a larger one
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_BYPASS = os.getenv("LLM_CACHE_BYPASS", "false").lower() == "true"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "/tmp/gemeos-llm-cache/learning-goals-generation.sqlite")
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", 32))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+
+response_cache = open_response_cache(
+    LLM_CACHE_PATH, LLM_CACHE_MAX_MB * 1024 * 1024, LLM_CACHE_TTL_SECONDS
+) if LLM_CACHE_ENABLED else None
+
+# Few-shot examples: only the most relevant ones that fit the token budget
+FEW_SHOT_TOKEN_BUDGET = int(os.getenv("FEW_SHOT_TOKEN_BUDGET", 2000))
+FEW_SHOT_MAX_EXAMPLES = int(os.getenv("FEW_SHOT_MAX_EXAMPLES", 8))
+
+def render_learning_goal_example(example):
+    snippet = example.get("snippet")
+    goals = example.get("learning_goals")
+    if snippet and goals:
+        return f"EXAMPLE INPUT:\n{snippet}\nEXAMPLE OUTPUT:\n{json.dumps({'learning_goals': goals})}\n\n"
+    return None
+
+few_shot_selector = ExampleSelector(
+    render_learning_goal_example,
+    token_budget=FEW_SHOT_TOKEN_BUDGET,
+    max_examples=FEW_SHOT_MAX_EXAMPLES
+)
+
+# Reviewer feedback: the prompt gets a capped, diverse sample; rejected goals are filtered locally
+feedback_selector = FeedbackSelector(
+    max_approved=int(os.getenv("FEEDBACK_MAX_APPROVED", 10)),
+    max_rejected=int(os.getenv("FEEDBACK_MAX_REJECTED", 5)),
+    threshold=float(os.getenv("REJECTED_GOAL_SIMILARITY", 0.7))
+)
+
+guidance_cache = GuidanceCache(
+    get_storage_client,
+    GUIDANCE_BUCKET,
+    ttl=GUIDANCE_CACHE_TTL_SECONDS,
+    negative_ttl=GUIDANCE_CACHE_NEGATIVE_TTL_SECONDS,
+    max_entries=GUIDANCE_CACHE_MAX_ENTRIES
+)
+
+# Processing ledger: redeliveries and duplicate publishes skip the Gemini call
+PROCESSING_LEDGER_ENABLED = os.getenv("PROCESSING_LEDGER_ENABLED", "true").lower() == "true"
+PROCESSING_LEASE_SECONDS = int(os.getenv("PROCESSING_LEASE_SECONDS", 600))
+
+ledger = ProcessingLedger(
+    get_supabase,
+    "learning-goals-generation",
+    lease_seconds=PROCESSING_LEASE_SECONDS,
+    enabled=PROCESSING_LEDGER_ENABLED
+)
+
+# The concept context (one Supabase RPC) and the guidance files (GCS) are fetched concurrently
+context_executor = ThreadPoolExecutor(max_workers=int(os.getenv("CONTEXT_FETCH_WORKERS", 8)))
+
+
+# Passage retrieval: prompts carry the passages about the concept instead of the whole text
+PASSAGE_RETRIEVAL_ENABLED = os.getenv("PASSAGE_RETRIEVAL_ENABLED", "true").lower() == "true"
+PASSAGE_TOP_K = int(os.getenv("PASSAGE_TOP_K", 6))
+PASSAGE_MAX_CHARS = int(os.getenv("PASSAGE_MAX_CHARS", 8000))
+
+passage_indexes = PassageIndexCache(
+    get_storage_client,
+    max_entries=int(os.getenv("PASSAGE_INDEX_CACHE_ENTRIES", 32))
+)
+
+# Batch mode: concepts sharing a source file get their goals from one prompt
+LEARNING_GOALS_BATCH_SIZE = int(os.getenv("LEARNING_GOALS_BATCH_SIZE", 20))
+# When > 0, single-concept messages for a domain arriving within this window are batched together
+# (must stay below the push subscription's ack deadline)
+LEARNING_GOALS_COALESCE_SECONDS = float(os.getenv("LEARNING_GOALS_COALESCE_SECONDS", 0))
+PUBSUB_ACK_DEADLINE_SECONDS = float(os.getenv("PUBSUB_ACK_DEADLINE_SECONDS", 10))
+
+batch_coalescer = Coalescer(window=LEARNING_GOALS_COALESCE_SECONDS, ack_deadline=PUBSUB_ACK_DEADLINE_SECONDS)
+batch_missing_concepts = instrumentation.metrics.counter(
+    "learning_goal_batch_missing_concepts_total",
+    "Concepts a batch response left out, by outcome (regenerated one by one, or failed).", ("outcome",)
+)
 
 # --- Healthcheck Route ---
 @app.route("/", methods=["GET"])
 def health_check():
     return "Gemeos learning goal generator is running", 200
 
+# --- Stats Route ---
+def collect_stats():
+    return {
+        "guidance_cache": guidance_cache.stats(),
+        "few_shot": few_shot_selector.stats(),
+        "feedback": feedback_selector.stats(),
+        "processing_ledger": ledger.stats(),
+        "instrumentation": instrumentation.stats(),
+        "batch_coalescer": batch_coalescer.stats(),
+        "passage_indexes": passage_indexes.stats(),
+        "gemini_rate_limiter": gemini_limiter.stats(),
+        "clients": client_stats(),
+        "llm_response_cache": response_cache.stats() if response_cache else None
+    }
+
+# Every numeric stat is also exported on /metrics
+instrumentation.metrics.export_stats("", collect_stats)
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify(collect_stats()), 200
+
+# --- Metrics Route ---
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(instrumentation.metrics.render(), content_type=CONTENT_TYPE)
+
 # --- Main Ingestion Route ---
 @app.route("/", methods=["POST"])
 def handle_pubsub():
+    lease = None
+    trace = instrumentation.trace("message")
     try:
         envelope = request.get_json()
         if not envelope or "message" not in envelope:
@@ -43,148 +177,443 @@ def handle_pubsub():
         if "data" not in pubsub_message:
             return "Bad Request: No data in message", 400
 
+        message_id = pubsub_message.get("messageId") or pubsub_message.get("message_id")
+        trace.annotate(message_id=message_id)
+        instrumentation.observe_message(pubsub_message)
+        if ledger.seen_message(message_id):
+            trace.finish("already_processed")
+            return "OK (already processed)", 200
+
         data = base64.b64decode(pubsub_message["data"]).decode("utf-8")
         attrs = json.loads(data)
         
         concept_id = attrs.get("concept_id")
+        concept_ids = attrs.get("concept_ids")
         domain_slug = attrs.get("domain_slug")
 
-        if not concept_id or not domain_slug:
-            return "Missing concept_id or domain_slug", 400
+        if not (concept_id or concept_ids) or not domain_slug:
+            return "Missing concept_id (or concept_ids) or domain_slug", 400
+
+        bypass_cache = bool(attrs.get("bypass_cache"))
+        if concept_ids or LEARNING_GOALS_COALESCE_SECONDS > 0:
+            requested = list(concept_ids or [concept_id])
+            trace.annotate(domain_slug=domain_slug, concepts=len(requested))
+            outcome, response = batch_coalescer.submit(
+                domain_slug, (requested, bypass_cache),
+                lambda requests: run_learning_goal_batches(domain_slug, requests, message_id)
+            )
+            trace.finish(outcome)
+            return response
+
+        trace.kind = "concept"
+        trace.annotate(concept_id=concept_id, domain_slug=domain_slug)
+        trace.log("📥 Received request")
 
-        print(f"📥 Received request for concept_id={concept_id}")
+        with trace.stage("prefetch"):
+            guidance_future = context_executor.submit(trace.timed, "guidance", fetch_guidance_from_gcs, domain_slug)
+            context = trace.timed("context", fetch_concept_context, concept_id)
+            guidance, examples = guidance_future.result()
 
-        extracted_text = fetch_text_for_concept(concept_id)
+        extracted_text = context.get("extracted_text")
         if not extracted_text:
+            trace.finish("not_found", "WARNING")
             return f"No extracted text found for concept_id: {concept_id}", 404
 
-        guidance, examples = fetch_guidance_from_gcs(domain_slug)
-        
-        approved_goals, rejected_goals = get_feedback_for_prompt(concept_id)
+        approved_goals = context["approved_goals"]
+        rejected_goals = context["rejected_goals"]
+
+        if context.get("name"):
+            with trace.stage("retrieval"):
+                extracted_text = select_relevant_text(extracted_text, context.get("passages_uri"), [context["name"]])
+
+        outcome, lease = ledger.claim(ledger.work_key(
+            "concept", concept_id, extracted_text, guidance, approved_goals, rejected_goals
+        ), message_id, force=bypass_cache)
+        skip = skip_response(outcome)
+        if skip:
+            trace.finish("skipped", reason=skip[0])
+            return skip
         
-        learning_goals = generate_learning_goals_with_gemini(extracted_text, guidance, examples, approved_goals, rejected_goals)
-        print(f"✅ Learning goals generated: {learning_goals}")
+        with trace.stage("gemini"):
+            learning_goals = generate_learning_goals_with_gemini(
+                extracted_text, guidance, examples, approved_goals, rejected_goals,
+                bypass_cache=bypass_cache
+            )
+        trace.log("Learning goals generated", "DEBUG", learning_goals=learning_goals)
 
-        if learning_goals:
-            save_learning_goals(learning_goals, concept_id)
+        with trace.stage("save"):
+            if learning_goals:
+                save_learning_goals(learning_goals, concept_id)
 
+        ledger.complete(lease, {"learning_goals": len(learning_goals)})
+        trace.finish(learning_goals=len(learning_goals))
         return "OK", 200
 
+    except RateLimitExceeded as e:
+        # Let Pub/Sub redeliver later instead of holding this worker while the quota recovers
+        trace.finish("deferred", "WARNING", error=str(e))
+        ledger.fail(lease, e)
+        return f"Too Many Requests: {str(e)}", 429
+
     except Exception as e:
-        print(f"❌ Error processing message: {str(e)}")
-        traceback.print_exc()
+        trace.finish("error", error=str(e), traceback=traceback.format_exc())
+        ledger.fail(lease, e)
         return f"Internal Server Error: {str(e)}", 500
 
+def run_learning_goal_batches(domain_slug, requests, message_id):
+    """Generate goals for every requested concept, one prompt per source file batch."""
+    concept_ids = list(dict.fromkeys(cid for ids, _ in requests for cid in ids))
+    bypass_cache = any(bypass for _, bypass in requests)
+    trace = instrumentation.trace("batch", message_id=message_id, domain_slug=domain_slug, concepts=len(concept_ids))
+
+    with trace.stage("prefetch"):
+        guidance_future = context_executor.submit(trace.timed, "guidance", fetch_guidance_from_gcs, domain_slug)
+        contexts, texts, passages = trace.timed("context", fetch_batch_context, concept_ids)
+        guidance, examples = guidance_future.result()
+
+    by_file = {}
+    for context in contexts:
+        if texts.get(context.get("source_file_id")):
+            by_file.setdefault(context["source_file_id"], []).append(context)
+        else:
+            trace.log("No extracted text found", "WARNING", concept_id=context["concept_id"])
+
+    saved = 0
+    batches = 0
+    for source_file_id, file_contexts in by_file.items():
+        for start in range(0, len(file_contexts), LEARNING_GOALS_BATCH_SIZE):
+            batch = file_contexts[start:start + LEARNING_GOALS_BATCH_SIZE]
+            with trace.stage("retrieval"):
+                text = select_relevant_text(
+                    texts[source_file_id], passages.get(source_file_id),
+                    [context["name"] for context in batch], max_chars=PASSAGE_MAX_CHARS * len(batch)
+                )
+            saved += process_learning_goal_batch(
+                source_file_id, text, batch, guidance, examples,
+                message_id, bypass_cache, trace
+            )
+            batches += 1
+
+    trace.finish(files=len(by_file), prompts=batches, learning_goals=saved)
+    return "OK", 200
+
+def process_learning_goal_batch(source_file_id, text, batch, guidance, examples, message_id, bypass_cache, trace):
+    lease = None
+    try:
+        outcome, lease = ledger.claim(ledger.work_key(
+            "file", source_file_id, text, guidance,
+            [(c["concept_id"], c["approved_goals"], c["rejected_goals"]) for c in batch]
+        ), message_id, force=bypass_cache)
+        if skip_response(outcome):
+            trace.log("🔁 Skipping batch", source_file_id=source_file_id, reason=outcome)
+            return 0
+
+        with trace.stage("gemini"):
+            goals_by_concept = generate_learning_goals_batch_with_gemini(
+                text, batch, guidance, examples, bypass_cache=bypass_cache
+            )
+            missing = [c for c in batch if str(c["concept_id"]) not in goals_by_concept]
+            if missing:
+                trace.log(
+                    "Batch response left out concepts, generating them one by one", "WARNING",
+                    source_file_id=source_file_id, concept_ids=[c["concept_id"] for c in missing]
+                )
+                for context in missing:
+                    goals_by_concept.update(generate_learning_goals_batch_with_gemini(
+                        text, [context], guidance, examples, bypass_cache=bypass_cache
+                    ))
+                failed = [c["concept_id"] for c in missing if str(c["concept_id"]) not in goals_by_concept]
+                batch_missing_concepts.inc(len(missing) - len(failed), outcome="regenerated")
+                if failed:
+                    # Save nothing, so the redelivered batch starts over
+                    batch_missing_concepts.inc(len(failed), outcome="failed")
+                    raise RuntimeError(f"No learning goals returned for concepts {failed}")
+        with trace.stage("save"):
+            saved = save_learning_goals_bulk(goals_by_concept)
+
+        ledger.complete(lease, {"concepts": len(batch), "learning_goals": saved})
+        return saved
+
+    except Exception as e:
+        ledger.fail(lease, e)
+        raise
+
 # --- Utilities ---
+def fetch_concept_context(concept_id):
+    """Extracted text plus approved/rejected goals for a concept in one round trip.
+
+    Falls back to the separate queries if the get_learning_goal_context RPC
+    is not deployed yet.
+    """
+    try:
+        res = get_supabase().rpc("get_learning_goal_context", {"p_concept_id": concept_id}).execute()
+        context = res.data or {}
+        if isinstance(context, list):
+            context = context[0] if context else {}
+        approved_goals = context.get("approved_goals") or []
+        rejected_goals = context.get("rejected_goals") or []
+        instrumentation.log(f"✅ Loaded context: {len(approved_goals)} approved, {len(rejected_goals)} rejected goals.")
+        return {
+            "name": context.get("name"),
+            "extracted_text": context.get("extracted_text"),
+            "passages_uri": context.get("passages_uri"),
+            "approved_goals": approved_goals,
+            "rejected_goals": rejected_goals
+        }
+    except Exception as e:
+        instrumentation.log(f"⚠️ get_learning_goal_context failed, using separate queries. Error: {e}", "WARNING")
+
+    extracted_text = fetch_text_for_concept(concept_id)
+    approved_goals, rejected_goals = get_feedback_for_prompt(concept_id) if extracted_text else ([], [])
+    return {"extracted_text": extracted_text, "approved_goals": approved_goals, "rejected_goals": rejected_goals}
+
+def fetch_batch_context(concept_ids):
+    """Per-concept context and the source files' texts (each once) for a batch.
+
+    Falls back to separate queries if the get_learning_goal_contexts RPC is
+    not deployed yet.
+    """
+    try:
+        res = get_supabase().rpc("get_learning_goal_contexts", {"p_concept_ids": concept_ids}).execute()
+        data = res.data or {}
+        contexts = data.get("concepts") or []
+        texts = data.get("texts") or {}
+        passages = data.get("passages") or {}
+        instrumentation.log(f"✅ Loaded context for {len(contexts)} concepts from {len(texts)} source files.")
+        return contexts, texts, passages
+    except Exception as e:
+        instrumentation.log(f"⚠️ get_learning_goal_contexts failed, using separate queries. Error: {e}", "WARNING")
+
+    concepts = get_supabase().table("concepts").select("id, name, source_file_id").in_("id", concept_ids).execute().data or []
+    file_ids = list({c["source_file_id"] for c in concepts if c.get("source_file_id")})
+    files = []
+    if file_ids:
+        files = get_supabase().table("domain_extracted_files").select("id, extracted_text, metadata_json")\
+            .in_("id", file_ids).execute().data or []
+    texts = {}
+    passages = {}
+    for f in files:
+        if f.get("extracted_text"):
+            texts[f["id"]] = f["extracted_text"]
+        passages_uri = ((f.get("metadata_json") or {}).get("passages") or {}).get("uri")
+        if passages_uri:
+            passages[f["id"]] = passages_uri
+    contexts = []
+    for concept in concepts:
+        approved_goals, rejected_goals = get_feedback_for_prompt(concept["id"]) \
+            if texts.get(concept.get("source_file_id")) else ([], [])
+        contexts.append({
+            "concept_id": concept["id"],
+            "name": concept.get("name"),
+            "source_file_id": concept.get("source_file_id"),
+            "approved_goals": approved_goals,
+            "rejected_goals": rejected_goals
+        })
+    return contexts, texts, passages
+
+def select_relevant_text(text, passages_uri, queries, max_chars=PASSAGE_MAX_CHARS):
+    """The file's passages that best match the concept names, or text if there is no usable index."""
+    if not PASSAGE_RETRIEVAL_ENABLED or not passages_uri:
+        return text
+    try:
+        selected = passage_indexes.get(passages_uri).select_text(queries, PASSAGE_TOP_K, max_chars)
+    except Exception as e:
+        instrumentation.log(f"⚠️ Could not use passage index {passages_uri}, sending the whole text. Error: {e}", "WARNING")
+        return text
+    if not selected or len(selected) >= len(text):
+        return text
+    instrumentation.log(f"📚 Sending {len(selected)} of {len(text)} characters (top passages for {len(queries)} concepts)")
+    return selected
+
 def fetch_text_for_concept(concept_id):
-    concept_res = supabase.table("concepts").select("source_file_id").eq("id", concept_id).single().execute()
+    concept_res = get_supabase().table("concepts").select("source_file_id").eq("id", concept_id).single().execute()
     if not concept_res.data or not concept_res.data.get("source_file_id"):
-        print(f"Could not find source file for concept {concept_id}")
+        instrumentation.log(f"⚠️ Could not find source file for concept {concept_id}", "WARNING")
         return None
     
     source_file_id = concept_res.data["source_file_id"]
-    text_res = supabase.table("domain_extracted_files").select("extracted_text").eq("id", source_file_id).single().execute()
+    text_res = get_supabase().table("domain_extracted_files").select("extracted_text").eq("id", source_file_id).single().execute()
     return text_res.data.get("extracted_text") if text_res.data else None
 
 def fetch_guidance_from_gcs(domain_slug):
     try:
-        bucket = storage_client.bucket(GUIDANCE_BUCKET)
-        
-        guidance_blob = bucket.blob(f"{domain_slug}/guidance/learning_goals/learning_goals_guidance.md")
-        guidance_text = guidance_blob.download_as_text()
-        
-        examples_blob = bucket.blob(f"{domain_slug}/guidance/learning_goals/learning_goals_examples.jsonl")
-        examples_text = examples_blob.download_as_text()
-        examples = [json.loads(line) for line in examples_text.strip().split('\n')]
+        guidance_text = guidance_cache.get_text(domain_slug, f"{domain_slug}/guidance/learning_goals/learning_goals_guidance.md")
+        examples = guidance_cache.get_jsonl(domain_slug, f"{domain_slug}/guidance/learning_goals/learning_goals_examples.jsonl")
+        if guidance_text is None or examples is None:
+            instrumentation.log(f"⚠️ No guidance files in GCS for domain '{domain_slug}'. Using default prompt.", "WARNING")
+            return None, None
         
-        print(f"✅ Successfully loaded guidance and {len(examples)} examples from GCS.")
+        instrumentation.log(f"✅ Loaded guidance and {len(examples)} examples (cache: {guidance_cache.stats()['hit_ratio']:.0%} hits).")
         return guidance_text, examples
     except Exception as e:
-        print(f"⚠️ Warning: Could not load guidance files from GCS for domain '{domain_slug}'. Using default prompt. Error: {e}")
+        instrumentation.log(f"⚠️ Could not load guidance files from GCS for domain '{domain_slug}'. Using default prompt. Error: {e}", "WARNING")
         return None, None
 
 def get_feedback_for_prompt(concept_id):
     try:
-        approved_res = supabase.table("learning_goals").select("goal_description").eq("concept_id", concept_id).eq("status", "approved").execute()
+        approved_res = get_supabase().table("learning_goals").select("goal_description").eq("concept_id", concept_id).eq("status", "approved").execute()
         approved_goals = [item['goal_description'] for item in approved_res.data]
         
-        rejected_res = supabase.table("learning_goals").select("goal_description").eq("concept_id", concept_id).eq("status", "rejected").execute()
+        rejected_res = get_supabase().table("learning_goals").select("goal_description").eq("concept_id", concept_id).eq("status", "rejected").execute()
         rejected_goals = [item['goal_description'] for item in rejected_res.data]
         
-        print(f"✅ Loaded feedback: {len(approved_goals)} approved, {len(rejected_goals)} rejected.")
+        instrumentation.log(f"✅ Loaded feedback: {len(approved_goals)} approved, {len(rejected_goals)} rejected.")
         return approved_goals, rejected_goals
 
     except Exception as e:
-        print(f"⚠️ Warning: Could not fetch feedback from database. Error: {e}")
+        instrumentation.log(f"⚠️ Could not fetch feedback from database. Error: {e}", "WARNING")
         return [], []
 
-def generate_learning_goals_with_gemini(text, guidance, examples, approved_goals, rejected_goals):
+def generate_learning_goals_with_gemini(text, guidance, examples, approved_goals, rejected_goals, bypass_cache=False):
     system_prompt = guidance if guidance else "You are an expert in curriculum design. Generate learning goals based on the provided text."
     
-    few_shot_examples = ""
-    if examples:
-        for example in examples:
-            snippet = example.get("snippet")
-            goals = example.get("learning_goals")
-            if snippet and goals:
-                few_shot_examples += f"EXAMPLE INPUT:\n{snippet}\nEXAMPLE OUTPUT:\n{json.dumps({'learning_goals': goals})}\n\n"
+    few_shot_examples = few_shot_selector.select(examples, text)
 
+    prompt_approved, prompt_rejected = feedback_selector.prompt_feedback(approved_goals, rejected_goals)
     feedback_instructions = ""
-    if approved_goals:
-        feedback_instructions += f"Here are some examples of GOOD learning goals that have been approved: {json.dumps(approved_goals)}\n"
-    if rejected_goals:
-        feedback_instructions += f"IMPORTANT: Do NOT suggest any of the following goals, as they have been rejected: {json.dumps(rejected_goals)}\n"
+    if prompt_approved:
+        feedback_instructions += f"Here are some examples of GOOD learning goals that have been approved: {json.dumps(prompt_approved)}\n"
+    if prompt_rejected:
+        feedback_instructions += f"IMPORTANT: Do NOT suggest any of the following goals, as they have been rejected: {json.dumps(prompt_rejected)}\n"
 
     prompt = f"""{few_shot_examples}{feedback_instructions}Based on the instructions and examples, analyze the following text and generate new, unique learning goals.
 
 TEXT TO ANALYZE:
 {text}"""
 
-    # --- ADDED LOGGING BLOCK ---
-    print("--- FINAL PROMPT SENT TO GEMINI ---")
-    print(f"System Prompt: {system_prompt}")
-    print(f"User Prompt: {prompt}")
-    print("------------------------------------")
-    # --- END OF LOGGING BLOCK ---
+    prompt_tokens = few_shot_selector.record_prompt(system_prompt, prompt)
+    instrumentation.log("Prompt built", prompt_tokens=prompt_tokens)
+    instrumentation.debug_prompt(system_prompt, prompt)
 
-    model = genai.GenerativeModel('gemini-1.5-pro-latest')
-    
-    response = model.generate_content(
-        [system_prompt, prompt],
-        generation_config=genai.types.GenerationConfig(
-            response_mime_type="application/json",
-            temperature=0.3
+    parsed_json = call_gemini_json(system_prompt, prompt, prompt_tokens, bypass_cache)
+    if parsed_json is None:
+        return []
+    return feedback_selector.filter_rejected(parsed_json.get("learning_goals", []), rejected_goals)
+
+def generate_learning_goals_batch_with_gemini(text, batch, guidance, examples, bypass_cache=False):
+    """Goals for several concepts of one source file; the text is sent once.
+
+    Returns {concept_id: [goal, ...]} for the concepts in batch the model
+    answered with a list; the caller handles the ones it left out. Responses
+    that leave any out are not cached, so a retry asks the model again.
+    """
+    system_prompt = guidance if guidance else "You are an expert in curriculum design. Generate learning goals based on the provided text."
+
+    few_shot_examples = few_shot_selector.select(examples, text)
+
+    concept_lines = []
+    for context in batch:
+        concept_lines.append(f"- {context['concept_id']}: {context['name']}")
+        prompt_approved, prompt_rejected = feedback_selector.prompt_feedback(
+            context["approved_goals"], context["rejected_goals"]
         )
+        if prompt_approved:
+            concept_lines.append(f"  Approved goals (GOOD examples): {json.dumps(prompt_approved)}")
+        if prompt_rejected:
+            concept_lines.append(f"  Rejected goals (do NOT suggest these): {json.dumps(prompt_rejected)}")
+    concept_block = "\n".join(concept_lines)
+
+    prompt = f"""{few_shot_examples}Based on the instructions and examples, analyze the following text and generate new, unique learning goals for EACH of the concepts listed below.
+
+Return your response as a JSON object with a single key "concepts", whose value is an object mapping each concept ID below to its list of learning goals, in the same format as the examples.
+
+CONCEPTS:
+{concept_block}
+
+TEXT TO ANALYZE:
+{text}"""
+
+    prompt_tokens = few_shot_selector.record_prompt(system_prompt, prompt)
+    instrumentation.log("Batch prompt built", concepts=len(batch), prompt_tokens=prompt_tokens)
+    instrumentation.debug_prompt(system_prompt, prompt)
+
+    rejected = {str(context["concept_id"]): context["rejected_goals"] for context in batch}
+    parsed_json = call_gemini_json(
+        system_prompt, prompt, prompt_tokens, bypass_cache,
+        validate=lambda content: len(goals_by_concept_id(content, rejected)) == len(rejected)
+    )
+    by_id = goals_by_concept_id(parsed_json, rejected)
+    return {
+        concept_id: feedback_selector.filter_rejected(goals, rejected[concept_id])
+        for concept_id, goals in by_id.items()
+    }
+
+def goals_by_concept_id(response, concept_ids):
+    """The goal lists in a batch response (parsed or raw JSON) for concept_ids."""
+    if isinstance(response, str):
+        if not is_json(response):
+            return {}
+        response = json.loads(response)
+    by_id = response.get("concepts") if isinstance(response, dict) else None
+    if not isinstance(by_id, dict):
+        return {}
+    return {
+        concept_id: goals for concept_id, goals in by_id.items()
+        if concept_id in concept_ids and isinstance(goals, list)
+    }
+
+def call_gemini_json(system_prompt, prompt, prompt_tokens, bypass_cache=False, validate=is_json):
+    """Run a JSON-mode Gemini call (through the response cache); None if unparseable.
+
+    Only responses that pass validate are stored in the cache.
+    """
+    model = get_gemini_model(GEMINI_MODEL)
+    
+    config = {
+        "response_mime_type": "application/json",
+        "temperature": 0.3
+    }
+    content = cached_call(
+        response_cache, GEMINI_MODEL, system_prompt, prompt, config,
+        lambda: gemini_limiter.call(
+            lambda: model.generate_content(
+                [system_prompt, prompt],
+                generation_config=config
+            ),
+            estimated_tokens=prompt_tokens
+        ).text,
+        bypass=bypass_cache or LLM_CACHE_BYPASS,
+        validate=validate
     )
     
-    content = response.text
     try:
-        parsed_json = json.loads(content)
-        return parsed_json.get("learning_goals", [])
+        return json.loads(content)
     except (json.JSONDecodeError, TypeError):
-        print(f"⚠️ Failed to parse Gemini JSON response for learning goals: {content}")
-        return []
+        instrumentation.log("⚠️ Failed to parse Gemini JSON response for learning goals", "WARNING", response=content)
+        return None
+
+def learning_goal_rows(goals, concept_id):
+    return [{
+        "concept_id": concept_id,
+        "goal_description": goal.get("goal_description"),
+        "bloom_level": goal.get("bloom_level"),
+        "goal_type": goal.get("goal_type"),
+        "sequence_order": goal.get("sequence_order"),
+        "status": "suggested"
+    } for goal in goals if isinstance(goal, dict)]
 
 def save_learning_goals(goals, concept_id):
     if not goals:
-        print("No learning goals to save.")
+        instrumentation.log("No learning goals to save.")
         return
 
-    rows = []
-    for goal in goals:
-        rows.append({
-            "concept_id": concept_id,
-            "goal_description": goal.get("goal_description"),
-            "bloom_level": goal.get("bloom_level"),
-            "goal_type": goal.get("goal_type"),
-            "sequence_order": goal.get("sequence_order"),
-            "status": "suggested"
-        })
-    
-    supabase.table("learning_goals").insert(rows).execute()
-    print(f"✅ Successfully saved {len(rows)} learning goals to Supabase.")
+    rows = learning_goal_rows(goals, concept_id)
+    get_supabase().table("learning_goals").insert(rows).execute()
+    instrumentation.log(f"✅ Successfully saved {len(rows)} learning goals to Supabase.")
+
+def save_learning_goals_bulk(goals_by_concept):
+    """Insert the goals of several concepts in one request; returns the row count."""
+    rows = [row for concept_id, goals in goals_by_concept.items() for row in learning_goal_rows(goals, concept_id)]
+    if not rows:
+        instrumentation.log("No learning goals to save.")
+        return 0
+    get_supabase().table("learning_goals").insert(rows).execute()
+    instrumentation.log(f"✅ Successfully saved {len(rows)} learning goals for {len(goals_by_concept)} concepts to Supabase.")
+    return len(rows)
 
 # --- Start App ---
 if __name__ == "__main__":
-    print("🚀 Starting gemeos-learning-goal-generator service...")
-    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 8080)))
+    port = int(os.getenv("PORT", 8080))
+    instrumentation.log("🚀 Starting gemeos-learning-goal-generator service", port=port)
+    warm_up(get_supabase, get_storage_client, lambda: get_gemini_model(GEMINI_MODEL))
+    app.run(host="0.0.0.0", port=port)
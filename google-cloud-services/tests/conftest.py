@@ -0,0 +1,39 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+# Services import gemeos_common from the parent directory and their own modules by name
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for path in (ROOT, os.path.join(ROOT, "concept-structurer"), os.path.join(ROOT, "gemeos-preprocessor")):
+    sys.path.insert(0, path)
+
+# Importing a service must not open the on-disk LLM response cache
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+
+
+def load_service(directory):
+    """Import <directory>/main.py under a name of its own (every service has a main.py)."""
+    name = directory.replace("-", "_") + "_main"
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, directory, "main.py"))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
+
+
+@pytest.fixture
+def chunker():
+    return load_service("concept-chunker")
+
+
+@pytest.fixture
+def preprocessor():
+    return load_service("gemeos-preprocessor")
+
+
+@pytest.fixture
+def learning_goals():
+    return load_service("learning-goals-generation")
@@ -0,0 +1,57 @@
+import io
+
+from chunking import build_chunks, write_chunks_sidecar
+from gemeos_common.chunks import is_sidecar, iter_chunks, read_text
+
+
+class FakeBlob:
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    def upload_from_string(self, data, content_type=None):
+        self.store[self.name] = data
+
+    def open(self, mode):
+        return io.BytesIO(self.store[self.name])
+
+
+class FakeBucket:
+    name = "uploads"
+
+    def __init__(self):
+        self.store = {}
+
+    def blob(self, name):
+        return FakeBlob(self.store, name)
+
+
+class FakeStorage:
+    def __init__(self, bucket):
+        self._bucket = bucket
+
+    def bucket(self, name):
+        return self._bucket
+
+
+PAGES = ["Intervals\n" * 30, "Triads and seventh chords\n" * 30, "Cadences\n" * 30]
+
+
+def _sidecar():
+    bucket = FakeBucket()
+    pointer = write_chunks_sidecar(bucket, "domain/book.pdf", build_chunks(PAGES, target_chars=200))
+    return FakeStorage(bucket), pointer
+
+
+def test_sidecar_round_trip_restores_the_full_text():
+    storage, pointer = _sidecar()
+
+    assert is_sidecar(pointer["uri"])
+    assert read_text(storage, pointer["uri"]) == "\n".join(PAGES)
+
+
+def test_reading_stops_at_the_requested_pages_and_characters():
+    storage, pointer = _sidecar()
+
+    assert {chunk["page"] for chunk in iter_chunks(storage, pointer["uri"], pages={2})} == {2}
+    assert read_text(storage, pointer["uri"], max_chars=250) == "\n".join(PAGES)[:250]
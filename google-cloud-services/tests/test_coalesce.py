@@ -0,0 +1,74 @@
+import threading
+import time
+
+import pytest
+
+from gemeos_common.coalesce import COALESCED, LEADER, Coalescer
+
+
+def test_requests_within_the_window_share_one_run():
+    coalescer = Coalescer(window=0.05)
+    runs = []
+    results = {}
+
+    def submit(name):
+        results[name] = coalescer.submit("domain", name, lambda payloads: runs.append(sorted(payloads)) or len(runs))
+
+    threads = [threading.Thread(target=submit, args=(name,)) for name in "abc"]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.005)
+    for thread in threads:
+        thread.join()
+
+    assert runs == [["a", "b", "c"]]
+    assert sorted(outcome for outcome, _ in results.values()) == [COALESCED, COALESCED, LEADER]
+    assert coalescer.stats()["in_flight"] == 0
+
+
+def test_leader_returns_after_its_own_run_and_hands_off():
+    coalescer = Coalescer(window=0)
+    started = threading.Event()
+    release = threading.Event()
+    runs = []
+    finished = {}
+
+    def fn(payloads):
+        runs.append(payloads)
+        if payloads == ["first"]:
+            started.set()
+            release.wait(1)
+        return payloads
+
+    def submit(name):
+        finished[name] = coalescer.submit("domain", name, fn)
+
+    leader = threading.Thread(target=submit, args=("first",))
+    leader.start()
+    started.wait(1)
+    followers = [threading.Thread(target=submit, args=(name,)) for name in ("second", "third")]
+    for thread in followers:
+        thread.start()
+    time.sleep(0.02)
+    release.set()
+    leader.join(1)
+
+    assert finished["first"] == (LEADER, ["first"])
+    for thread in followers:
+        thread.join(1)
+    assert runs == [["first"], ["second", "third"]]
+    assert finished["second"] == (LEADER, ["second", "third"])
+    assert finished["third"] == (COALESCED, ["second", "third"])
+    assert coalescer.stats()["handoffs"] == 1
+
+
+def test_failed_run_fails_only_its_batch():
+    coalescer = Coalescer(window=0)
+
+    def fn(payloads):
+        raise RuntimeError("gemini down")
+
+    with pytest.raises(RuntimeError):
+        coalescer.submit("domain", "a", fn)
+    assert coalescer.submit("domain", "b", lambda payloads: payloads) == (LEADER, ["b"])
+    assert coalescer.stats()["failed_runs"] == 1
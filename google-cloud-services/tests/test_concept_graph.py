@@ -0,0 +1,67 @@
+from gemeos_common.concept_graph import ConceptGraph
+
+CONCEPTS = [
+    {"id": "c1", "name": "Harmony"},
+    {"id": "c2", "name": "Triads"},
+    {"id": "c3", "name": "Seventh Chords"},
+    {"id": "c4", "name": "Voice Leading"},
+    {"id": "c5", "name": "Rhythm"},
+]
+
+
+def test_a_valid_hierarchy_gets_order_depths_and_ancestors():
+    graph = ConceptGraph.from_hierarchy([
+        {"concept": "Harmony", "parent": None},
+        {"concept": "Triads", "parent": "Harmony"},
+        {"concept": "seventh chords", "parent": "Triads"},
+        {"concept": "Voice Leading", "parent": "Harmony"},
+        {"concept": "Rhythm", "parent": ""},
+    ], CONCEPTS)
+
+    assert graph.issues == {}
+    assert [graph.ids[i] for i in graph.roots] == ["c1", "c5"]
+    assert graph.learning_path("c3") == ["c1", "c2", "c3"]
+    assert [graph.depth[graph.index[c]] for c in ("c1", "c2", "c3")] == [0, 1, 2]
+    order = list(graph.order)
+    assert order.index(graph.index["c2"]) < order.index(graph.index["c3"])
+    assert graph.is_ancestor(graph.index["c1"], graph.index["c3"])
+    assert not graph.is_ancestor(graph.index["c4"], graph.index["c3"])
+
+
+def test_model_mistakes_are_repaired_and_reported():
+    graph = ConceptGraph.from_hierarchy([
+        {"concept": "Harmony", "parent": "Voice Leading"},
+        {"concept": "Voice Leading", "parent": "Harmony"},
+        {"concept": "Triads", "parent": "Triads"},
+        {"concept": "Triads", "parent": "Harmony"},
+        {"concept": "Counterpoint", "parent": "Harmony"},
+        {"concept": "Seventh Chords", "parent": "Arpeggios"},
+        "not an entry",
+    ], CONCEPTS)
+
+    assert graph.issues == {
+        "unknown_concepts": ["Counterpoint"],
+        "unknown_parents": ["Triads", "Arpeggios"],
+        "duplicates": ["Triads"],
+        "cycles_broken": ["Harmony"],
+        "orphans": ["Rhythm"],
+    }
+    assert len(graph) == 5
+    assert sorted(graph.ids[i] for i in graph.roots) == ["c1", "c2", "c3", "c5"]
+    assert graph.learning_path("c4") == ["c1", "c4"]
+
+
+def test_the_stored_form_round_trips():
+    graph = ConceptGraph.from_hierarchy([
+        {"concept": "Triads", "parent": "Harmony"},
+        {"concept": "Seventh Chords", "parent": "Triads"},
+    ], CONCEPTS)
+
+    data = graph.to_dict()
+    restored = ConceptGraph.from_dict(data)
+
+    node = next(node for node in data["nodes"] if node["id"] == "c3")
+    assert node["ancestor_ids"] == ["c1", "c2"]
+    assert node["depth"] == 2
+    assert restored.to_hierarchy() == graph.to_hierarchy()
+    assert restored.issues == graph.issues
@@ -0,0 +1,104 @@
+from gemeos_common.concept_index import ConceptNameIndex, stem_key
+
+
+class FakeQuery:
+    def __init__(self, supabase):
+        self.supabase = supabase
+        self.rows = list(supabase.rows)
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.rows = [row for row in self.rows if row[column] == value]
+        return self
+
+    def gt(self, column, value):
+        self.supabase.incremental += 1
+        self.rows = [row for row in self.rows if row[column] > value]
+        return self
+
+    def in_(self, column, values):
+        self.rows = [row for row in self.rows if row[column] in values]
+        return self
+
+    def execute(self):
+        self.supabase.fetches += 1
+        return type("Response", (), {"data": self.rows})()
+
+
+class FakeSupabase:
+    def __init__(self, rows):
+        self.rows = rows
+        self.fetches = 0
+        self.incremental = 0
+
+    def table(self, name):
+        assert name == "concepts"
+        return FakeQuery(self)
+
+
+def concept(concept_id, name, status="approved", updated_at="2025-10-01T00:00:00", domain_id="jazz"):
+    return {"id": concept_id, "name": name, "status": status, "updated_at": updated_at, "domain_id": domain_id}
+
+
+def test_duplicates_match_exactly_by_stem_or_by_trigrams():
+    supabase = FakeSupabase([concept(1, "Major Scales"), concept(2, "Dominant seventh chord")])
+    index = ConceptNameIndex(lambda: supabase)
+
+    assert index.find_duplicate("jazz", "major scales ") == ("Major Scales", "exact")
+    assert index.find_duplicate("jazz", "Major scale") == ("Major Scales", "stem")
+    assert index.find_duplicate("jazz", "Dominant seventh chordz") == ("Dominant seventh chord", "trigram 0.88")
+    assert index.find_duplicate("jazz", "Dominant seventh chord voicing") is None
+    assert index.find_duplicate("jazz", "Tritone substitution") is None
+    assert index.find_duplicate("other", "Major Scales") is None
+    assert index.stats()["checks"] == 6
+
+
+def test_stem_key_folds_plurals_and_suffixes():
+    assert stem_key("Chord Progressions") == stem_key("chord progression")
+    assert stem_key("Voicing") != stem_key("Voice")
+
+
+def test_rejected_concepts_are_not_indexed():
+    supabase = FakeSupabase([concept(1, "Modes", status="rejected")])
+    index = ConceptNameIndex(lambda: supabase)
+
+    assert index.find_duplicate("jazz", "Modes") is None
+
+
+def test_names_added_locally_match_before_the_database_reports_them():
+    supabase = FakeSupabase([])
+    index = ConceptNameIndex(lambda: supabase)
+    index.find_duplicate("jazz", "Modes")
+
+    index.add_local("jazz", "Blues Form")
+
+    assert index.find_duplicate("jazz", "blues form") == ("Blues Form", "exact")
+
+
+def test_refreshes_fetch_only_changed_rows():
+    supabase = FakeSupabase([concept(1, "Modes"), concept(2, "Cadences")])
+    index = ConceptNameIndex(lambda: supabase, refresh=0)
+    index.find_duplicate("jazz", "Modes")
+
+    supabase.rows = [
+        concept(1, "Modes", status="rejected", updated_at="2025-10-02T00:00:00"),
+        concept(2, "Cadences"),
+        concept(3, "Voice Leading", status="suggested", updated_at="2025-10-02T00:00:00"),
+    ]
+
+    assert index.find_duplicate("jazz", "Modes") is None
+    assert index.find_duplicate("jazz", "Voice leading") == ("Voice Leading", "exact")
+    assert index.find_duplicate("jazz", "Cadences") == ("Cadences", "exact")
+    assert supabase.incremental == 3
+
+
+def test_lookups_within_the_refresh_interval_do_not_query():
+    supabase = FakeSupabase([concept(1, "Modes")])
+    index = ConceptNameIndex(lambda: supabase, refresh=60)
+
+    index.find_duplicate("jazz", "Modes")
+    index.find_duplicate("jazz", "Cadences")
+
+    assert supabase.fetches == 1
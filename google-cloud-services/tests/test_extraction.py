@@ -0,0 +1,133 @@
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import extraction
+
+
+def make_pdf(path, texts):
+    """Write a minimal PDF with one line of text per page."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in texts:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    path.write_bytes(out)
+    return str(path)
+
+
+@pytest.fixture
+def pool():
+    yield
+    extraction._reset_process_pool(kill=True)
+
+
+def no_pool():
+    raise AssertionError("small documents should not use the pool")
+
+
+def test_small_documents_are_extracted_inline(tmp_path, monkeypatch):
+    path = make_pdf(tmp_path / "small.pdf", [f"Page {i}" for i in range(3)])
+    monkeypatch.setattr(extraction, "get_process_pool", no_pool)
+
+    pages, page_count, info = extraction.extract_pages_supervised(path)
+
+    assert pages == ["Page 0", "Page 1", "Page 2"]
+    assert page_count == 3
+    assert info["status"] == extraction.STATUS_COMPLETE
+
+
+def test_long_documents_are_extracted_on_the_pool_in_page_order(tmp_path, monkeypatch, pool):
+    path = make_pdf(tmp_path / "long.pdf", [f"Page {i}" for i in range(40)])
+    monkeypatch.setattr(extraction, "PARALLEL_MIN_PAGES", 4)
+    monkeypatch.setattr(extraction, "MIN_PAGES_PER_TASK", 4)
+
+    pages, page_count, info = extraction.extract_pages_supervised(path, workers=2)
+
+    assert pages == [f"Page {i}" for i in range(40)]
+    assert page_count == 40
+    assert info["status"] == extraction.STATUS_COMPLETE
+
+
+def test_an_expired_deadline_times_out_inline(tmp_path):
+    path = make_pdf(tmp_path / "small.pdf", ["Page 0", "Page 1"])
+
+    pages, page_count, info = extraction.extract_pages_supervised(path, deadline_seconds=0)
+
+    assert pages == []
+    assert info["status"] == extraction.STATUS_TIMEOUT
+
+
+def test_an_expired_deadline_times_out_on_the_pool(tmp_path, monkeypatch, pool):
+    path = make_pdf(tmp_path / "long.pdf", [f"Page {i}" for i in range(10)])
+    monkeypatch.setattr(extraction, "PARALLEL_MIN_PAGES", 4)
+
+    pages, page_count, info = extraction.extract_pages_supervised(path, deadline_seconds=0, workers=2)
+
+    assert pages == []
+    assert page_count is None
+    assert info["status"] == extraction.STATUS_TIMEOUT
+
+
+def test_a_range_stops_at_the_memory_budget(tmp_path):
+    path = make_pdf(tmp_path / "small.pdf", ["Page 0", "Page 1", "Page 2"])
+
+    page_count, pages, status = extraction._extract_page_range(path, 0, 3, time.time() + 30, 0, float("inf"))
+
+    assert (page_count, pages, status) == (3, ["Page 0"], extraction.STATUS_MEMORY_LIMIT)
+
+
+class FakePool:
+    def __init__(self):
+        self.shut_down = False
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+def test_a_crashed_worker_fails_only_its_range(monkeypatch):
+    broken_pool = FakePool()
+    monkeypatch.setattr(extraction, "_process_pool", broken_pool)
+    future = Future()
+    future.set_exception(BrokenProcessPool("worker killed"))
+
+    assert extraction._result_or_failure(future) == (None, [], extraction.STATUS_FAILED)
+    assert broken_pool.shut_down
+    assert extraction._process_pool is None
+
+
+def test_extraction_stops_at_the_character_budget(tmp_path, monkeypatch, pool):
+    path = make_pdf(tmp_path / "long.pdf", [f"Page {i}" for i in range(40)])
+    monkeypatch.setattr(extraction, "PARALLEL_MIN_PAGES", 4)
+    monkeypatch.setattr(extraction, "MIN_PAGES_PER_TASK", 4)
+
+    pages, page_count, info = extraction.extract_pages_supervised(path, workers=1, max_chars=40)
+
+    assert pages == [f"Page {i}" for i in range(len(pages))]
+    assert 4 <= len(pages) < 40
+    assert page_count == 40
+    assert info["status"] == extraction.STATUS_TRUNCATED
+
+
+def test_inline_extraction_stops_at_the_character_budget(tmp_path):
+    path = make_pdf(tmp_path / "small.pdf", ["Page 0", "Page 1", "Page 2"])
+
+    pages, page_count, info = extraction.extract_pages_supervised(path, max_chars=7)
+
+    assert pages == ["Page 0", "Page 1"]
+    assert info["status"] == extraction.STATUS_TRUNCATED
@@ -0,0 +1,58 @@
+from gemeos_common.feedback import FeedbackSelector, RejectedGoalIndex, diverse_sample, normalize_goal
+
+
+def test_filler_words_are_ignored():
+    assert normalize_goal("Students will be able to identify major triads") == normalize_goal("Identify major triad")
+
+
+def test_repeated_phrasings_use_one_slot():
+    goals = [
+        "Identify major triads",
+        "Identify the major triads",
+        "Students will identify major triads",
+        "Play a twelve bar blues",
+        "Explain swing rhythm",
+    ]
+
+    sample = diverse_sample(goals, 3)
+
+    assert len(sample) == 3
+    assert sum("triad" in goal for goal in sample) == 1
+    assert sample == [goal for goal in goals if goal in sample], "goals keep their original order"
+    assert diverse_sample(goals[:2], 5) == goals[:2]
+    assert diverse_sample(goals, 0) == []
+
+
+def test_the_prompt_sample_is_capped():
+    selector = FeedbackSelector(max_approved=2, max_rejected=1)
+    approved = [f"Approved goal about topic {word}" for word in ("harmony", "rhythm", "form", "melody")]
+    rejected = ["Memorize every chord", "Memorise every chords", "Learn music"]
+
+    prompt_approved, prompt_rejected = selector.prompt_feedback(approved, rejected)
+
+    assert len(prompt_approved) == 2
+    assert len(prompt_rejected) == 1
+    assert selector.stats()["approved_available"] == 4
+
+
+def test_near_duplicates_of_rejected_goals_are_dropped():
+    selector = FeedbackSelector()
+    goals = [
+        {"goal_description": "Students will be able to memorize every chord symbol"},
+        {"goal_description": "Memorize every chord symbols."},
+        {"goal_description": "Voice a dominant seventh chord in close position"},
+        {"goal_description": None},
+    ]
+
+    kept = selector.filter_rejected(goals, ["Memorize every chord symbol"])
+
+    assert kept == goals[2:]
+    assert selector.stats()["goals_dropped"] == 2
+    assert selector.filter_rejected(goals, []) == goals
+
+
+def test_unrelated_goals_do_not_match():
+    index = RejectedGoalIndex(["Memorize every chord symbol"])
+
+    assert index.match("Compose a melody over a blues progression") is None
+    assert index.match("memorize every chord symbol") == "Memorize every chord symbol"
@@ -0,0 +1,57 @@
+from gemeos_common.fewshot import ExampleSelector, count_tokens
+
+EXAMPLES = [
+    {"text": "Harmony: triads, seventh chords and their inversions.", "goal": "Build triads"},
+    {"text": "Rhythm: syncopation, swing feel and polyrhythms.", "goal": "Feel swing"},
+    {"text": "Form: the twelve bar blues and AABA song form.", "goal": "Play a blues"},
+]
+
+
+def render(example):
+    if not example.get("goal"):
+        return None
+    return f"Text: {example['text']}\nGoal: {example['goal']}\n\n"
+
+
+def test_the_most_similar_example_comes_first():
+    selector = ExampleSelector(render)
+
+    prefix = selector.select(EXAMPLES, "Swing rhythm and syncopation in bebop")
+
+    assert prefix.startswith(render(EXAMPLES[1]))
+    assert selector.select([], "anything") == ""
+
+
+def test_examples_are_packed_to_the_token_budget_and_cap():
+    one_example = count_tokens(render(EXAMPLES[0]))
+    selector = ExampleSelector(render, token_budget=one_example + 1)
+
+    assert selector.select(EXAMPLES, "Seventh chords and inversions") == render(EXAMPLES[0])
+
+    selector = ExampleSelector(render, max_examples=2)
+    assert selector.select(EXAMPLES, "Blues form").count("Goal:") == 2
+
+
+def test_examples_render_skips_are_left_out():
+    selector = ExampleSelector(render)
+
+    prefix = selector.select(EXAMPLES + [{"text": "No goal here"}], "No goal here")
+
+    assert "No goal here" not in prefix
+    assert selector.stats()["examples_available"] == 3
+
+
+def test_each_examples_list_is_indexed_once():
+    selector = ExampleSelector(render)
+
+    selector.select(EXAMPLES, "Swing")
+    selector.select(EXAMPLES, "Blues")
+    selector.select(list(EXAMPLES), "Blues")
+
+    assert selector.stats()["indexes_built"] == 2
+
+
+def test_count_tokens_counts_punctuation_separately():
+    assert count_tokens("") == 0
+    assert count_tokens("chord") == 2
+    assert count_tokens('{"a": 1}') == 7
@@ -0,0 +1,102 @@
+from google.api_core import exceptions as google_exceptions
+
+from gemeos_common.guidance import GuidanceCache
+
+
+class FakeBlob:
+    def __init__(self, storage, path):
+        self.storage = storage
+        self.path = path
+        self.generation = None
+        self.etag = None
+
+    def download_as_bytes(self, if_generation_not_match=None):
+        self.storage.downloads.append((self.path, if_generation_not_match))
+        if self.storage.unreachable:
+            raise ConnectionError("GCS unreachable")
+        if self.path not in self.storage.blobs:
+            raise google_exceptions.NotFound(self.path)
+        data, generation = self.storage.blobs[self.path]
+        if if_generation_not_match == generation:
+            raise google_exceptions.NotModified(self.path)
+        self.generation = generation
+        return data
+
+
+class FakeStorage:
+    def __init__(self, blobs):
+        self.blobs = blobs
+        self.downloads = []
+        self.unreachable = False
+
+    def bucket(self, name):
+        return self
+
+    def blob(self, path):
+        return FakeBlob(self, path)
+
+
+def cache_for(storage, **kwargs):
+    return GuidanceCache(lambda: storage, "guidance", **kwargs)
+
+
+def test_fresh_entries_are_served_without_gcs():
+    storage = FakeStorage({"jazz/guidance.md": (b"Be concise.", 1)})
+    cache = cache_for(storage)
+
+    assert cache.get_text("jazz", "jazz/guidance.md") == "Be concise."
+    assert cache.get_text("jazz", "jazz/guidance.md") == "Be concise."
+
+    assert len(storage.downloads) == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_stale_entries_revalidate_by_generation():
+    storage = FakeStorage({"jazz/examples.jsonl": (b'{"goal": "a"}\n{"goal": "b"}\n', 1)})
+    cache = cache_for(storage, ttl=0)
+
+    assert cache.get_jsonl("jazz", "jazz/examples.jsonl") == [{"goal": "a"}, {"goal": "b"}]
+    assert cache.get_jsonl("jazz", "jazz/examples.jsonl") == [{"goal": "a"}, {"goal": "b"}]
+    storage.blobs["jazz/examples.jsonl"] = (b'{"goal": "c"}\n', 2)
+    assert cache.get_jsonl("jazz", "jazz/examples.jsonl") == [{"goal": "c"}]
+
+    assert storage.downloads[1:] == [("jazz/examples.jsonl", 1), ("jazz/examples.jsonl", 1)]
+    stats = cache.stats()
+    assert stats["revalidated_unchanged"] == 1
+    assert stats["revalidated_changed"] == 1
+
+
+def test_missing_blobs_are_cached_as_negative_entries():
+    storage = FakeStorage({})
+    cache = cache_for(storage)
+
+    assert cache.get_text("jazz", "jazz/guidance.md") is None
+    assert cache.get_text("jazz", "jazz/guidance.md") is None
+
+    assert len(storage.downloads) == 1
+    assert cache.stats()["negative_hits"] == 1
+
+
+def test_the_cached_copy_is_served_while_gcs_is_unreachable():
+    storage = FakeStorage({"jazz/guidance.md": (b"Be concise.", 1)})
+    cache = cache_for(storage, ttl=0)
+    cache.get_text("jazz", "jazz/guidance.md")
+    storage.unreachable = True
+
+    assert cache.get_text("jazz", "jazz/guidance.md") == "Be concise."
+    assert cache.stats()["stale_served"] == 1
+
+
+def test_least_recently_used_entries_are_evicted():
+    storage = FakeStorage({f"jazz/{name}.md": (name.encode(), 1) for name in "abc"})
+    cache = cache_for(storage, max_entries=2)
+    cache.get_text("jazz", "jazz/a.md")
+    cache.get_text("jazz", "jazz/b.md")
+    cache.get_text("jazz", "jazz/a.md")
+    cache.get_text("jazz", "jazz/c.md")
+
+    cache.get_text("jazz", "jazz/a.md")
+    cache.get_text("jazz", "jazz/b.md")
+
+    assert [path for path, _ in storage.downloads] == ["jazz/a.md", "jazz/b.md", "jazz/c.md", "jazz/b.md"]
+    assert cache.stats()["evictions"] == 2
@@ -0,0 +1,105 @@
+import pytest
+
+
+class FakeQuery:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def select(self, columns):
+        return self
+
+    def in_(self, column, values):
+        self.rows = [row for row in self.rows if row["id"] in values]
+        return self
+
+    def eq(self, column, value):
+        return self
+
+    def execute(self):
+        return type("Response", (), {"data": self.rows})()
+
+
+class NoRpcSupabase:
+    """Supabase without the get_learning_goal_contexts function deployed."""
+
+    def __init__(self, tables):
+        self.tables = tables
+
+    def rpc(self, name, params):
+        raise RuntimeError(f"function {name} does not exist")
+
+    def table(self, name):
+        return FakeQuery(list(self.tables.get(name, [])))
+
+
+def context(concept_id):
+    return {"concept_id": concept_id, "name": f"Concept {concept_id}", "approved_goals": [], "rejected_goals": []}
+
+
+@pytest.fixture
+def batch_service(learning_goals, monkeypatch):
+    monkeypatch.setattr(learning_goals.ledger, "enabled", False)
+    saved = []
+    monkeypatch.setattr(learning_goals, "save_learning_goals_bulk", lambda goals: saved.append(goals) or len(goals))
+    learning_goals.saved = saved
+    return learning_goals
+
+
+def test_batch_regenerates_left_out_concepts_one_by_one(batch_service, monkeypatch):
+    calls = []
+
+    def generate(text, batch, guidance, examples, bypass_cache=False):
+        calls.append([c["concept_id"] for c in batch])
+        if len(batch) > 1:
+            return {"c1": ["Goal 1"]}
+        return {str(batch[0]["concept_id"]): [f"Goal for {batch[0]['concept_id']}"]}
+
+    monkeypatch.setattr(batch_service, "generate_learning_goals_batch_with_gemini", generate)
+    trace = batch_service.instrumentation.trace("batch")
+
+    batch_service.process_learning_goal_batch("file-1", "text", [context("c1"), context("c2")], None, [], "m-1", False, trace)
+
+    assert calls == [["c1", "c2"], ["c2"]]
+    assert batch_service.saved == [{"c1": ["Goal 1"], "c2": ["Goal for c2"]}]
+
+
+def test_batch_fails_without_saving_when_a_concept_stays_missing(batch_service, monkeypatch):
+    monkeypatch.setattr(
+        batch_service, "generate_learning_goals_batch_with_gemini",
+        lambda text, batch, guidance, examples, bypass_cache=False: {"c1": ["Goal 1"]} if len(batch) > 1 else {}
+    )
+    trace = batch_service.instrumentation.trace("batch")
+
+    with pytest.raises(RuntimeError, match="c2"):
+        batch_service.process_learning_goal_batch("file-1", "text", [context("c1"), context("c2")], None, [], "m-1", False, trace)
+
+    assert batch_service.saved == []
+
+
+def test_goals_by_concept_id_drops_unknown_and_malformed_entries(learning_goals):
+    response = '{"concepts": {"c1": ["Goal"], "c2": "not a list", "c3": ["Other"]}}'
+
+    assert learning_goals.goals_by_concept_id(response, {"c1": [], "c2": []}) == {"c1": ["Goal"]}
+    assert learning_goals.goals_by_concept_id("not json", {"c1": []}) == {}
+
+
+def test_batch_context_falls_back_without_the_rpc(learning_goals, monkeypatch):
+    supabase = NoRpcSupabase({
+        "concepts": [
+            {"id": "c1", "name": "Scales", "source_file_id": "f1"},
+            {"id": "c2", "name": "Modes", "source_file_id": "f1"},
+        ],
+        "domain_extracted_files": [
+            {"id": "f1", "extracted_text": "All about scales and modes.", "metadata_json": {}},
+        ],
+    })
+    monkeypatch.setattr(learning_goals, "get_supabase", lambda: supabase)
+    monkeypatch.setattr(learning_goals, "get_feedback_for_prompt", lambda concept_id: (["Approved"], []))
+
+    contexts, texts, passages = learning_goals.fetch_batch_context(["c1", "c2"])
+
+    assert [c["concept_id"] for c in contexts] == ["c1", "c2"]
+    assert contexts[0]["source_file_id"] == "f1"
+    assert contexts[0]["approved_goals"] == ["Approved"]
+    assert texts == {"f1": "All about scales and modes."}
+    assert passages == {}
@@ -0,0 +1,156 @@
+import pytest
+
+from gemeos_common.ledger import CLAIMED, DONE, IN_PROGRESS, RETRY_LATER, ProcessingLedger, skip_response
+
+
+class Response:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeLedgerDb:
+    """processing_ledger and claim_processing_work (see the migration), with a settable clock."""
+
+    def __init__(self):
+        self.rows = {}
+        self.now = 0.0
+        self.down = False
+
+    def rpc(self, name, params):
+        assert name == "claim_processing_work"
+        if self.down:
+            raise ConnectionError("Supabase unreachable")
+        return FakeCall(lambda: self.claim(**params))
+
+    def claim(self, p_work_key, p_service, p_message_id, p_lease_seconds, p_force):
+        row = self.rows.get(p_work_key)
+        if row is None or row["status"] == "failed" \
+                or (row["status"] == "in_progress" and row["lease_expires_at"] < self.now) \
+                or (row["status"] == "done" and p_force):
+            self.rows[p_work_key] = {
+                "service": p_service, "message_id": p_message_id, "status": "in_progress",
+                "lease_expires_at": self.now + p_lease_seconds,
+            }
+            return [{"outcome": "claimed", "holder_message_id": p_message_id}]
+        return [{"outcome": row["status"], "holder_message_id": row["message_id"]}]
+
+    def table(self, name):
+        assert name == "processing_ledger"
+        return FakeTable(self)
+
+
+class FakeCall:
+    def __init__(self, run):
+        self.run = run
+
+    def execute(self):
+        return Response(self.run())
+
+
+class FakeTable:
+    def __init__(self, db):
+        self.db = db
+        self.filters = {}
+        self.fields = None
+
+    def select(self, columns):
+        return self
+
+    def update(self, fields):
+        self.fields = fields
+        return self
+
+    def eq(self, column, value):
+        self.filters[column] = value
+        return self
+
+    def limit(self, count):
+        return self
+
+    def execute(self):
+        matches = [
+            (key, row) for key, row in self.db.rows.items()
+            if all((key if column == "work_key" else row.get(column)) == value for column, value in self.filters.items())
+        ]
+        if self.fields is not None:
+            for _, row in matches:
+                row.update(self.fields)
+        return Response([{"work_key": key} for key, _ in matches])
+
+
+@pytest.fixture
+def db():
+    return FakeLedgerDb()
+
+
+@pytest.fixture
+def ledger(db):
+    return ProcessingLedger(lambda: db, "concept-chunker", lease_seconds=600)
+
+
+def test_work_keys_depend_on_the_inputs(ledger):
+    key = ledger.work_key("file", "f1", "text", {"a": 1})
+
+    assert key.startswith("concept-chunker:file:f1:")
+    assert key == ledger.work_key("file", "f1", "text", {"a": 1})
+    assert key != ledger.work_key("file", "f1", "other text", {"a": 1})
+
+
+def test_completed_work_is_skipped(ledger):
+    key = ledger.work_key("file", "f1", "text")
+    outcome, lease = ledger.claim(key, "m-1")
+    ledger.complete(lease, {"concepts": 3})
+
+    assert outcome == CLAIMED
+    assert ledger.claim(key, "m-2") == (DONE, None)
+    assert ledger.seen_message("m-1")
+    assert not ledger.seen_message("m-2")
+    assert skip_response(DONE)[1] == 200
+
+
+def test_concurrent_deliveries_are_told_apart(ledger):
+    key = ledger.work_key("file", "f1", "text")
+    ledger.claim(key, "m-1")
+
+    assert ledger.claim(key, "m-2") == (IN_PROGRESS, None)
+    assert ledger.claim(key, "m-1") == (RETRY_LATER, None)
+    assert skip_response(IN_PROGRESS)[1] == 200
+    assert skip_response(RETRY_LATER)[1] == 409
+
+
+def test_failed_work_can_be_claimed_again(ledger, db):
+    key = ledger.work_key("file", "f1", "text")
+    _, lease = ledger.claim(key, "m-1")
+    ledger.fail(lease, RuntimeError("Gemini said no"))
+
+    assert db.rows[key]["last_error"] == "Gemini said no"
+    assert ledger.claim(key, "m-2")[0] == CLAIMED
+
+
+def test_an_expired_lease_can_be_taken_over(ledger, db):
+    key = ledger.work_key("file", "f1", "text")
+    _, stale = ledger.claim(key, "m-1")
+    db.now += 601
+
+    outcome, lease = ledger.claim(key, "m-2")
+    ledger.complete(stale)
+
+    assert outcome == CLAIMED
+    assert db.rows[key]["status"] == "in_progress", "only the lease holder may finish the work"
+    ledger.complete(lease)
+    assert db.rows[key]["status"] == "done"
+
+
+def test_force_reclaims_finished_work(ledger):
+    key = ledger.work_key("file", "f1", "text")
+    _, lease = ledger.claim(key, "m-1")
+    ledger.complete(lease)
+
+    assert ledger.claim(key, "m-2", force=True)[0] == CLAIMED
+
+
+def test_work_proceeds_unguarded_when_the_ledger_is_down(ledger, db):
+    db.down = True
+
+    assert ledger.claim("key", "m-1") == (CLAIMED, None)
+    assert ledger.stats()["errors"] == 1
@@ -0,0 +1,97 @@
+import itertools
+
+from gemeos_common import llm_cache
+from gemeos_common.llm_cache import ResponseCache, cache_key, cached_call, open_response_cache
+
+
+def counting(*responses):
+    """call() returning responses in turn, counting the calls."""
+    responses = list(responses)
+
+    def call():
+        call.count += 1
+        return responses.pop(0)
+
+    call.count = 0
+    return call
+
+
+def generate(cache, prompt, call, **kwargs):
+    return cache.generate("gemini", "system", prompt, {"temperature": 0.3}, call, **kwargs)
+
+
+def test_identical_calls_are_served_from_the_cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"))
+    call = counting('{"a": 1}', '{"a": 2}')
+
+    assert generate(cache, "prompt", call) == '{"a": 1}'
+    assert generate(cache, "prompt", call) == '{"a": 1}'
+
+    assert call.count == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_the_key_covers_model_prompt_and_config():
+    key = cache_key("gemini", "system", "prompt", {"temperature": 0.3})
+
+    assert key == cache_key("gemini", "system", "prompt", {"temperature": 0.3})
+    assert key != cache_key("gemini", "system", "prompt", {"temperature": 0.4})
+    assert key != cache_key("other", "system", "prompt", {"temperature": 0.3})
+
+
+def test_bypass_skips_the_read_but_stores_the_fresh_response(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"))
+    call = counting('{"a": 1}', '{"a": 2}')
+    generate(cache, "prompt", call)
+
+    assert generate(cache, "prompt", call, bypass=True) == '{"a": 2}'
+    assert generate(cache, "prompt", call) == '{"a": 2}'
+    assert call.count == 2
+
+
+def test_invalid_responses_are_not_stored(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"))
+    call = counting("not json", '{"a": 1}')
+
+    assert cached_call(cache, "gemini", "system", "prompt", {}, call) == "not json"
+    assert cached_call(cache, "gemini", "system", "prompt", {}, call) == '{"a": 1}'
+    assert call.count == 2
+
+
+def test_expired_entries_are_misses(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / "cache.db"), ttl=60)
+    now = [1000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now[0])
+    call = counting('{"a": 1}', '{"a": 2}')
+    generate(cache, "prompt", call)
+    now[0] += 61
+
+    assert generate(cache, "prompt", call) == '{"a": 2}'
+    assert call.count == 2
+
+
+def test_least_recently_used_responses_are_evicted_over_the_size_bound(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / "cache.db"), max_bytes=30)
+    clock = itertools.count(1000)
+    monkeypatch.setattr(llm_cache.time, "time", lambda: next(clock))
+    for prompt in ("a", "b", "c"):
+        generate(cache, prompt, counting('{"value": 10}'))
+
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["bytes"] <= 30
+    assert cache.get(cache_key("gemini", "system", "a", {"temperature": 0.3})) is None
+
+
+def test_the_cache_survives_a_restart(tmp_path):
+    path = str(tmp_path / "cache.db")
+    generate(ResponseCache(path), "prompt", counting('{"a": 1}'))
+
+    assert generate(ResponseCache(path), "prompt", counting('{"a": 2}')) == '{"a": 1}'
+
+
+def test_an_unusable_path_disables_caching(tmp_path):
+    (tmp_path / "file").write_text("")
+
+    assert open_response_cache(str(tmp_path / "file" / "cache.db"), 1024, 60) is None
+    assert cached_call(None, "gemini", "system", "prompt", {}, lambda: "fresh") == "fresh"
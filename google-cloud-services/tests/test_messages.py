@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from gemeos_common.messages import decode_extraction_request, encode_extraction_request, parse_text_ref, resolve_text
+
+
+def test_version_2_round_trip_points_at_stored_text():
+    data, attributes = encode_extraction_request("rec-1", "dom-1", "gs://b/f.pdf", "abc", {"pages": 3}, text_chars=42)
+
+    message = decode_extraction_request(data)
+
+    assert attributes["schema_version"] == "2"
+    assert "extracted_text" not in message
+    assert parse_text_ref(message["text_ref"]) == ("domain_extracted_files", "rec-1", "extracted_text")
+
+
+def test_version_1_keeps_inline_text():
+    data = json.dumps({"record_id": "rec-1", "domain_id": "dom-1", "extracted_text": "Scales and modes"})
+
+    message = decode_extraction_request(data)
+
+    assert message["version"] == 1
+    assert message["text_chars"] == len("Scales and modes")
+    assert resolve_text(message, supabase=None) == "Scales and modes"
+
+
+def test_unknown_version_is_rejected():
+    with pytest.raises(ValueError):
+        decode_extraction_request(json.dumps({"version": 9, "record_id": "rec-1"}))
+
+
+def test_chunker_reads_the_preprocessor_claim_check(chunker):
+    data, _ = encode_extraction_request(
+        "rec-1", "dom-1", "gs://b/f.pdf", "abc", {"pages": 3}, text_chars=42, domain_slug="jazz-music"
+    )
+
+    attrs, extraction_request = chunker.parse_request(data.decode("utf-8"))
+
+    assert (attrs["file_id"], attrs["domain_id"], attrs["domain_slug"]) == ("rec-1", "dom-1", "jazz-music")
+    assert extraction_request["text_ref"] == "supabase://domain_extracted_files/rec-1/extracted_text"
+
+
+def test_chunker_keeps_its_own_requests(chunker):
+    body = json.dumps({"file_id": "rec-1", "domain_id": "dom-1", "domain_slug": "jazz-music"})
+
+    assert chunker.parse_request(body) == (json.loads(body), None)
+
+
+class FakeDomains:
+    def __init__(self, names):
+        self.names = names
+        self.queries = 0
+        self.domain_id = None
+
+    def table(self, name):
+        assert name == "domains"
+        return self
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.domain_id = value
+        return self
+
+    def single(self):
+        return self
+
+    def execute(self):
+        self.queries += 1
+        return type("Result", (), {"data": {"name": self.names[self.domain_id]}})()
+
+
+def test_preprocessor_slugifies_the_domain_name_once(preprocessor):
+    supabase = FakeDomains({"dom-slug-test": "  Jazz Music & Theory "})
+
+    assert preprocessor.fetch_domain_slug(supabase, "dom-slug-test") == "jazz-music-theory"
+    assert preprocessor.fetch_domain_slug(supabase, "dom-slug-test") == "jazz-music-theory"
+    assert supabase.queries == 1
@@ -0,0 +1,90 @@
+import pytest
+
+from chunking import build_chunks
+from gemeos_common.passages import (
+    PassageIndex, PassageIndexCache, is_passage_index, split_passages, write_passage_index
+)
+
+PAGES = [
+    "Triads are built from stacked thirds.\n\nMajor and minor triads differ in the third.",
+    "Swing rhythm places the offbeat late.\n\nSyncopation accents weak beats.",
+    "The twelve bar blues repeats a chord progression.\n\nBlues scales add a flat fifth.",
+]
+
+
+class FakeBlob:
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    def upload_from_string(self, data, content_type=None):
+        self.store[self.name] = data
+
+    def download_as_bytes(self):
+        self.store["downloads"] = self.store.get("downloads", 0) + 1
+        return self.store[self.name]
+
+
+class FakeBucket:
+    name = "uploads"
+
+    def __init__(self):
+        self.store = {}
+
+    def blob(self, name):
+        return FakeBlob(self.store, name)
+
+
+class FakeStorage:
+    def __init__(self, bucket):
+        self._bucket = bucket
+
+    def bucket(self, name):
+        return self._bucket
+
+
+@pytest.fixture
+def index():
+    return PassageIndex.build(build_chunks(PAGES), target_chars=30)
+
+
+def test_passages_keep_their_page_and_offset():
+    chunks = build_chunks(PAGES)
+    text = "\n".join(PAGES)
+
+    passages = split_passages(chunks, target_chars=30)
+
+    assert len(passages) == 6
+    for page, start, passage in passages:
+        assert text[start:start + len(passage)] == passage
+    assert passages[-1][0] == 3
+
+
+def test_search_ranks_the_matching_passage_first(index):
+    [(score, pid)] = index.search("Swing rhythms", k=1)
+
+    assert index.passages[pid][2].startswith("Swing rhythm")
+    assert index.search("counterpoint") == []
+
+
+def test_selected_text_is_in_document_order_within_the_budget(index):
+    selected = index.select_text(["blues scale", "stacked thirds"], k=1)
+
+    assert selected == "Triads are built from stacked thirds.\n\nBlues scales add a flat fifth."
+    assert index.select_text(["counterpoint"]) is None
+    assert len(index.select_text(["triads", "blues", "swing"], max_chars=60)) <= 60
+
+
+def test_the_stored_index_round_trips_through_the_cache(index):
+    bucket = FakeBucket()
+    pointer = write_passage_index(bucket, "domain/book.pdf", index)
+    cache = PassageIndexCache(lambda: FakeStorage(bucket))
+
+    loaded = cache.get(pointer["uri"])
+    cache.get(pointer["uri"])
+
+    assert is_passage_index(pointer["uri"])
+    assert pointer["count"] == len(index.passages)
+    assert loaded.search("syncopation") == index.search("syncopation")
+    assert bucket.store["downloads"] == 1
+    assert cache.stats()["hits"] == 1
@@ -0,0 +1,69 @@
+from concurrent.futures import Future
+
+
+class FakeTable:
+    def __init__(self, updates):
+        self.updates = updates
+
+    def update(self, values):
+        self.updates.append(values)
+        return self
+
+    def eq(self, column, value):
+        return self
+
+    def execute(self):
+        return None
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.updates = []
+
+    def table(self, name):
+        assert name == "domain_extracted_files"
+        return FakeTable(self.updates)
+
+
+class FakePublisherClient:
+    def topic_path(self, project, topic):
+        return f"projects/{project}/topics/{topic}"
+
+    def publish(self, topic, data, **attributes):
+        future = Future()
+        future.set_result("message-1")
+        return future
+
+
+def test_sync_publish_records_the_confirmed_message(preprocessor, monkeypatch):
+    monkeypatch.setattr(preprocessor, "PUBLISH_MODE", "sync")
+    monkeypatch.setattr(preprocessor, "publisher_client", FakePublisherClient())
+    supabase = FakeSupabase()
+    metadata = {"pages": 3}
+
+    message_id = preprocessor.publish_extraction_request(
+        "rec-1", "dom-1", "gs://b/f.pdf", "abc", metadata, text_chars=10, domain_slug="jazz",
+        on_published=lambda confirmed: preprocessor.mark_published(supabase, "rec-1", metadata, confirmed)
+    )
+
+    assert message_id == "message-1"
+    [update] = supabase.updates
+    assert update["metadata_json"]["pages"] == 3
+    assert update["metadata_json"]["published"]["message_id"] == "message-1"
+
+
+def test_failed_publish_records_nothing(preprocessor, monkeypatch):
+    class BrokenClient(FakePublisherClient):
+        def publish(self, topic, data, **attributes):
+            raise RuntimeError("permission denied")
+
+    monkeypatch.setattr(preprocessor, "PUBLISH_MODE", "sync")
+    monkeypatch.setattr(preprocessor, "publisher_client", BrokenClient())
+    supabase = FakeSupabase()
+
+    message_id = preprocessor.publish_extraction_request(
+        "rec-1", "dom-1", "gs://b/f.pdf", "abc", {}, on_published=lambda confirmed: supabase.updates.append(confirmed)
+    )
+
+    assert message_id is None
+    assert supabase.updates == []
@@ -0,0 +1,79 @@
+from concurrent.futures import Future
+
+import pytest
+
+from publishing import AsyncPublisher
+
+
+class FailingClient:
+    def __init__(self, fail_topics):
+        self.fail_topics = fail_topics
+        self.calls = []
+
+    def publish(self, topic, data, **attributes):
+        self.calls.append(topic)
+        if topic in self.fail_topics:
+            raise RuntimeError("client closed")
+        future = Future()
+        future.set_result("message-id")
+        return future
+
+
+def test_client_error_is_raised_and_not_left_in_flight():
+    publisher = AsyncPublisher(FailingClient({"topic"}), "topic")
+
+    with pytest.raises(RuntimeError):
+        publisher.publish(b"payload", file_id="f1")
+
+    assert publisher.stats()["in_flight"] == 0
+    assert publisher.flush(timeout=0.1)
+
+
+def test_retry_that_client_rejects_goes_to_dead_letter():
+    client = FailingClient({"topic"})
+    publisher = AsyncPublisher(client, "topic", "dead-letter", max_attempts=2, retry_base_delay=0.01)
+    failed = Future()
+    failed.set_exception(RuntimeError("deadline exceeded"))
+
+    publisher._in_flight += 1
+    publisher._on_done(failed, 0, b"payload", 1, {"file_id": "f1"})
+
+    assert publisher.flush(timeout=1)
+    stats = publisher.stats()
+    assert stats["failed_attempts"] == 2
+    assert stats["dead_lettered"] == 1
+    assert client.calls == ["topic", "dead-letter"]
+
+
+def test_dead_letter_client_error_is_not_left_in_flight():
+    publisher = AsyncPublisher(FailingClient({"topic", "dead-letter"}), "topic", "dead-letter", max_attempts=1)
+
+    publisher._dead_letter(b"payload", {"file_id": "f1"}, RuntimeError("deadline exceeded"))
+
+    assert publisher.flush(timeout=0.1)
+    assert publisher.stats()["dead_letter_failed"] == 1
+
+
+class FlakyClient:
+    def __init__(self, failures):
+        self.failures = failures
+
+    def publish(self, topic, data, **attributes):
+        future = Future()
+        if self.failures:
+            self.failures -= 1
+            future.set_exception(RuntimeError("unavailable"))
+        else:
+            future.set_result("message-7")
+        return future
+
+
+def test_on_published_runs_once_the_retry_is_confirmed():
+    publisher = AsyncPublisher(FlakyClient(failures=1), "topic", max_attempts=3, retry_base_delay=0.01)
+    confirmed = []
+
+    publisher.publish(b"payload", on_published=confirmed.append, file_id="f1")
+
+    assert publisher.flush(timeout=1)
+    assert confirmed == ["message-7"]
+    assert publisher.stats()["retried"] == 1
@@ -0,0 +1,95 @@
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from gemeos_common import ratelimit
+from gemeos_common.ratelimit import RateLimiter, RateLimitExceeded, TokenBucket, retry_hint_seconds
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(ratelimit.time, "sleep", slept.append)
+    return slept
+
+
+def flaky(errors, result="ok"):
+    """fn() that raises each of errors in turn, then returns result."""
+    errors = list(errors)
+    calls = []
+
+    def fn():
+        calls.append(len(calls))
+        if errors:
+            raise errors.pop(0)
+        return result
+
+    fn.calls = calls
+    return fn
+
+
+def test_bucket_charges_debt_as_wait_time():
+    bucket = TokenBucket(rate=1.0, capacity=2)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(1.0, abs=0.05)
+
+
+def test_calls_over_the_wait_budget_fail_fast_and_refund(sleeps):
+    limiter = RateLimiter(requests_per_minute=6, max_wait=5)
+    limiter.call(lambda: "ok")
+
+    with pytest.raises(RateLimitExceeded):
+        limiter.call(lambda: "ok")
+
+    assert sleeps == []
+    assert limiter.stats()["wait_budget_exceeded"] == 1
+    assert limiter.requests._tokens == pytest.approx(0, abs=0.01)
+
+
+def test_retryable_errors_back_off_and_retry(sleeps):
+    limiter = RateLimiter(requests_per_minute=600, base_delay=1.0)
+    fn = flaky([google_exceptions.ServiceUnavailable("busy"), google_exceptions.InternalServerError("oops")])
+
+    assert limiter.call(fn) == "ok"
+
+    assert len(fn.calls) == 3
+    assert len(sleeps) == 2 and sleeps[0] <= 1.0 and sleeps[1] <= 2.0
+    assert limiter.stats()["retries"] == 2
+
+
+def test_a_server_retry_hint_pauses_every_caller(sleeps):
+    limiter = RateLimiter(requests_per_minute=600)
+    fn = flaky([google_exceptions.ResourceExhausted("Quota exceeded, please retry in 2.5s")])
+
+    assert limiter.call(fn) == "ok"
+
+    assert sleeps[0] == 2.5
+    assert limiter.requests.reserve() > 2
+    assert limiter.stats()["server_hints"] == 1
+
+
+def test_retries_run_out(sleeps):
+    limiter = RateLimiter(requests_per_minute=600, max_attempts=2)
+    fn = flaky([google_exceptions.ServiceUnavailable("busy")] * 2)
+
+    with pytest.raises(RateLimitExceeded):
+        limiter.call(fn)
+
+    assert len(fn.calls) == 2
+    assert limiter.stats()["failures"] == 1
+
+
+def test_other_errors_are_not_retried(sleeps):
+    limiter = RateLimiter(requests_per_minute=600)
+    fn = flaky([ValueError("bad request")])
+
+    with pytest.raises(ValueError):
+        limiter.call(fn)
+
+    assert len(fn.calls) == 1
+
+
+def test_retry_hint_from_the_error_message():
+    assert retry_hint_seconds(Exception("Please retry in 12s")) == 12.0
+    assert retry_hint_seconds(Exception("Nope")) is None
@@ -0,0 +1,36 @@
+import json
+
+from structuring import structure_hierarchically
+
+GUIDANCE = "Structure these concepts."
+
+
+def _names(count):
+    return [f"Concept {i}" for i in range(count)]
+
+
+def test_unlinked_clusters_stop_instead_of_recursing():
+    calls = []
+
+    def empty_model(prompt):
+        calls.append(prompt)
+        return []
+
+    names = _names(400)
+    hierarchy = structure_hierarchically(names, GUIDANCE, empty_model, max_cluster_size=50)
+
+    assert len(calls) == 8
+    assert [entry["concept"] for entry in hierarchy] == names
+    assert all(entry["parent"] is None for entry in hierarchy)
+
+
+def test_cluster_roots_are_linked():
+    def model(prompt):
+        names = json.loads(prompt[prompt.rindex("\n[") + 1:])
+        return [{"concept": name, "parent": names[0] if name != names[0] else None} for name in names]
+
+    names = _names(120)
+    hierarchy = structure_hierarchically(names, GUIDANCE, model, max_cluster_size=50)
+
+    roots = [entry["concept"] for entry in hierarchy if entry["parent"] is None]
+    assert len(roots) == 1
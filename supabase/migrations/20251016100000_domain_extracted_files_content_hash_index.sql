@@ -0,0 +1,13 @@
+-- ============================================================
+-- CONTENT-HASH DEDUP LOOKUPS FOR THE PREPROCESSOR
+-- ============================================================
+-- The preprocessor hashes every upload before extracting it and looks for
+-- an existing record with the same content_hash to reuse. Index the hash so
+-- that lookup stays cheap as domain_extracted_files grows.
+
+ALTER TABLE public.domain_extracted_files
+    ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_domain_extracted_files_content_hash
+    ON public.domain_extracted_files (content_hash)
+    WHERE content_hash IS NOT NULL;
@@ -0,0 +1,82 @@
+-- ============================================================
+-- PROCESSING LEDGER FOR THE GEMINI PUB/SUB SERVICES
+-- ============================================================
+-- Pub/Sub redelivers a push message whenever the handler does not return
+-- 2xx (or takes too long), and the same logical work can also be published
+-- twice. The concept chunker, concept structurer and learning-goal
+-- generator record each unit of work here before calling Gemini, so a
+-- duplicate or concurrent delivery is acknowledged without repeating the
+-- call or inserting duplicate rows.
+--
+-- work_key is "<service>:<entity kind>:<entity id>:<input hash>". A claim is
+-- a lease: if the worker holding it dies, another delivery may take the work
+-- over once lease_expires_at has passed.
+
+CREATE TABLE IF NOT EXISTS public.processing_ledger (
+    work_key TEXT PRIMARY KEY,
+    service TEXT NOT NULL,
+    message_id TEXT,
+    status TEXT NOT NULL CHECK (status IN ('in_progress', 'done', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 1,
+    lease_expires_at TIMESTAMPTZ,
+    last_error TEXT,
+    result JSONB,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    completed_at TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_processing_ledger_message_id
+    ON public.processing_ledger (message_id)
+    WHERE message_id IS NOT NULL;
+
+-- Only the services (service role) touch the ledger
+ALTER TABLE public.processing_ledger ENABLE ROW LEVEL SECURITY;
+
+-- Atomically claim a unit of work.
+-- Returns 'claimed' when the caller now holds the lease, otherwise the
+-- current holder's state: 'done' or 'in_progress' (with its message_id).
+-- Failed work and expired leases can always be reclaimed; p_force also
+-- reclaims finished work (explicit reprocessing).
+CREATE OR REPLACE FUNCTION public.claim_processing_work(
+    p_work_key TEXT,
+    p_service TEXT,
+    p_message_id TEXT,
+    p_lease_seconds INTEGER,
+    p_force BOOLEAN DEFAULT FALSE
+)
+RETURNS TABLE (outcome TEXT, holder_message_id TEXT)
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    INSERT INTO public.processing_ledger AS l
+        (work_key, service, message_id, status, lease_expires_at)
+    VALUES
+        (p_work_key, p_service, p_message_id, 'in_progress', now() + make_interval(secs => p_lease_seconds))
+    ON CONFLICT (work_key) DO UPDATE
+        SET status = 'in_progress',
+            message_id = EXCLUDED.message_id,
+            lease_expires_at = EXCLUDED.lease_expires_at,
+            attempts = l.attempts + 1,
+            last_error = NULL,
+            updated_at = now()
+        WHERE l.status = 'failed'
+           OR (l.status = 'in_progress' AND l.lease_expires_at < now())
+           OR (l.status = 'done' AND p_force);
+
+    IF FOUND THEN
+        RETURN QUERY SELECT 'claimed'::TEXT, p_message_id;
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+        SELECT l.status, l.message_id
+        FROM public.processing_ledger l
+        WHERE l.work_key = p_work_key;
+END;
+$$;
+
+REVOKE ALL ON FUNCTION public.claim_processing_work(TEXT, TEXT, TEXT, INTEGER, BOOLEAN) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.claim_processing_work(TEXT, TEXT, TEXT, INTEGER, BOOLEAN) TO service_role;
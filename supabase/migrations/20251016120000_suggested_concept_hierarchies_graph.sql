@@ -0,0 +1,15 @@
+-- ============================================================
+-- PRECOMPUTED CONCEPT GRAPH FOR SUGGESTED HIERARCHIES
+-- ============================================================
+-- The concept structurer validates Gemini's [{concept, parent}] list
+-- against the domain's approved concepts before saving it: names are
+-- resolved to concept IDs, cycles are broken and missing concepts added as
+-- roots. Alongside the (repaired) suggested_structure it now stores the
+-- graph with topological order, depth, ancestor and child IDs per concept,
+-- so learning-path queries read them instead of walking the JSON.
+
+ALTER TABLE public.suggested_concept_hierarchies
+    ADD COLUMN IF NOT EXISTS graph JSONB;
+
+COMMENT ON COLUMN public.suggested_concept_hierarchies.graph IS
+    'Validated concept graph: {version, roots, max_depth, nodes: [{id, name, parent_id, depth, order, ancestor_ids, child_ids}], issues}';
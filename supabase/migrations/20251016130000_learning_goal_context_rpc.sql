@@ -0,0 +1,40 @@
+-- ============================================================
+-- SINGLE ROUND-TRIP CONTEXT FOR LEARNING-GOAL GENERATION
+-- ============================================================
+-- The learning-goal generator needs, per concept: the extracted text of the
+-- concept's source file and the approved and rejected goals already on the
+-- concept (feedback for the prompt). That used to take four sequential
+-- queries; this function returns all of it in one call.
+
+CREATE INDEX IF NOT EXISTS idx_learning_goals_concept_status
+    ON public.learning_goals (concept_id, status);
+
+CREATE OR REPLACE FUNCTION public.get_learning_goal_context(p_concept_id UUID)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+    SELECT jsonb_build_object(
+        'concept_id', c.id,
+        'source_file_id', c.source_file_id,
+        'extracted_text', f.extracted_text,
+        'approved_goals', COALESCE((
+            SELECT jsonb_agg(g.goal_description ORDER BY g.created_at)
+            FROM public.learning_goals g
+            WHERE g.concept_id = c.id AND g.status = 'approved'
+        ), '[]'::jsonb),
+        'rejected_goals', COALESCE((
+            SELECT jsonb_agg(g.goal_description ORDER BY g.created_at)
+            FROM public.learning_goals g
+            WHERE g.concept_id = c.id AND g.status = 'rejected'
+        ), '[]'::jsonb)
+    )
+    FROM public.concepts c
+    LEFT JOIN public.domain_extracted_files f ON f.id = c.source_file_id
+    WHERE c.id = p_concept_id;
+$$;
+
+REVOKE ALL ON FUNCTION public.get_learning_goal_context(UUID) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.get_learning_goal_context(UUID) TO service_role;
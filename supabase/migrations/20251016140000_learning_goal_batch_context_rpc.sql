@@ -0,0 +1,50 @@
+-- ============================================================
+-- BATCH CONTEXT FOR LEARNING-GOAL GENERATION
+-- ============================================================
+-- Batch counterpart of get_learning_goal_context: the learning-goal
+-- generator groups concepts by source file and sends each file's text to
+-- Gemini once for all of its concepts. Returns every concept's name, source
+-- file and feedback goals, and each source file's text exactly once.
+
+CREATE OR REPLACE FUNCTION public.get_learning_goal_contexts(p_concept_ids UUID[])
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+    WITH selected AS (
+        SELECT c.id, c.name, c.source_file_id
+        FROM public.concepts c
+        WHERE c.id = ANY(p_concept_ids)
+    )
+    SELECT jsonb_build_object(
+        'concepts', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object(
+                'concept_id', s.id,
+                'name', s.name,
+                'source_file_id', s.source_file_id,
+                'approved_goals', COALESCE((
+                    SELECT jsonb_agg(g.goal_description ORDER BY g.created_at)
+                    FROM public.learning_goals g
+                    WHERE g.concept_id = s.id AND g.status = 'approved'
+                ), '[]'::jsonb),
+                'rejected_goals', COALESCE((
+                    SELECT jsonb_agg(g.goal_description ORDER BY g.created_at)
+                    FROM public.learning_goals g
+                    WHERE g.concept_id = s.id AND g.status = 'rejected'
+                ), '[]'::jsonb)
+            ))
+            FROM selected s
+        ), '[]'::jsonb),
+        'texts', COALESCE((
+            SELECT jsonb_object_agg(f.id, f.extracted_text)
+            FROM public.domain_extracted_files f
+            WHERE f.id IN (SELECT source_file_id FROM selected)
+              AND f.extracted_text IS NOT NULL
+        ), '{}'::jsonb)
+    );
+$$;
+
+REVOKE ALL ON FUNCTION public.get_learning_goal_contexts(UUID[]) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.get_learning_goal_contexts(UUID[]) TO service_role;
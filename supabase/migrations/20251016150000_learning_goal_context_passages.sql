@@ -0,0 +1,82 @@
+-- ============================================================
+-- PASSAGE INDEX POINTERS IN THE LEARNING-GOAL CONTEXT
+-- ============================================================
+-- The preprocessor now writes a BM25 passage index per file and records it
+-- in domain_extracted_files.metadata_json->'passages'. The learning-goal
+-- generator queries it with the concept name, so both context functions
+-- also return the concept name and the index URI.
+
+CREATE OR REPLACE FUNCTION public.get_learning_goal_context(p_concept_id UUID)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+    SELECT jsonb_build_object(
+        'concept_id', c.id,
+        'name', c.name,
+        'source_file_id', c.source_file_id,
+        'extracted_text', f.extracted_text,
+        'passages_uri', f.metadata_json -> 'passages' ->> 'uri',
+        'approved_goals', COALESCE((
+            SELECT jsonb_agg(g.goal_description ORDER BY g.created_at)
+            FROM public.learning_goals g
+            WHERE g.concept_id = c.id AND g.status = 'approved'
+        ), '[]'::jsonb),
+        'rejected_goals', COALESCE((
+            SELECT jsonb_agg(g.goal_description ORDER BY g.created_at)
+            FROM public.learning_goals g
+            WHERE g.concept_id = c.id AND g.status = 'rejected'
+        ), '[]'::jsonb)
+    )
+    FROM public.concepts c
+    LEFT JOIN public.domain_extracted_files f ON f.id = c.source_file_id
+    WHERE c.id = p_concept_id;
+$$;
+
+CREATE OR REPLACE FUNCTION public.get_learning_goal_contexts(p_concept_ids UUID[])
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+    WITH selected AS (
+        SELECT c.id, c.name, c.source_file_id
+        FROM public.concepts c
+        WHERE c.id = ANY(p_concept_ids)
+    )
+    SELECT jsonb_build_object(
+        'concepts', COALESCE((
+            SELECT jsonb_agg(jsonb_build_object(
+                'concept_id', s.id,
+                'name', s.name,
+                'source_file_id', s.source_file_id,
+                'approved_goals', COALESCE((
+                    SELECT jsonb_agg(g.goal_description ORDER BY g.created_at)
+                    FROM public.learning_goals g
+                    WHERE g.concept_id = s.id AND g.status = 'approved'
+                ), '[]'::jsonb),
+                'rejected_goals', COALESCE((
+                    SELECT jsonb_agg(g.goal_description ORDER BY g.created_at)
+                    FROM public.learning_goals g
+                    WHERE g.concept_id = s.id AND g.status = 'rejected'
+                ), '[]'::jsonb)
+            ))
+            FROM selected s
+        ), '[]'::jsonb),
+        'texts', COALESCE((
+            SELECT jsonb_object_agg(f.id, f.extracted_text)
+            FROM public.domain_extracted_files f
+            WHERE f.id IN (SELECT source_file_id FROM selected)
+              AND f.extracted_text IS NOT NULL
+        ), '{}'::jsonb),
+        'passages', COALESCE((
+            SELECT jsonb_object_agg(f.id, f.metadata_json -> 'passages' ->> 'uri')
+            FROM public.domain_extracted_files f
+            WHERE f.id IN (SELECT source_file_id FROM selected)
+              AND f.metadata_json -> 'passages' ->> 'uri' IS NOT NULL
+        ), '{}'::jsonb)
+    );
+$$;